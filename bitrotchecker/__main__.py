@@ -1,59 +1,340 @@
+import argparse
 import os
+import signal
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Dict, Tuple
 
 import requests
 
-from bitrotchecker.src.configuration_util import get_healthcheck_url, get_mutable_paths, get_immutable_paths
+from bitrotchecker.src.change_queue import ChangeQueue, walk_changes
+from bitrotchecker.src.change_watcher import ChangeWatcher, is_supported
+from bitrotchecker.src.checksum_checkpoint_util import ChecksumCheckpointUtil
+from bitrotchecker.src.configuration_util import (
+    get_healthcheck_url,
+    get_mutable_paths,
+    get_immutable_paths,
+    get_workers_per_device,
+    get_metrics_textfile_path,
+)
+from bitrotchecker.src.constants import (
+    BUDGETED_RECENCY_RETENTION_DAYS,
+    METRICS_TEXTFILE_NAME,
+    METRICS_JSON_FILE_NAME,
+    PROGRESS_TOTALS_FILE_NAME,
+    DAEMON_CYCLE_PAUSE_SECONDS,
+)
+from bitrotchecker.src.daemon_util import DaemonConfig, DaemonStatus, start_status_server
+from bitrotchecker.src.database_indexes import check_query_plans
 from bitrotchecker.src.file_processor import FileProcessor
+from bitrotchecker.src.file_util import walk_files
+from bitrotchecker.src.io_throttle import IO_THROTTLE, install_reload_signal_handler
 from bitrotchecker.src.logger_util import LoggerUtil
 from bitrotchecker.src.mongo_util import MongoUtil
+from bitrotchecker.src.processing_summary import ProcessingSummary
+from bitrotchecker.src.progress_reporter import ProgressReporter, load_previous_totals, save_totals
 from bitrotchecker.src.recency_util import RecencyUtil
+from bitrotchecker.src.run_metrics import METRICS
+from bitrotchecker.src.run_profiler import RunProfiler
+from bitrotchecker.src.verification_scheduler import VerificationScheduler, BYTES_IN_A_GIB
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Checks files for bit rot.")
+    parser.add_argument(
+        "--byte-budget-gib",
+        type=float,
+        help="Only verify this many GiB, starting with the files that have gone the longest without verification",
+    )
+    parser.add_argument(
+        "--time-budget-hours",
+        type=float,
+        help="Stop starting new files after this many hours, starting with the files that have gone the longest"
+        " without verification",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="Profile the run and write the profile to the logs directory"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print a line for every file instead of only the progress of the run"
+    )
+    parser.add_argument(
+        "--count-first",
+        action="store_true",
+        help="Count the files before processing them, for a more accurate estimate of the time left."
+        " Otherwise the totals of the previous run are used.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running, verifying files in a cycle every DAEMON_CYCLE_PAUSE_SECONDS within the configured active"
+        " hours, and serve the status on a local port",
+    )
+    return parser.parse_args()
+
+
+def _get_device_workers(workers_per_device: Dict[str, int]) -> Dict[int, int]:
+    """
+    Converts the configured number of workers for the device of each path into the number of workers by device.
+    """
+    return {os.stat(path).st_dev: num_workers for path, num_workers in workers_per_device.items()}
+
+
+def _count_files(paths: List[str]) -> Tuple[int, int]:
+    """
+    Returns the number of files and bytes in the paths, without reading any of the files.
+    """
+    num_files = 0
+    num_bytes = 0
+    for path in paths:
+        print(f"Counting files in {path}...")
+        for file_entry in walk_files(path):
+            num_files += 1
+            num_bytes += file_entry.stat().st_size
+    return num_files, num_bytes
+
+
+def _print_summary(name: str, summary: ProcessingSummary):
+    print(f"\nSuccesses in {name}: {summary.successes}")
+    print(f"Failures in {name}:  {summary.failures}")
+    print(f"Skips in {name}:  {summary.skips}")
+
+
+def _process_queued_changes(
+    file_processor: FileProcessor, change_queue: ChangeQueue, mutable_paths: List[str], deadline: Optional[float]
+) -> Dict[str, ProcessingSummary]:
+    """
+    Processes the files that the change watcher has queued under the mutable paths, and removes them from the queue.
+    Returns the summary of each path with queued changes.
+    """
+    queued_changes = [changes for changes in map(change_queue.get_changes, mutable_paths) if changes]
+    if not queued_changes:
+        return {}
+
+    print("\n==========================================")
+    print(f"Processing {sum(map(len, queued_changes))} queued changes...\n")
+    summaries = file_processor.process_paths(
+        [(changes.root, walk_changes(changes), False) for changes in queued_changes], deadline
+    )
+    # Changes that were not processed before the deadline, or that may not have been recorded because of an
+    # exception, stay queued for the next run
+    if file_processor.exceptions_logged:
+        print(f"Keeping the queued changes as {file_processor.exceptions_logged} exceptions were logged")
+    elif not file_processor.deadline_reached:
+        for changes in queued_changes:
+            change_queue.remove_changes(changes)
+
+    for path, summary in summaries.items():
+        _print_summary(f"changes in {path}", summary)
+    return summaries
+
+
+def _process_budgeted(
+    file_processor: FileProcessor,
+    recency_util: RecencyUtil,
+    logger: LoggerUtil,
+    all_paths: List[str],
+    immutable_paths: List[str],
+    byte_budget_gib: Optional[float],
+    time_budget_hours: Optional[float],
+    deadline: Optional[float],
+) -> ProcessingSummary:
+    # Finding the files counts towards the time budget
+    if time_budget_hours is not None:
+        budget_deadline = time.monotonic() + time_budget_hours * 60 * 60
+        deadline = budget_deadline if deadline is None else min(deadline, budget_deadline)
+
+    max_bytes = None if byte_budget_gib is None else int(byte_budget_gib * BYTES_IN_A_GIB)
+    scheduler = VerificationScheduler(recency_util, max_bytes=max_bytes)
+    for path in all_paths:
+        print(f"Finding files in {path}...")
+        scheduler.add_files(path, walk_files(path), path in immutable_paths)
+
+    # The byte budget is the total of the files picked here, so the progress and time left are measured from now,
+    # without the time spent finding the files
+    if file_processor.progress_reporter is not None:
+        file_processor.progress_reporter.start()
+    print("\n==========================================")
+    print("Processing the files that have gone the longest without verification...\n")
+    summary = file_processor.process_scheduled_files(scheduler.get_files_to_verify(), deadline)
+    _print_summary("budgeted run", summary)
+
+    print("\n===================================")
+    for line in scheduler.get_report():
+        logger.write(line)
+
+    return summary
+
+
+def _write_metrics(start_time: float, file_processor: FileProcessor):
+    METRICS.set_gauge("last_run_timestamp_seconds", time.time())
+    METRICS.set_gauge("last_run_duration_seconds", time.monotonic() - start_time)
+    METRICS.set_gauge("last_run_failures", len(file_processor.failed_files))
+    for stage_metrics in file_processor.stage_metrics:
+        METRICS.set_gauge("stage_busy_seconds", stage_metrics.busy_seconds, stage=stage_metrics.name)
+        METRICS.set_gauge("stage_max_queue_depth", stage_metrics.max_queue_depth, stage=stage_metrics.name)
+
+    metrics_textfile_path = get_metrics_textfile_path() or os.path.join("logs", METRICS_TEXTFILE_NAME)
+    metrics_json_path = os.path.join("logs", METRICS_JSON_FILE_NAME)
+    METRICS.write_prometheus_textfile(metrics_textfile_path)
+    METRICS.write_json(metrics_json_path)
+    print(f"Wrote metrics to {metrics_textfile_path} and {metrics_json_path}")
 
 
 def main():
-    mongo_util = MongoUtil()
-    recency_util = RecencyUtil()
+    args = _parse_args()
+    os.makedirs("logs", exist_ok=True)
+
+    if not args.profile:
+        _run(args)
+        return
+
+    profile_file_name = f"profile {datetime.now()}.pstats".replace(":", "_")
+    with RunProfiler(os.path.join("logs", profile_file_name)):
+        _run(args)
+
+
+def _run(args: argparse.Namespace):
+    # Read limits can be changed while running by editing the configuration file and sending SIGHUP
+    IO_THROTTLE.reload_from_config()
+    install_reload_signal_handler()
 
-    # Clean recency util so it does not balloon forever
-    recency_util.clean_records()
+    mongo_util = MongoUtil(verbose=args.verbose)
+    check_query_plans(mongo_util.files_collection)
+    recency_util = RecencyUtil()
+    recency_util.import_legacy_pickle()
+    change_queue = ChangeQueue()
 
     # To get data on the current database, uncomment next line
     # mongo_util.get_size_of_documents()
 
-    immutable_paths = get_immutable_paths()
-    mutable_paths = get_mutable_paths()
+    if args.daemon:
+        _run_daemon(args, mongo_util, recency_util, change_queue)
+        return
+
+    summary = _run_cycle(
+        args,
+        mongo_util,
+        recency_util,
+        change_queue,
+        get_immutable_paths(),
+        get_mutable_paths(),
+        get_workers_per_device(),
+    )
+    _ping_healthcheck(get_healthcheck_url(), summary.failures)
+
+
+def _run_cycle(
+    args: argparse.Namespace,
+    mongo_util: MongoUtil,
+    recency_util: RecencyUtil,
+    change_queue: ChangeQueue,
+    immutable_paths: List[str],
+    mutable_paths: List[str],
+    workers_per_device: Dict[str, int],
+    deadline: Optional[float] = None,
+    daemon_status: Optional[DaemonStatus] = None,
+) -> ProcessingSummary:
+    """
+    Processes the queued changes and then every path, or the files picked for a budgeted run.
+    No more files are started once the time.monotonic() deadline has passed.
+    Returns the totals of the run.
+    """
+    start_time = time.monotonic()
+    is_budgeted = args.byte_budget_gib is not None or args.time_budget_hours is not None
+
+    # Clean recency util so it does not balloon forever.
+    # Budgeted runs order files by their last verification, so they keep records for longer.
+    if is_budgeted:
+        recency_util.clean_records(BUDGETED_RECENCY_RETENTION_DAYS)
+    else:
+        recency_util.clean_records()
+
     all_paths = immutable_paths + mutable_paths
 
     total_successes = 0
     total_skips = 0
-    os.makedirs("logs", exist_ok=True)
+
+    # Budgeted runs only go as far as their byte budget, so a full run's totals would not apply to them
+    progress_totals_path = os.path.join("logs", PROGRESS_TOTALS_FILE_NAME)
+    if is_budgeted:
+        total_files = None
+        total_bytes = None if args.byte_budget_gib is None else int(args.byte_budget_gib * BYTES_IN_A_GIB)
+    elif args.count_first:
+        total_files, total_bytes = _count_files(all_paths)
+    else:
+        total_files, total_bytes = load_previous_totals(progress_totals_path)
+    # A single reporter covers the queued changes and the walk, so the progress and time left are for the whole cycle.
+    # A budgeted run starts it again once it has found the files to verify.
+    progress_reporter = ProgressReporter(total_files, total_bytes)
 
     with LoggerUtil() as logger:
-        file_processor = FileProcessor(recency_util, mongo_util, logger)
-        for path in all_paths:
-            is_immutable = path in immutable_paths
-            num_skips = 0
-            num_success = 0
-            num_failures = 0
+        file_processor = FileProcessor(
+            recency_util,
+            mongo_util,
+            logger,
+            checksum_checkpoint_util=ChecksumCheckpointUtil(),
+            device_workers=_get_device_workers(workers_per_device),
+            verbose=args.verbose,
+            progress_reporter=progress_reporter,
+        )
+        if daemon_status is not None:
+            daemon_status.set_file_processor(file_processor)
+
+        # Files that the change watcher saw change are processed before anything else
+        for summary in _process_queued_changes(file_processor, change_queue, mutable_paths, deadline).values():
+            total_successes += summary.successes
+            total_skips += summary.skips
+
+        if is_budgeted:
+            summary = _process_budgeted(
+                file_processor,
+                recency_util,
+                logger,
+                all_paths,
+                immutable_paths,
+                args.byte_budget_gib,
+                args.time_budget_hours,
+                deadline,
+            )
+            total_successes += summary.successes
+            total_skips += summary.skips
+        else:
+            # While the change watcher is running, the queued changes already include every changed file
+            walked_paths = []
+            for path in all_paths:
+                if path in mutable_paths and change_queue.can_skip_full_walk(path):
+                    print(f"Skipping the full walk of {path} as the change watcher has queued every change")
+                else:
+                    walked_paths.append(path)
+
+            # Every path is processed at the same time so that paths on different devices are read in parallel
             print("\n==========================================")
-            print(f"Processing files in {path}...\n")
-            for root, dirs, files in os.walk(path):
-                for file in files:
-                    true_file_path = os.path.join(root, file)
-                    success = file_processor.process_file(
-                        root=root, path=path, true_file_path=true_file_path, file_is_immutable=is_immutable
+            print(f"Processing files in {', '.join(walked_paths)}...\n")
+            walk_start_time = time.time()
+            # The queued changes are seen again by the walk, so the totals only count the walk itself
+            files_before_walk, bytes_before_walk = progress_reporter.files_done, progress_reporter.bytes_done
+            summaries = file_processor.process_paths(
+                [(path, walk_files(path), path in immutable_paths) for path in walked_paths], deadline
+            )
+            # A walk that was cut short by the deadline could have missed changed files
+            if not file_processor.deadline_reached:
+                for path in walked_paths:
+                    if path in mutable_paths:
+                        change_queue.record_full_walk(path, walk_start_time)
+                # The totals are only for a run that walks every path
+                if len(walked_paths) == len(all_paths):
+                    save_totals(
+                        progress_totals_path,
+                        progress_reporter.files_done - files_before_walk,
+                        progress_reporter.bytes_done - bytes_before_walk,
                     )
-                    if success is None:
-                        num_skips += 1
-                    elif success:
-                        num_success += 1
-                    else:
-                        num_failures += 1
-
-            print(f"\nSuccesses in {path}: {num_success}")
-            print(f"Failures in {path}:  {num_failures}")
-            print(f"Skips in {path}:  {num_skips}")
-            total_successes = total_successes + num_success
-            total_skips = total_skips + num_skips
+
+            for path, summary in summaries.items():
+                _print_summary(path, summary)
+                total_successes = total_successes + summary.successes
+                total_skips = total_skips + summary.skips
 
         failed_files = file_processor.failed_files
 
@@ -61,14 +342,162 @@ def main():
         logger.write(f"Total successes: {total_successes}")
         logger.write(f"Total failures:  {len(failed_files)}")
         logger.write(f"Total skips:  {total_skips}")
+        inode_checksum_cache = file_processor.inode_checksum_cache
+        if inode_checksum_cache.files_deduplicated:
+            logger.write(
+                f"Hard links not read again: {inode_checksum_cache.files_deduplicated}"
+                f" ({inode_checksum_cache.bytes_deduplicated / BYTES_IN_A_GIB:.2f} GiB saved)"
+            )
+        logger.write_event(
+            "run_finished",
+            successes=total_successes,
+            failures=len(failed_files),
+            skips=total_skips,
+            files_deduplicated=inode_checksum_cache.files_deduplicated,
+            bytes_deduplicated=inode_checksum_cache.bytes_deduplicated,
+            duration_seconds=time.monotonic() - start_time,
+        )
+
+    _write_metrics(start_time, file_processor)
+    return ProcessingSummary(successes=total_successes, failures=len(failed_files), skips=total_skips)
+
+
+def _start_change_watcher(
+    mutable_paths: List[str], change_queue: ChangeQueue
+) -> Optional[Tuple[threading.Event, threading.Thread]]:
+    """
+    Watches the mutable paths from a background thread, so that cycles can skip walking them in full.
+    Returns the event that stops the watcher and its thread, if inotify is available.
+    """
+    if not mutable_paths or not is_supported():
+        return None
+
+    stop_event = threading.Event()
+
+    def _watch():
+        try:
+            ChangeWatcher(mutable_paths, change_queue).run(stop_event)
+        except Exception as e:
+            # Without the watcher's heartbeat, cycles go back to walking the mutable paths in full
+            print(f"The change watcher stopped: {e}")
+
+    thread = threading.Thread(target=_watch, name="change-watcher", daemon=True)
+    thread.start()
+    return stop_event, thread
+
+
+def _stop_change_watcher(change_watcher: Optional[Tuple[threading.Event, threading.Thread]]):
+    if change_watcher is not None:
+        stop_event, thread = change_watcher
+        stop_event.set()
+        thread.join()
+
+
+def _run_daemon(args: argparse.Namespace, mongo_util: MongoUtil, recency_util: RecencyUtil, change_queue: ChangeQueue):
+    """
+    Runs a cycle every DAEMON_CYCLE_PAUSE_SECONDS within the configured active hours, until sent SIGTERM.
+
+    The database connection pool, the recency database and the change watcher's directory watches stay open between
+    cycles, instead of being set up again by every run. The configuration is read again when sent SIGHUP.
+    """
+    daemon_config = DaemonConfig.load()
+    daemon_status = DaemonStatus(change_queue)
+    # Set by the signal handlers to cut any wait short
+    wake_up = threading.Event()
+    reload_requested = threading.Event()
+    stop_requested = threading.Event()
+
+    def _on_reload(signal_number, frame):
+        # The configuration is reloaded by the main loop, where an invalid file cannot stop the daemon
+        reload_requested.set()
+        wake_up.set()
+
+    def _on_stop(signal_number, frame):
+        stop_requested.set()
+        wake_up.set()
+        # Not under the status lock, since the handler can run while the main thread holds it
+        file_processor = daemon_status.file_processor
+        if file_processor is not None:
+            file_processor.stop()
+
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, _on_reload)
+    signal.signal(signal.SIGTERM, _on_stop)
+    signal.signal(signal.SIGINT, _on_stop)
+
+    status_server = start_status_server(daemon_status, daemon_config.status_port)
+    print(f"Serving the status on http://127.0.0.1:{daemon_config.status_port}/status")
+    change_watcher = _start_change_watcher(daemon_config.mutable_paths, change_queue)
+
+    next_cycle_time = time.monotonic()
+    try:
+        while not stop_requested.is_set():
+            wake_up.clear()
+            if reload_requested.is_set():
+                reload_requested.clear()
+                try:
+                    new_config = DaemonConfig.load()
+                    IO_THROTTLE.reload_from_config()
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Could not reload the configuration, so the old one is kept: {e}")
+                    continue
+                if new_config.mutable_paths != daemon_config.mutable_paths:
+                    _stop_change_watcher(change_watcher)
+                    change_watcher = _start_change_watcher(new_config.mutable_paths, change_queue)
+                if new_config.status_port != daemon_config.status_port:
+                    print("The status port only changes when the daemon is restarted")
+                daemon_config = new_config
+                print("Reloaded the configuration")
+
+            now = datetime.now()
+            active_hours = daemon_config.active_hours
+            if active_hours is not None and not active_hours.is_active(now):
+                next_start = active_hours.get_next_start(now)
+                daemon_status.wait_until(next_start.timestamp(), "outside active hours")
+                print(f"Waiting until {next_start} for the active hours, {active_hours}")
+                wake_up.wait((next_start - now).total_seconds())
+                continue
+
+            remaining_seconds = next_cycle_time - time.monotonic()
+            if remaining_seconds > 0:
+                daemon_status.wait_until(time.time() + remaining_seconds, "waiting for the next cycle")
+                wake_up.wait(remaining_seconds)
+                continue
+
+            # Stop starting files when the active hours end
+            deadline = None
+            if active_hours is not None:
+                deadline = time.monotonic() + (active_hours.get_end(now) - now).total_seconds()
+
+            daemon_status.start_cycle()
+            summary = _run_cycle(
+                args,
+                mongo_util,
+                recency_util,
+                change_queue,
+                daemon_config.immutable_paths,
+                daemon_config.mutable_paths,
+                daemon_config.workers_per_device,
+                deadline,
+                daemon_status,
+            )
+            daemon_status.finish_cycle(successes=summary.successes, failures=summary.failures, skips=summary.skips)
+            next_cycle_time = time.monotonic() + DAEMON_CYCLE_PAUSE_SECONDS
+            if stop_requested.is_set():
+                break
+            _ping_healthcheck(daemon_config.healthcheck_url, summary.failures)
+    finally:
+        _stop_change_watcher(change_watcher)
+        status_server.shutdown()
+    print("Stopped the daemon")
+
 
+def _ping_healthcheck(healthcheck_url: Optional[str], total_failures: int):
     # If we have a healthcheck URL, ping it if there were no errors
-    healthcheck_url = get_healthcheck_url()
     if healthcheck_url is None:
         print("No healthcheck URL. Skipping.")
         return
 
-    total_failures = len(failed_files)
     if total_failures > 0:
         print(f"There were {total_failures} errors. Not sending healthcheck.")
         return
@@ -0,0 +1,57 @@
+from typing import List, Tuple
+
+from bitrotchecker.src.checksum_algorithms import BlockCrc32Hasher, unpack_block_checksums
+from bitrotchecker.src.constants import BLOCK_CHECKSUM_MIN_FILE_SIZE
+from bitrotchecker.src.file_reader import read_chunks
+from bitrotchecker.src.run_metrics import METRICS
+
+
+def should_have_block_checksums(file_size: int) -> bool:
+    return BLOCK_CHECKSUM_MIN_FILE_SIZE is not None and file_size >= BLOCK_CHECKSUM_MIN_FILE_SIZE
+
+
+def get_block_checksums_of_range(file_path: str, block_size: int, first_block: int, num_blocks: int) -> List[int]:
+    """
+    Calculates the block checksums of only the given blocks of the file, without reading the rest of it.
+    """
+    hasher = BlockCrc32Hasher(block_size)
+    bytes_remaining = num_blocks * block_size
+
+    with METRICS.time("hash_blocks"), open(file_path, "rb") as file:
+        file.seek(first_block * block_size)
+        for chunk in read_chunks(file):
+            if len(chunk) > bytes_remaining:
+                chunk = chunk[:bytes_remaining]
+            hasher.update(chunk)
+            bytes_remaining -= len(chunk)
+            if bytes_remaining <= 0:
+                break
+
+    return unpack_block_checksums(hasher.result())
+
+
+def get_differing_byte_ranges(
+    expected_block_checksums: List[int], actual_block_checksums: List[int], block_size: int, first_block: int = 0
+) -> List[Tuple[int, int]]:
+    """
+    Returns the (start, end) byte ranges, end exclusive, of every run of blocks whose checksums differ.
+    The checksum lists start at first_block.
+    """
+    byte_ranges: List[Tuple[int, int]] = []
+    for index, (expected, actual) in enumerate(zip(expected_block_checksums, actual_block_checksums)):
+        if expected == actual:
+            continue
+
+        block_start = (first_block + index) * block_size
+        block_end = block_start + block_size
+        if byte_ranges and byte_ranges[-1][1] == block_start:
+            # Merge neighbouring blocks into one range
+            byte_ranges[-1] = (byte_ranges[-1][0], block_end)
+        else:
+            byte_ranges.append((block_start, block_end))
+
+    return byte_ranges
+
+
+def format_byte_ranges(byte_ranges: List[Tuple[int, int]], file_size: int) -> str:
+    return ", ".join(f"{start}-{min(end, file_size) - 1}" for start, end in byte_ranges)
@@ -0,0 +1,29 @@
+import threading
+
+
+class ByteBudget:
+    """
+    Blocks callers until enough of a shared byte allowance is free.
+
+    A single request larger than the whole budget is still allowed through once nothing else is in flight,
+    so that an oversized request can never deadlock.
+    """
+
+    def __init__(self, max_bytes: int):
+        if max_bytes <= 0:
+            raise ValueError(f"Byte budget must be positive but was {max_bytes}")
+
+        self.max_bytes = max_bytes
+        self.bytes_in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, num_bytes: int):
+        with self._condition:
+            while self.bytes_in_flight > 0 and self.bytes_in_flight + num_bytes > self.max_bytes:
+                self._condition.wait()
+            self.bytes_in_flight += num_bytes
+
+    def release(self, num_bytes: int):
+        with self._condition:
+            self.bytes_in_flight -= num_bytes
+            self._condition.notify_all()
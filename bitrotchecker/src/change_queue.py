@@ -0,0 +1,218 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from bitrotchecker.src.constants import (
+    CHANGE_QUEUE_FILE_NAME,
+    CHANGE_WATCHER_HEARTBEAT_SECONDS,
+    WATCHED_FULL_WALK_INTERVAL_DAYS,
+)
+from bitrotchecker.src.file_util import get_file_entries, is_inside, walk_files
+
+SECONDS_IN_A_DAY = 60 * 60 * 24
+
+
+class ChangeQueue:
+    """
+    Keeps the files that the change watcher has seen change under each mutable path until a run has processed them,
+    along with directories that need to be walked in full because their changes could not all be seen,
+    such as after the watcher's event queue overflowed.
+
+    Also keeps when the watcher started watching each path and when each path was last walked in full,
+    so a run knows when every change since the last full walk is already in the queue.
+    """
+
+    def __init__(self, change_queue_file_path=CHANGE_QUEUE_FILE_NAME):
+        self.change_queue_file_path = change_queue_file_path
+        self.lock = threading.Lock()
+
+        # The watcher and the runs are separate processes, so every statement commits on its own
+        self.connection = sqlite3.connect(self.change_queue_file_path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA busy_timeout=10000")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS changed_files ("
+            " file_path TEXT PRIMARY KEY,"
+            " root TEXT NOT NULL,"
+            " queued_time REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS changed_directories ("
+            " directory TEXT PRIMARY KEY,"
+            " root TEXT NOT NULL,"
+            " queued_time REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS roots ("
+            " root TEXT PRIMARY KEY,"
+            " watching_since REAL,"
+            " heartbeat_time REAL,"
+            " last_full_walk_time REAL"
+            ") WITHOUT ROWID"
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def add_changes(self, root: str, file_paths: Iterable[str], directories: Iterable[str] = ()):
+        """
+        Queues changed files, and directories whose every file needs to be processed, in a single transaction.
+        A path that is already queued has its queued time updated, so it is kept if it is being processed right now.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO changed_files (file_path, root, queued_time) VALUES (?, ?, ?)",
+                ((file_path, root, now) for file_path in file_paths),
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO changed_directories (directory, root, queued_time) VALUES (?, ?, ?)",
+                ((directory, root, now) for directory in directories),
+            )
+
+    def get_changes(self, root: str) -> "QueuedChanges":
+        with self.lock:
+            queued_directories = self.connection.execute(
+                "SELECT directory, queued_time FROM changed_directories WHERE root = ? ORDER BY directory", (root,)
+            ).fetchall()
+            queued_files = self.connection.execute(
+                "SELECT file_path, queued_time FROM changed_files WHERE root = ? ORDER BY file_path", (root,)
+            ).fetchall()
+        return QueuedChanges(root, queued_files, queued_directories)
+
+    def count_changes(self) -> int:
+        with self.lock:
+            return sum(
+                self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ["changed_files", "changed_directories"]
+            )
+
+    def remove_changes(self, changes: "QueuedChanges"):
+        """
+        Removes the changes once they have been processed.
+        A path that was queued again since the changes were read has a newer queued time, so it is kept.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "DELETE FROM changed_files WHERE file_path = ? AND queued_time = ?", changes.queued_files
+            )
+            self.connection.executemany(
+                "DELETE FROM changed_directories WHERE directory = ? AND queued_time = ?", changes.queued_directories
+            )
+
+    def start_watching(self, root: str):
+        """
+        Records that every change under the root is seen from now on.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO roots (root, watching_since, heartbeat_time) VALUES (?, ?, ?)"
+                " ON CONFLICT (root) DO UPDATE SET watching_since = excluded.watching_since,"
+                " heartbeat_time = excluded.heartbeat_time",
+                (root, now, now),
+            )
+
+    def heartbeat(self, roots: Iterable[str]):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "UPDATE roots SET heartbeat_time = ? WHERE root = ? AND watching_since IS NOT NULL",
+                ((now, root) for root in roots),
+            )
+
+    def stop_watching(self, root: str):
+        """
+        Records that changes under the root may be missed, until the watcher starts watching it again.
+        """
+        with self.lock:
+            self.connection.execute("UPDATE roots SET watching_since = NULL WHERE root = ?", (root,))
+
+    def record_full_walk(self, root: str, walk_start_time: float):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO roots (root, last_full_walk_time) VALUES (?, ?)"
+                " ON CONFLICT (root) DO UPDATE SET last_full_walk_time = excluded.last_full_walk_time",
+                (root, walk_start_time),
+            )
+
+    def can_skip_full_walk(
+        self,
+        root: str,
+        full_walk_interval_days: float = WATCHED_FULL_WALK_INTERVAL_DAYS,
+        heartbeat_seconds: float = CHANGE_WATCHER_HEARTBEAT_SECONDS,
+    ) -> bool:
+        """
+        Returns whether every change under the root since it was last walked in full is in the queue.
+        That is when the watcher was already watching the root when the last full walk started, and is still running.
+        Roots are still walked in full every full_walk_interval_days, so that unchanged files are verified again.
+        """
+        with self.lock:
+            row: Optional[Tuple[Optional[float], Optional[float], Optional[float]]] = self.connection.execute(
+                "SELECT watching_since, heartbeat_time, last_full_walk_time FROM roots WHERE root = ?", (root,)
+            ).fetchone()
+        if row is None or None in row:
+            return False
+
+        watching_since, heartbeat_time, last_full_walk_time = row
+        now = time.time()
+        # Allow for one missed heartbeat, such as while the watcher is busy adding watches to a new directory
+        watcher_running = now - heartbeat_time <= 2 * heartbeat_seconds
+        return (
+            watcher_running
+            and watching_since <= last_full_walk_time
+            and now - last_full_walk_time < full_walk_interval_days * SECONDS_IN_A_DAY
+        )
+
+
+@dataclass
+class QueuedChanges:
+    root: str
+    # The (path, queued time) of every change that was read
+    queued_files: List[Tuple[str, float]]
+    queued_directories: List[Tuple[str, float]]
+
+    def __len__(self) -> int:
+        return len(self.queued_files) + len(self.queued_directories)
+
+    @property
+    def directories(self) -> List[str]:
+        """
+        The directories to walk, leaving out those inside another directory that is walked.
+        """
+        directories: List[str] = []
+        for directory, _ in sorted(self.queued_directories):
+            if not any(is_inside(directory, parent) for parent in directories):
+                directories.append(directory)
+        return directories
+
+    @property
+    def file_paths(self) -> List[str]:
+        """
+        The changed files, leaving out those that are processed by walking a directory they are in.
+        """
+        directories = self.directories
+        return [
+            file_path
+            for file_path, _ in self.queued_files
+            if not any(is_inside(file_path, directory) for directory in directories)
+        ]
+
+
+def walk_changes(changes: QueuedChanges) -> Iterator[os.DirEntry]:
+    """
+    Yields an entry for every changed file that still exists, and for every file in the changed directories.
+    """
+    yield from get_file_entries(changes.file_paths)
+    for directory in changes.directories:
+        yield from walk_files(directory)
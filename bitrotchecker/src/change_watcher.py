@@ -0,0 +1,273 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from bitrotchecker.src.change_queue import ChangeQueue
+from bitrotchecker.src.configuration_util import get_mutable_paths
+from bitrotchecker.src.constants import CHANGE_WATCHER_HEARTBEAT_SECONDS
+from bitrotchecker.src.file_util import should_skip_file, should_skip_name
+
+# Event masks from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# A changed file is queued once it has been written and closed, created (such as a new hard link),
+# moved into a watched directory, or had its modified time set
+FILE_CHANGE_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO | IN_ATTRIB
+WATCH_MASK = (
+    FILE_CHANGE_MASK | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+
+# The wd, mask, cookie and name length of an inotify_event, followed by the name
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+# How often to check whether the watcher has been asked to stop
+_POLL_TIMEOUT_SECONDS = 1
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_LIBC = _load_libc()
+
+
+def is_supported() -> bool:
+    return _LIBC is not None
+
+
+def parse_events(data: bytes) -> Iterator[Tuple[int, int, str]]:
+    """
+    Yields the (watch descriptor, mask, name) of each inotify_event in the data read from an inotify instance.
+    """
+    offset = 0
+    while offset < len(data):
+        watch_descriptor, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name_end = offset + name_length
+        name = os.fsdecode(data[offset:name_end].rstrip(b"\0"))
+        offset = name_end
+        yield watch_descriptor, mask, name
+
+
+class RootWatch:
+    """
+    Watches every directory under one of the mutable paths with its own inotify instance,
+    so that when the instance's event queue overflows only that path has to be walked again.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.file_descriptor = _LIBC.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.file_descriptor < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, f"Could not create an inotify instance: {os.strerror(error_number)}")
+        self.directories: Dict[int, str] = {}
+        # Whether every directory under the root has a watch, which is needed to trust the change queue
+        self.complete = True
+
+    def close(self):
+        os.close(self.file_descriptor)
+
+    def add_watches(self, directory: str):
+        """
+        Watches the directory and every directory under it, without following symbolic links.
+        """
+        directories_to_watch = [directory]
+        while directories_to_watch:
+            directory = directories_to_watch.pop()
+            if not self._add_watch(directory):
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not should_skip_name(entry.name) and entry.is_dir(follow_symlinks=False):
+                            directories_to_watch.append(entry.path)
+            except OSError as e:
+                # Deleted since it was listed, or it cannot be read
+                print(f"Could not list {directory}: {e}")
+
+    def _add_watch(self, directory: str) -> bool:
+        watch_descriptor = _LIBC.inotify_add_watch(self.file_descriptor, os.fsencode(directory), WATCH_MASK)
+        if watch_descriptor < 0:
+            error_number = ctypes.get_errno()
+            if error_number in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            # Such as ENOSPC when fs.inotify.max_user_watches is reached
+            print(f"WARNING: Could not watch {directory}: {os.strerror(error_number)}")
+            self.complete = False
+            return False
+
+        # Watching a directory again, such as after it was moved, gives the same watch descriptor
+        self.directories[watch_descriptor] = directory
+        return True
+
+    def read_events(self) -> Tuple[Set[str], Set[str]]:
+        """
+        Reads every pending event and returns the changed files and the directories that need to be walked.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.file_descriptor, _READ_SIZE)
+            except BlockingIOError:
+                break
+            events.extend(parse_events(data))
+        return self.handle_events(events)
+
+    def handle_events(self, events: List[Tuple[int, int, str]]) -> Tuple[Set[str], Set[str]]:
+        changed_files: Set[str] = set()
+        changed_directories: Set[str] = set()
+        for watch_descriptor, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, so any file under the root could have changed
+                print(f"WARNING: Too many changes in {self.root} to keep up with. It will be walked in full.")
+                changed_directories.add(self.root)
+                continue
+
+            directory = self.directories.get(watch_descriptor)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # The directory was deleted, or the file system it is on was unmounted
+                del self.directories[watch_descriptor]
+                if directory == self.root:
+                    self.complete = False
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and directory == self.root:
+                print(f"WARNING: {self.root} was deleted or moved. It will be walked in full.")
+                self.complete = False
+                continue
+            if not name or should_skip_name(name):
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files can be created in a new directory before it is watched, so walk it
+                    self.add_watches(path)
+                    changed_directories.add(path)
+            elif mask & FILE_CHANGE_MASK:
+                changed_files.add(path)
+
+        return changed_files, changed_directories
+
+
+class ChangeWatcher:
+    """
+    Watches the mutable paths for created, modified and moved files, and queues them in the ChangeQueue
+    for the next run to process first. While the watcher keeps running, runs can skip walking the paths in full.
+    """
+
+    def __init__(
+        self,
+        roots: List[str],
+        change_queue: ChangeQueue,
+        heartbeat_seconds: float = CHANGE_WATCHER_HEARTBEAT_SECONDS,
+    ):
+        self.roots = roots
+        self.change_queue = change_queue
+        self.heartbeat_seconds = heartbeat_seconds
+        self.root_watches: Dict[int, RootWatch] = {}
+        self.last_heartbeat_time = 0.0
+        self.poller = select.poll()
+
+    def start(self):
+        for root in self.roots:
+            if should_skip_file(root):
+                continue
+            # Until every directory is watched, changes in the directories not watched yet could be missed
+            self.change_queue.stop_watching(root)
+            print(f"Watching {root}...")
+            root_watch = RootWatch(root)
+            root_watch.add_watches(root)
+            self.root_watches[root_watch.file_descriptor] = root_watch
+            self.poller.register(root_watch.file_descriptor, select.POLLIN)
+            if root_watch.complete:
+                self.change_queue.start_watching(root)
+                print(f"Watching {len(root_watch.directories)} directories in {root}")
+            else:
+                print(f"WARNING: Not every directory in {root} could be watched, so it will still be walked in full")
+        self.last_heartbeat_time = time.monotonic()
+
+    def close(self):
+        for root_watch in self.root_watches.values():
+            self.change_queue.stop_watching(root_watch.root)
+            root_watch.close()
+        self.root_watches.clear()
+
+    def poll(self, timeout_seconds: float):
+        """
+        Queues the changes that happen within the timeout, and records that the watcher is still running.
+        """
+        for file_descriptor, _ in self.poller.poll(timeout_seconds * 1000):
+            root_watch = self.root_watches[file_descriptor]
+            was_complete = root_watch.complete
+            changed_files, changed_directories = root_watch.read_events()
+            if changed_files or changed_directories:
+                self.change_queue.add_changes(root_watch.root, changed_files, changed_directories)
+            if was_complete and not root_watch.complete:
+                self.change_queue.stop_watching(root_watch.root)
+
+        if time.monotonic() - self.last_heartbeat_time >= self.heartbeat_seconds:
+            self.change_queue.heartbeat(
+                root_watch.root for root_watch in self.root_watches.values() if root_watch.complete
+            )
+            self.last_heartbeat_time = time.monotonic()
+
+    def run(self, stop_event: threading.Event):
+        self.start()
+        try:
+            while not stop_event.is_set():
+                self.poll(_POLL_TIMEOUT_SECONDS)
+        finally:
+            self.close()
+
+
+def main():
+    if not is_supported():
+        print("The change watcher needs inotify, which is only available on Linux.")
+        exit(1)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signal_number, frame: stop_event.set())
+
+    change_queue = ChangeQueue()
+    try:
+        ChangeWatcher(get_mutable_paths(), change_queue).run(stop_event)
+    finally:
+        change_queue.close()
+    print("Stopped watching")
+
+
+if __name__ == "__main__":
+    main()
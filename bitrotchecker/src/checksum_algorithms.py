@@ -0,0 +1,147 @@
+import hashlib
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Protocol, List
+
+from bitrotchecker.src.constants import BLOCK_CHECKSUM_BLOCK_SIZE
+
+
+class Hasher(Protocol):
+    """
+    Hashers may also have get_state and set_state methods, with a JSON serializable state,
+    if they can be saved part way through a file and resumed later.
+    """
+
+    def update(self, data: bytes): ...
+
+    def result(self) -> Any: ...
+
+
+def is_resumable(hasher: Hasher) -> bool:
+    return hasattr(hasher, "get_state") and hasattr(hasher, "set_state")
+
+
+class Crc32Hasher:
+    def __init__(self):
+        self.checksum = 0
+
+    def update(self, data: bytes):
+        self.checksum = zlib.crc32(data, self.checksum)
+
+    def result(self) -> int:
+        return self.checksum & 0xFFFFFFFF
+
+    def get_state(self) -> Any:
+        return self.checksum
+
+    def set_state(self, state: Any):
+        self.checksum = state
+
+
+class HashlibHasher:
+    def __init__(self, hashlib_name: str):
+        self.hasher = hashlib.new(hashlib_name)
+
+    def update(self, data: bytes):
+        self.hasher.update(data)
+
+    def result(self) -> str:
+        return self.hasher.hexdigest()
+
+
+class BlockCrc32Hasher:
+    """
+    Calculates a separate CRC-32 for every block of the data, so that a mismatch can be narrowed down to a block.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self.block_checksums: List[int] = []
+        self.checksum = 0
+        self.checksum_size = 0
+
+    def update(self, data: bytes):
+        with memoryview(data) as data_view:
+            offset = 0
+            while offset < len(data_view):
+                end = offset + min(len(data_view) - offset, self.block_size - self.checksum_size)
+                self.checksum = zlib.crc32(data_view[offset:end], self.checksum)
+                self.checksum_size += end - offset
+                offset = end
+
+                if self.checksum_size == self.block_size:
+                    self.block_checksums.append(self.checksum & 0xFFFFFFFF)
+                    self.checksum = 0
+                    self.checksum_size = 0
+
+    def result(self) -> bytes:
+        block_checksums = list(self.block_checksums)
+        if self.checksum_size:
+            # The last block of a file is usually shorter than the rest
+            block_checksums.append(self.checksum & 0xFFFFFFFF)
+        return pack_block_checksums(block_checksums)
+
+    def get_state(self) -> Any:
+        return [list(self.block_checksums), self.checksum, self.checksum_size]
+
+    def set_state(self, state: Any):
+        block_checksums, self.checksum, self.checksum_size = state
+        self.block_checksums = list(block_checksums)
+
+
+def pack_block_checksums(block_checksums: List[int]) -> bytes:
+    # Four bytes per block keeps the database documents compact
+    return struct.pack(f">{len(block_checksums)}I", *block_checksums)
+
+
+def unpack_block_checksums(packed_block_checksums: bytes) -> List[int]:
+    return list(struct.unpack(f">{len(packed_block_checksums) // 4}I", packed_block_checksums))
+
+
+@dataclass(frozen=True)
+class ChecksumAlgorithm:
+    # The name saved in the database next to each checksum. DO NOT modify existing names.
+    name: str
+    display_name: str
+    create_hasher: Callable[[], Hasher]
+
+
+CRC32 = "crc32"
+BLAKE2B = "blake2b"
+SHA256 = "sha256"
+
+CHECKSUM_ALGORITHMS: Dict[str, ChecksumAlgorithm] = {
+    algorithm.name: algorithm
+    for algorithm in [
+        ChecksumAlgorithm(CRC32, "CRC-32", Crc32Hasher),
+        ChecksumAlgorithm(BLAKE2B, "BLAKE2b", lambda: HashlibHasher("blake2b")),
+        ChecksumAlgorithm(SHA256, "SHA-256", lambda: HashlibHasher("sha256")),
+    ]
+}
+
+# Records from before the algorithm was saved in the database were all made with CRC-32
+LEGACY_CHECKSUM_ALGORITHM = CRC32
+
+# Per-block CRC-32s of large files. This is calculated alongside the whole file checksum rather than instead of it,
+# so it cannot be used as the CHECKSUM_ALGORITHM.
+CRC32_BLOCKS = "crc32_blocks"
+BLOCK_CHECKSUM_ALGORITHM = ChecksumAlgorithm(
+    CRC32_BLOCKS, "CRC-32 blocks", lambda: BlockCrc32Hasher(BLOCK_CHECKSUM_BLOCK_SIZE)
+)
+
+
+def get_checksum_algorithm(name: str) -> ChecksumAlgorithm:
+    if name == CRC32_BLOCKS:
+        return BLOCK_CHECKSUM_ALGORITHM
+
+    algorithm = CHECKSUM_ALGORITHMS.get(name)
+    if algorithm is None:
+        raise ValueError(f"Unknown checksum algorithm {name!r}. Options are: {', '.join(CHECKSUM_ALGORITHMS)}")
+    return algorithm
+
+
+def format_checksum(checksum: Any) -> str:
+    if isinstance(checksum, int):
+        return format(checksum, "X")
+    return str(checksum)
@@ -0,0 +1,105 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import Iterable, Optional
+
+from bitrotchecker.src.checksum_algorithms import CHECKSUM_ALGORITHMS, get_checksum_algorithm, CRC32
+from bitrotchecker.src.constants import CHUNK_SIZE
+from bitrotchecker.src.file_reader import READ_STRATEGIES, read_chunks
+
+# How much data to checksum with each algorithm and read strategy if no size is given on the command line
+DEFAULT_BENCHMARK_SIZE_MIB = 1024
+
+
+def benchmark_algorithms(algorithms: Iterable[str], data: bytes, num_chunks: int) -> float:
+    """
+    Feeds the data to every given algorithm num_chunks times, the same way a file is checksummed.
+    Returns the throughput in MiB per second.
+    """
+    hashers = [get_checksum_algorithm(algorithm).create_hasher() for algorithm in algorithms]
+
+    start_time = time.perf_counter()
+    for _ in range(num_chunks):
+        for hasher in hashers:
+            hasher.update(data)
+    for hasher in hashers:
+        hasher.result()
+    elapsed_seconds = time.perf_counter() - start_time
+
+    return (len(data) * num_chunks) / (1024 * 1024) / elapsed_seconds
+
+
+def benchmark_read_strategy(file_path: str, read_strategy: str) -> float:
+    """
+    Calculates the CRC-32 of the file using the given read strategy.
+    Returns the throughput in MiB per second.
+    """
+    hasher = get_checksum_algorithm(CRC32).create_hasher()
+    num_bytes = 0
+
+    start_time = time.perf_counter()
+    with open(file_path, "rb") as file:
+        for chunk in read_chunks(file, read_strategy=read_strategy):
+            hasher.update(chunk)
+            num_bytes += len(chunk)
+    hasher.result()
+    elapsed_seconds = time.perf_counter() - start_time
+
+    return num_bytes / (1024 * 1024) / elapsed_seconds
+
+
+def _drop_from_page_cache(file_path: str):
+    # Without this, every strategy after the first would read the file from memory instead of the disk
+    if hasattr(os, "posix_fadvise"):
+        with open(file_path, "rb") as file:
+            # Pages that have not been written to the disk yet, such as those of the file just written, are not dropped
+            os.fsync(file.fileno())
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _benchmark_read_strategies(file_path: str):
+    print(f"\nCalculating the CRC-32 of {file_path} with each read strategy...")
+    for read_strategy in READ_STRATEGIES:
+        _drop_from_page_cache(file_path)
+        throughput = benchmark_read_strategy(file_path, read_strategy)
+        print(f"{read_strategy}: {throughput:.1f} MiB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure checksum and file read throughput on this machine.")
+    parser.add_argument("--size-mib", type=int, default=DEFAULT_BENCHMARK_SIZE_MIB, help="How much data to use")
+    parser.add_argument("--file", help="An existing file to read instead of writing a temporary one")
+    arguments = parser.parse_args()
+    run_benchmark(arguments.size_mib, arguments.file)
+
+
+def run_benchmark(size_mib: int, file_path: Optional[str] = None):
+    num_chunks = max(1, size_mib * 1024 * 1024 // CHUNK_SIZE)
+    data = os.urandom(CHUNK_SIZE)
+
+    print(f"Checksumming {num_chunks} chunks of {CHUNK_SIZE} bytes with each algorithm (no disk reads)...")
+    for algorithm in CHECKSUM_ALGORITHMS:
+        throughput = benchmark_algorithms([algorithm], data, num_chunks)
+        print(f"{algorithm}: {throughput:.1f} MiB/s")
+
+    # Migrating records calculates two checksums with a single read
+    throughput = benchmark_algorithms(CHECKSUM_ALGORITHMS, data, num_chunks)
+    print(f"All algorithms at once: {throughput:.1f} MiB/s")
+
+    if file_path:
+        _benchmark_read_strategies(file_path)
+        return
+
+    # Write a file to the working directory rather than a temporary directory, which may be in memory
+    with tempfile.NamedTemporaryFile(dir=".", prefix="checksum_benchmark_", delete=False) as benchmark_file:
+        for _ in range(num_chunks):
+            benchmark_file.write(data)
+    try:
+        _benchmark_read_strategies(benchmark_file.name)
+    finally:
+        os.remove(benchmark_file.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from bitrotchecker.src.constants import CHECKSUM_CHECKPOINT_FILE_NAME
+
+
+class ChecksumCheckpointUtil:
+    """
+    Saves how far through a large file its checksums have been calculated, so that an interrupted run can resume
+    from there instead of from the start of the file.
+
+    A checkpoint is only used if the file still has the same size and modified time as when it was saved.
+    """
+
+    def __init__(self, checkpoint_file_path=CHECKSUM_CHECKPOINT_FILE_NAME):
+        self.checkpoint_file_path = checkpoint_file_path
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(self.checkpoint_file_path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " file_path TEXT PRIMARY KEY,"
+            " file_size INTEGER NOT NULL,"
+            " modified_time REAL NOT NULL,"
+            " algorithms TEXT NOT NULL,"
+            " offset INTEGER NOT NULL,"
+            " states TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def load_checkpoint(
+        self, file_path: str, file_size: int, modified_time: float, algorithms: Iterable[str]
+    ) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """
+        Returns the offset and the hasher state of every algorithm, if there is a valid checkpoint for the file.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT file_size, modified_time, algorithms, offset, states FROM checkpoints WHERE file_path = ?",
+                (file_path,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        saved_file_size, saved_modified_time, saved_algorithms, offset, states = row
+        if (saved_file_size, saved_modified_time, saved_algorithms) != (
+            file_size,
+            modified_time,
+            _join_algorithms(algorithms),
+        ):
+            # The file has changed, or different checksums are needed, so start again
+            self.remove_checkpoint(file_path)
+            return None
+
+        return offset, json.loads(states)
+
+    def save_checkpoint(
+        self,
+        file_path: str,
+        file_size: int,
+        modified_time: float,
+        algorithms: Iterable[str],
+        offset: int,
+        states: Dict[str, Any],
+    ):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints"
+                " (file_path, file_size, modified_time, algorithms, offset, states) VALUES (?, ?, ?, ?, ?, ?)",
+                (file_path, file_size, modified_time, _join_algorithms(algorithms), offset, json.dumps(states)),
+            )
+
+    def remove_checkpoint(self, file_path: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM checkpoints WHERE file_path = ?", (file_path,))
+
+
+def _join_algorithms(algorithms: Iterable[str]) -> str:
+    return ",".join(sorted(algorithms))
@@ -25,3 +25,39 @@ def get_mutable_paths() -> List[str]:
 
 def get_healthcheck_url() -> Optional[str]:
     return _read_config_file()["healthcheck_url"]
+
+
+def get_max_read_bytes_per_second() -> Optional[int]:
+    return _read_config_file().get("max_read_bytes_per_second")
+
+
+def get_max_load_average() -> Optional[float]:
+    return _read_config_file().get("max_load_average")
+
+
+def get_max_disk_utilization_percent() -> Optional[float]:
+    return _read_config_file().get("max_disk_utilization_percent")
+
+
+def get_throttle_disks() -> Optional[List[str]]:
+    return _read_config_file().get("throttle_disks")
+
+
+def get_workers_per_device() -> Dict[str, int]:
+    return _read_config_file().get("workers_per_device", {})
+
+
+def get_metrics_textfile_path() -> Optional[str]:
+    return _read_config_file().get("metrics_textfile_path")
+
+
+def get_active_hours() -> Optional[List[str]]:
+    return _read_config_file().get("active_hours")
+
+
+def get_status_port() -> Optional[int]:
+    return _read_config_file().get("status_port")
+
+
+def get_record_expiry_days() -> Optional[int]:
+    return _read_config_file().get("record_expiry_days")
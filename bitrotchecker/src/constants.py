@@ -2,23 +2,183 @@
 # Configurable constants
 ########################
 # The file on disk to save information about how recently a file has been scanned.
-RECENCY_FILE_NAME = "recency.pickle"
+RECENCY_FILE_NAME = "recency.sqlite3"
+
+# The file that older versions saved recency information to.
+# If it exists, its records are imported into RECENCY_FILE_NAME and it is renamed with an ".imported" suffix.
+LEGACY_RECENCY_FILE_NAME = "recency.pickle"
 
 # How many days to wait before checking a file again.
 # This threshold is ignored if the file modified time has changed.
 # Lower this to scan files more frequently.
 RECENCY_MINIMUM_AGE_DAYS = 90
 
+# How many days of recency records to keep when running with a byte or time budget.
+# Budgeted runs pick the files that were verified the longest time ago, so they need records older than
+# RECENCY_MINIMUM_AGE_DAYS. Files without a record are treated as never verified and are picked first.
+BUDGETED_RECENCY_RETENTION_DAYS = 2 * 365
+
+# How many days pass between budgeted runs, used to project when every file will have been verified.
+BUDGETED_RUN_INTERVAL_DAYS = 1
+
+# The most files a budgeted run keeps as candidates while walking the paths, which bounds its memory use when it only
+# has a time budget. A run picks at most this many of the most overdue files, about 100 MB of memory.
+BUDGETED_RUN_MAX_FILES = 250 * 1000
+
 # Ignore files created less than X seconds ago
 IGNORE_FILES_NEWER_THAN_SECONDS = 60 * 60 * 24  # Hours in seconds
 
 # The file on disk to load configuration from.
 CONFIG_FILE_NAME = "config.json"
 
+# The checksum algorithm used for new records. The options are in checksum_algorithms.py.
+# Existing records keep verifying with the algorithm they were made with.
+# When a record made with a different algorithm passes verification, it is upgraded to this algorithm
+# using the same read of the file, so changing this never needs an extra read of every file.
+CHECKSUM_ALGORITHM = "crc32"
+
+# Files at least this large also get a checksum for every block of BLOCK_CHECKSUM_BLOCK_SIZE bytes.
+# When such a file fails verification, the failure says which byte ranges have changed.
+# Set to None to turn off block checksums.
+BLOCK_CHECKSUM_MIN_FILE_SIZE = 1024 * 1024 * 1024
+
+# The size of each block for block checksums. Each block costs 4 bytes in the database.
+# Changing this only affects new records.
+BLOCK_CHECKSUM_BLOCK_SIZE = 64 * 1024 * 1024
+
+# How many bytes of a file with block checksums to verify in a single run.
+# Files larger than this are verified a portion at a time, continuing where the last run stopped,
+# and are only marked as recently processed once every block has been verified.
+# Set to None to always verify whole files.
+BLOCK_VERIFICATION_BYTES_PER_RUN = 32 * 1024 * 1024 * 1024
+
+# The file on disk to save how far through large files their checksums have been calculated.
+CHECKSUM_CHECKPOINT_FILE_NAME = "checksum_checkpoints.sqlite3"
+
+# Files at least this large save their checksum progress as they are read.
+# If a run is interrupted part way through such a file, the next run continues from the last saved progress.
+# This only works with checksum algorithms that can be resumed, such as CRC-32.
+# Set to None to always read files from the start.
+RESUMABLE_CHECKSUM_MIN_FILE_SIZE = 8 * 1024 * 1024 * 1024
+
+# How many bytes to read between saving checksum progress.
+CHECKSUM_CHECKPOINT_INTERVAL_BYTES = 1024 * 1024 * 1024
+
 # The chunk size for calculating the checksum.
 # This affects the performance when reading your disk.
 CHUNK_SIZE = 4096 * 1024
 
+# How files are read when calculating checksums. The options are in file_reader.py:
+# "read" allocates a new buffer for every chunk, "readinto" reuses one buffer, "mmap" maps the file into memory,
+# and "double_buffer" reads the next chunk while the current one is being checksummed.
+# Run checksum_benchmark.py to see which is fastest on your machine.
+READ_STRATEGY = "readinto"
+
+# Whether to tell the kernel to drop file data from the page cache once it has been checksummed.
+# Files are read once and not again for a long time, so caching them only pushes out data other programs need.
+# This is only supported on some platforms (not Windows) and is ignored elsewhere.
+DROP_READ_DATA_FROM_PAGE_CACHE = True
+
+# How often to check the load average and disk utilization when they are limited in the configuration file.
+# Reads stay paused for at least this long once a limit is exceeded.
+THROTTLE_LOAD_CHECK_INTERVAL_SECONDS = 5
+
+# The number of files to read at the same time from each device (disk).
+# Every device is read in parallel, so paths on separate disks are all checked at once.
+# Two readers keep a disk busy while the other file's chunk is being checksummed, even on a single spinning disk.
+# SSDs can handle more, while a spinning disk that is also used by other programs may be better off with 1.
+# Use "workers_per_device" in the configuration file to set this for specific devices.
+WORKERS_PER_DEVICE = 2
+
+# The maximum number of bytes that can be being read for each device at the same time.
+# Each file counts as the size of the read buffers it needs, which is at most CHUNK_SIZE for each buffer
+# that READ_STRATEGY holds at once. This bounds the memory used by the read buffers.
+MAX_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+
+# Files move through the stages walk -> prepare -> look up -> read and verify -> record.
+# Each stage, and the read and verify stage of each device, has its own threads and a queue of at most
+# PIPELINE_QUEUE_SIZE files in front of it, so a slow stage holds back the stages before it instead of using
+# more memory.
+PIPELINE_QUEUE_SIZE = 1000
+
+# The number of threads that check files against the recency database without reading them.
+PREPARE_WORKERS = 2
+
+# The number of threads that look files up in the database, in batches of up to MONGO_LOOKUP_BATCH_SIZE files.
+# Reading files is done by WORKERS_PER_DEVICE threads for each device.
+LOOKUP_WORKERS = 2
+
+# The number of threads that record results in the recency database and the log.
+RECORD_WORKERS = 1
+
+# The number of hard-linked inodes whose checksums are kept for their other links during a run.
+# Links that are never reached, such as links outside the configured paths, would otherwise keep their inode's
+# checksums for the whole run, so the least recently used inodes are dropped beyond this.
+# A link whose inode was dropped is simply read again.
+INODE_CHECKSUM_CACHE_MAX_ENTRIES = 10000
+
+# The number of file IDs to look up in the database with a single query.
+# Larger batches mean fewer round trips to the database.
+MONGO_LOOKUP_BATCH_SIZE = 500
+
+# The number of database writes (last accessed updates and new records) to send in a single bulk write.
+MONGO_WRITE_BATCH_SIZE = 500
+
+# The number of file IDs to remove from the database with a single query when removing records in bulk.
+MONGO_DELETE_BATCH_SIZE = 1000
+
+# The number of file IDs that are sorted in memory at a time when finding orphan records.
+# Each sorted run is written to a temporary file and the runs are merged, so memory use does not grow with the tree.
+# A million file IDs use about 100 MB of memory.
+ORPHAN_SORT_RUN_SIZE = 1000 * 1000
+
+# The number of threads that hash files when fixing timestamps.
+# Files are only hashed when their size matches more than one record, or when checksums are verified.
+TIMESTAMP_FIX_HASH_WORKERS = 4
+
+# Whether to refuse to run when a query that is run for every file would scan the whole collection, because its index
+# is missing. If False, only a warning is printed. Run manage_indexes to create the indexes.
+REQUIRE_INDEXED_QUERIES = True
+
+# The files in the logs directory that metrics are written to at the end of each run.
+# The Prometheus textfile can be written elsewhere, such as the node exporter's textfile collector directory,
+# with "metrics_textfile_path" in the configuration file.
+METRICS_TEXTFILE_NAME = "bitrotchecker.prom"
+METRICS_JSON_FILE_NAME = "metrics.json"
+
+# How often to print the progress of a run (files and bytes done, throughput and the estimated time left).
+# Use --verbose to also print a line for every file.
+PROGRESS_REPORT_INTERVAL_SECONDS = 10
+
+# The file in the logs directory that the number of files and bytes seen by a full run is saved to.
+# The next run uses these as its totals when estimating the time left, unless --count-first is used.
+PROGRESS_TOTALS_FILE_NAME = "progress_totals.json"
+
+# How often the log files are flushed to disk while running. They are always flushed at the end of a run.
+LOG_FLUSH_INTERVAL_SECONDS = 5
+
+# The number of bytes of log messages to hold in memory before writing them, even between flushes.
+LOG_BUFFER_SIZE = 1024 * 1024
+
+# The file on disk that the change watcher queues the changed files of the mutable paths in.
+CHANGE_QUEUE_FILE_NAME = "change_queue.sqlite3"
+
+# How often the change watcher records that it is still running.
+# A run only trusts the change queue if the watcher has recorded this within the last two intervals.
+CHANGE_WATCHER_HEARTBEAT_SECONDS = 60
+
+# How many days a mutable path can go without a full walk while the change watcher is running.
+# Without a full walk, only the files in the change queue are processed, so unchanged files are not verified again
+# until the next full walk. Set this to 0 to always walk every path in full.
+WATCHED_FULL_WALK_INTERVAL_DAYS = 7
+
+# How long the daemon waits after finishing a cycle before starting the next one.
+# Cycles only run within the "active_hours" in the configuration file.
+DAEMON_CYCLE_PAUSE_SECONDS = 60 * 60
+
+# The local port that the daemon serves its status on, unless "status_port" is set in the configuration file.
+DAEMON_STATUS_PORT = 8787
+
 # Prefix strings to skip when processing files.
 # Each prefix is evaluated for every part of the path.
 # For example [".st"] means that C:\Program Files\MyProgram\.stver\test.txt would be skipped
@@ -33,13 +193,46 @@ SKIP_SUFFIXES = [".tmp"]
 # Mongo constants
 ########################
 # DO NOT modify these constants as they are fields in the database.
+# Field names are kept short since they are stored in every document.
 MONGO_ID_KEY = "_id"
-FILE_ID_KEY = "file_id"
-MODIFIED_TIME_KEY = "mtime"
-MODIFIED_TIME_S_KEY = "mtime_s"
-SIZE_KEY = "size"
-CHECKSUM_KEY = "checksum"
-LAST_ACCESSED_KEY = "last_accessed"
+# The SHA-256 of the file path, as 32 bytes of binary data
+FILE_ID_KEY = "f"
+# The modified time of the file in integer nanoseconds
+MODIFIED_TIME_NS_KEY = "m"
+SIZE_KEY = "s"
+CHECKSUM_KEY = "c"
+CHECKSUM_ALGORITHM_KEY = "a"
+BLOCK_CHECKSUMS_KEY = "b"
+BLOCK_SIZE_KEY = "bs"
+NEXT_BLOCK_KEY = "nb"
+LAST_ACCESSED_KEY = "l"
+
+# The collection that holds the version of the files collection's schema and the progress of a migration.
+SCHEMA_COLLECTION_NAME = "schema"
+FILES_SCHEMA_ID = "files"
+SCHEMA_VERSION_KEY = "version"
+LAST_MIGRATED_ID_KEY = "last_migrated_id"
+PENDING_INDEXES_KEY = "pending_indexes"
+# Version 1 is the legacy schema below. Version 2 is the compact schema above.
+FILES_SCHEMA_VERSION = 2
+
+# The fields of the legacy schema, which are only used to migrate old databases.
+# The file ID was a hex string and the modified time was a float of seconds.
+LEGACY_FILE_ID_KEY = "file_id"
+LEGACY_MODIFIED_TIME_KEY = "mtime"
+LEGACY_MODIFIED_TIME_S_KEY = "mtime_s"
+# The legacy fields that map directly to a compact field
+LEGACY_KEYS = {
+    LEGACY_FILE_ID_KEY: FILE_ID_KEY,
+    LEGACY_MODIFIED_TIME_KEY: MODIFIED_TIME_NS_KEY,
+    "size": SIZE_KEY,
+    "checksum": CHECKSUM_KEY,
+    "checksum_algorithm": CHECKSUM_ALGORITHM_KEY,
+    "block_checksums": BLOCK_CHECKSUMS_KEY,
+    "block_size": BLOCK_SIZE_KEY,
+    "next_block": NEXT_BLOCK_KEY,
+    "last_accessed": LAST_ACCESSED_KEY,
+}
 
 # Use 366 days in a year to round up
 SECONDS_IN_A_YEAR = 60 * 60 * 24 * 366
@@ -0,0 +1,179 @@
+import json
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, time as time_of_day
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from bitrotchecker.src.change_queue import ChangeQueue
+from bitrotchecker.src.configuration_util import (
+    get_immutable_paths,
+    get_mutable_paths,
+    get_healthcheck_url,
+    get_workers_per_device,
+    get_active_hours,
+    get_status_port,
+)
+from bitrotchecker.src.constants import DAEMON_STATUS_PORT
+from bitrotchecker.src.file_processor import FileProcessor
+
+TIME_OF_DAY_FORMAT = "%H:%M"
+
+
+class ActiveHours:
+    """
+    The hours of the day that the daemon verifies files in, which can run past midnight, such as 22:00 to 06:00.
+    """
+
+    def __init__(self, start: time_of_day, end: time_of_day):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def parse(cls, active_hours: Optional[List[str]]) -> Optional["ActiveHours"]:
+        """
+        Parses a ["HH:MM", "HH:MM"] start and end, or returns None to be active all day.
+        """
+        if active_hours is None:
+            return None
+        start, end = (datetime.strptime(hour, TIME_OF_DAY_FORMAT).time() for hour in active_hours)
+        return cls(start, end)
+
+    def __str__(self) -> str:
+        return f"{self.start.strftime(TIME_OF_DAY_FORMAT)} to {self.end.strftime(TIME_OF_DAY_FORMAT)}"
+
+    def is_active(self, now: datetime) -> bool:
+        current_time = now.time()
+        if self.start == self.end:
+            return True
+        if self.start < self.end:
+            return self.start <= current_time < self.end
+        return current_time >= self.start or current_time < self.end
+
+    def get_end(self, now: datetime) -> datetime:
+        """
+        Returns when the active hours that now is in end.
+        """
+        end = datetime.combine(now.date(), self.end)
+        return end if end > now else end + timedelta(days=1)
+
+    def get_next_start(self, now: datetime) -> datetime:
+        start = datetime.combine(now.date(), self.start)
+        return start if start > now else start + timedelta(days=1)
+
+
+@dataclass
+class DaemonConfig:
+    """
+    The configuration the daemon runs with, read once at startup and again whenever it is sent SIGHUP.
+    """
+
+    immutable_paths: List[str]
+    mutable_paths: List[str]
+    healthcheck_url: Optional[str]
+    workers_per_device: Dict[str, int]
+    active_hours: Optional[ActiveHours]
+    status_port: int
+
+    @classmethod
+    def load(cls) -> "DaemonConfig":
+        return cls(
+            immutable_paths=get_immutable_paths(),
+            mutable_paths=get_mutable_paths(),
+            healthcheck_url=get_healthcheck_url(),
+            workers_per_device=get_workers_per_device(),
+            active_hours=ActiveHours.parse(get_active_hours()),
+            status_port=get_status_port() or DAEMON_STATUS_PORT,
+        )
+
+
+class DaemonStatus:
+    """
+    What the daemon is doing, for the status endpoint. Updated by the daemon's main thread and read by the server.
+    """
+
+    def __init__(self, change_queue: ChangeQueue):
+        self.change_queue = change_queue
+        self.lock = threading.Lock()
+
+        self.state = "starting"
+        self.started_time = time.time()
+        self.cycles_completed = 0
+        self.cycle_start_time: Optional[float] = None
+        self.next_cycle_time: Optional[float] = None
+        self.last_cycle: Optional[Dict[str, Any]] = None
+        self.file_processor: Optional[FileProcessor] = None
+
+    def start_cycle(self):
+        with self.lock:
+            self.state = "verifying"
+            self.cycle_start_time = time.time()
+            self.next_cycle_time = None
+
+    def set_file_processor(self, file_processor: Optional[FileProcessor]):
+        with self.lock:
+            self.file_processor = file_processor
+
+    def finish_cycle(self, **summary):
+        with self.lock:
+            self.cycles_completed += 1
+            self.last_cycle = {
+                "started_time": self.cycle_start_time,
+                "finished_time": time.time(),
+                **summary,
+            }
+            self.cycle_start_time = None
+            self.file_processor = None
+
+    def wait_until(self, next_cycle_time: float, reason: str):
+        with self.lock:
+            self.state = reason
+            self.next_cycle_time = next_cycle_time
+
+    def get_status(self) -> Dict[str, Any]:
+        with self.lock:
+            status = {
+                "state": self.state,
+                "started_time": self.started_time,
+                "cycles_completed": self.cycles_completed,
+                "cycle_start_time": self.cycle_start_time,
+                "next_cycle_time": self.next_cycle_time,
+                "last_cycle": self.last_cycle,
+                "queued_changes": self.change_queue.count_changes(),
+            }
+            file_processor = self.file_processor
+
+        if file_processor is not None:
+            if file_processor.progress_reporter is not None:
+                status["progress"] = file_processor.progress_reporter.get_progress()
+            status["queue_sizes"] = file_processor.get_queue_sizes()
+        return status
+
+
+def start_status_server(daemon_status: DaemonStatus, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves the daemon's status as JSON on a local port, from a background thread.
+    """
+
+    class _StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ["/", "/status"]:
+                self.send_error(404)
+                return
+
+            body = json.dumps(daemon_status.get_status(), default=str).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # A request is not worth a line in the daemon's output
+            pass
+
+    server = ThreadingHTTPServer((host, port), _StatusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="status-server", daemon=True).start()
+    return server
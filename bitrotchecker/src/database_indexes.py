@@ -0,0 +1,180 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import pymongo
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure, PyMongoError
+
+from bitrotchecker.src.constants import (
+    FILE_ID_KEY,
+    MODIFIED_TIME_NS_KEY,
+    LAST_ACCESSED_KEY,
+    REQUIRE_INDEXED_QUERIES,
+)
+from bitrotchecker.src.file_record import encode_file_id
+
+# Stands in for a real file ID when asking the database how it would run a query
+_EXAMPLE_FILE_ID = encode_file_id("00" * 32)
+
+SECONDS_IN_A_DAY = 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    keys: List[Tuple[str, int]]
+    options: Dict[str, Any] = field(default_factory=dict)
+    # Why the index is needed
+    description: str = ""
+
+
+REQUIRED_INDEXES = [
+    IndexSpec(
+        [(FILE_ID_KEY, pymongo.ASCENDING), (MODIFIED_TIME_NS_KEY, pymongo.ASCENDING)],
+        {"unique": True},
+        # A query on only the file ID uses the start of this index, so it does not need an index of its own
+        "finds a file's record by file ID and modified time, or every record of a file by file ID",
+    ),
+]
+
+# The keys of the optional TTL index that deletes records that have not been accessed for a while
+EXPIRY_INDEX_KEYS = [(LAST_ACCESSED_KEY, pymongo.ASCENDING)]
+
+
+def get_expiry_index(record_expiry_days: int) -> IndexSpec:
+    return IndexSpec(
+        EXPIRY_INDEX_KEYS,
+        {"expireAfterSeconds": record_expiry_days * SECONDS_IN_A_DAY},
+        f"deletes records that have not been accessed for {record_expiry_days} days",
+    )
+
+
+def _get_hot_queries(collection_name: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the queries that are run for every file, as explain commands.
+    """
+    return {
+        "find by file ID and modified time": {
+            "find": collection_name,
+            "filter": {FILE_ID_KEY: _EXAMPLE_FILE_ID, MODIFIED_TIME_NS_KEY: 0},
+            "limit": 1,
+        },
+        "find by file ID": {"find": collection_name, "filter": {FILE_ID_KEY: _EXAMPLE_FILE_ID}},
+        "find a batch of file IDs": {"find": collection_name, "filter": {FILE_ID_KEY: {"$in": [_EXAMPLE_FILE_ID]}}},
+        "delete by file ID": {
+            "delete": collection_name,
+            "deletes": [{"q": {FILE_ID_KEY: _EXAMPLE_FILE_ID}, "limit": 0}],
+        },
+    }
+
+
+def _find_index(collection: Collection, index_spec: IndexSpec) -> Optional[Tuple[str, Mapping[str, Any]]]:
+    for name, index in collection.index_information().items():
+        if [(key, direction) for key, direction in index["key"]] == index_spec.keys:
+            return name, index
+    return None
+
+
+def ensure_indexes(collection: Collection, record_expiry_days: Optional[int] = None) -> List[str]:
+    """
+    Creates every required index that does not exist yet, and checks the options of those that do.
+    The TTL index that deletes records is only created if record_expiry_days is given.
+    Returns a line describing each index.
+    """
+    lines = []
+    index_specs = list(REQUIRED_INDEXES)
+    if record_expiry_days is None:
+        existing_index = _find_index(collection, IndexSpec(EXPIRY_INDEX_KEYS))
+        if existing_index is not None and "expireAfterSeconds" in existing_index[1]:
+            lines.append(
+                f"WARNING: Index {existing_index[0]} deletes records that have not been accessed for"
+                f" {existing_index[1]['expireAfterSeconds']} seconds, but record_expiry_days is not configured."
+                f" Drop it unless records should expire."
+            )
+    else:
+        lines.append(
+            f"WARNING: Records that have not been accessed for {record_expiry_days} days are deleted."
+            f" A file that is not verified within that time, such as with a budgeted run, is recorded again as a new"
+            f" file, and any rot in it is accepted."
+        )
+        index_specs.append(get_expiry_index(record_expiry_days))
+
+    for index_spec in index_specs:
+        keys = ", ".join(key for key, _ in index_spec.keys)
+        existing_index = _find_index(collection, index_spec)
+        if existing_index is None:
+            try:
+                name = collection.create_index(index_spec.keys, **index_spec.options)
+            except PyMongoError as e:
+                lines.append(f"FAIL: Could not create the index on {keys}: {e}")
+                continue
+            lines.append(f"Created index {name}, which {index_spec.description}")
+            continue
+
+        name, index = existing_index
+        different_options = {
+            option: index.get(option) for option, value in index_spec.options.items() if index.get(option) != value
+        }
+        if different_options:
+            lines.append(
+                f"FAIL: Index {name} has the options {different_options} instead of {index_spec.options}."
+                f" Drop it and run this again to recreate it."
+            )
+        else:
+            lines.append(f"Index {name} is valid")
+
+    return lines
+
+
+def get_index_sizes(collection: Collection) -> Optional[Dict[str, int]]:
+    """
+    Returns the size in bytes of each index of the collection, or None if the database does not report them.
+    """
+    try:
+        stats = next(collection.aggregate([{"$collStats": {"storageStats": {}}}]))
+    except (PyMongoError, NotImplementedError, StopIteration):
+        return None
+    return dict(stats["storageStats"]["indexSizes"])
+
+
+def _uses_collection_scan(plan: Any) -> bool:
+    # Plans are trees of stages, nested differently depending on the server version
+    if isinstance(plan, Mapping):
+        return plan.get("stage") == "COLLSCAN" or any(_uses_collection_scan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_uses_collection_scan(value) for value in plan)
+    return False
+
+
+def find_collection_scans(collection: Collection) -> List[str]:
+    """
+    Asks the database how it would run each hot query, and returns the ones that would scan the whole collection.
+    """
+    collection_scans = []
+    for query_name, query in _get_hot_queries(collection.name).items():
+        explain_result = collection.database.command({"explain": query, "verbosity": "queryPlanner"})
+        if _uses_collection_scan(explain_result["queryPlanner"]["winningPlan"]):
+            collection_scans.append(query_name)
+    return collection_scans
+
+
+def check_query_plans(collection: Collection, require_indexed_queries: bool = REQUIRE_INDEXED_QUERIES):
+    """
+    Warns about, or refuses to continue with, hot queries that would scan the whole collection for every file.
+    """
+    try:
+        collection_scans = find_collection_scans(collection)
+    except OperationFailure as e:
+        # Not every database lets every user run explain
+        print(f"Could not check the query plans: {e}")
+        return
+
+    if not collection_scans:
+        return
+
+    message = (
+        f"These queries would scan the whole collection: {', '.join(collection_scans)}."
+        f" Run `python -m bitrotchecker.src.manage_indexes` to create the indexes they need."
+    )
+    if require_indexed_queries:
+        raise ValueError(message)
+    print(f"WARNING: {message}")
@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Callable, List
+
+from bitrotchecker.src.byte_budget import ByteBudget
+from bitrotchecker.src.pipeline_stage import StageMetrics
+
+# Put on a device's queue to tell its workers that no more work is coming
+_DONE = object()
+
+
+class _Device:
+    """
+    The queue of one device and the workers that take work from it.
+    """
+
+    def __init__(self, device: int, num_workers: int, queue_size: int, max_in_flight_bytes: int):
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.byte_budget = ByteBudget(max_in_flight_bytes)
+        self.metrics = StageMetrics(f"device {device}", num_workers, queue_size)
+        self.threads: List[threading.Thread] = [
+            threading.Thread(target=self._work, name=f"device-{device}-{i}", daemon=True) for i in range(num_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while (work := self.queue.get()) is not _DONE:
+            future, in_flight_bytes, function, args = work
+            self.byte_budget.acquire(in_flight_bytes)
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                start_time = time.monotonic()
+                try:
+                    future.set_result(function(*args))
+                except Exception as e:
+                    future.set_exception(e)
+                finally:
+                    self.metrics.record_work(1, time.monotonic() - start_time)
+            finally:
+                self.byte_budget.release(in_flight_bytes)
+
+        # Leave the marker for the other workers
+        self.queue.put(_DONE)
+
+    def close(self):
+        """
+        Waits for every queued piece of work to finish and stops the workers.
+        """
+        self.queue.put(_DONE)
+        for thread in self.threads:
+            thread.join()
+
+
+class DevicePool:
+    """
+    Runs work on a separate set of threads for each device (as identified by st_dev).
+
+    Every device is worked on at the same time, but each device only has its own number of workers,
+    so a spinning disk is never read by more sequential readers than it can handle.
+    Each device has its own queue and in-flight byte budget, and only its own workers wait for the budget,
+    so a slow device cannot hold up the others. Submitting only waits while the device's queue is full.
+    """
+
+    def __init__(
+        self,
+        workers_per_device: int,
+        max_in_flight_bytes: int,
+        device_workers: Optional[Dict[int, int]] = None,
+        queue_size: int = 0,
+    ):
+        self.workers_per_device = workers_per_device
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.device_workers = device_workers or {}
+        self.queue_size = queue_size
+
+        self.lock = threading.Lock()
+        self._devices: Dict[int, _Device] = {}
+        self.metrics: Dict[int, StageMetrics] = {}
+
+    def __enter__(self) -> "DevicePool":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def _get_device(self, device: int) -> _Device:
+        with self.lock:
+            if device not in self._devices:
+                num_workers = self.device_workers.get(device, self.workers_per_device)
+                self._devices[device] = _Device(device, num_workers, self.queue_size, self.max_in_flight_bytes)
+                self.metrics[device] = self._devices[device].metrics
+            return self._devices[device]
+
+    def submit(self, device: int, in_flight_bytes: int, function: Callable, *args) -> Future:
+        """
+        Queues the function to run on one of the device's workers once the device has room for in_flight_bytes more
+        bytes. Only waits while the device's queue is full.
+        """
+        pool_device = self._get_device(device)
+        future: Future = Future()
+        pool_device.queue.put((future, in_flight_bytes, function, args))
+        pool_device.metrics.record_queue_depth(pool_device.queue.qsize())
+        return future
+
+    def get_queue_sizes(self) -> Dict[str, int]:
+        """
+        Returns the number of submitted files that have not started yet on each device.
+        """
+        with self.lock:
+            return {f"device {device}": pool_device.queue.qsize() for device, pool_device in self._devices.items()}
+
+    def shutdown(self):
+        """
+        Waits for all submitted work to finish.
+        """
+        with self.lock:
+            devices = list(self._devices.values())
+            self._devices.clear()
+
+        for pool_device in devices:
+            pool_device.close()
@@ -1,59 +1,546 @@
 import os
-from typing import Optional
+from dataclasses import dataclass
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from itertools import islice
+from typing import Optional, Iterable, Iterator, Callable, TypeVar, List, Tuple, Dict
 
+from bitrotchecker.src.checksum_checkpoint_util import ChecksumCheckpointUtil
+from bitrotchecker.src.constants import (
+    WORKERS_PER_DEVICE,
+    MAX_IN_FLIGHT_BYTES,
+    CHUNK_SIZE,
+    PREPARE_WORKERS,
+    LOOKUP_WORKERS,
+    RECORD_WORKERS,
+    PIPELINE_QUEUE_SIZE,
+)
+from bitrotchecker.src.device_pool import DevicePool
+from bitrotchecker.src.file_reader import get_buffers_per_file
 from bitrotchecker.src.file_record import FileRecord
+from bitrotchecker.src.inode_checksum_cache import InodeChecksumCache
+from bitrotchecker.src.file_result import FileResult
 from bitrotchecker.src.file_result_enum import FileResultValue
 from bitrotchecker.src.file_util import should_skip_file
+from bitrotchecker.src.io_throttle import IO_THROTTLE
 from bitrotchecker.src.logger_util import LoggerUtil
 from bitrotchecker.src.mongo_util import MongoUtil
+from bitrotchecker.src.pipeline_stage import PipelineStage, StageMetrics
+from bitrotchecker.src.processing_summary import ProcessingSummary
+from bitrotchecker.src.progress_reporter import ProgressReporter
 from bitrotchecker.src.recency_util import RecencyUtil
+from bitrotchecker.src.run_metrics import METRICS
+
+# Even an empty file has some overhead while it is queued, so never count a file as smaller than this.
+MINIMUM_IN_FLIGHT_BYTES = 64 * 1024
+
+T = TypeVar("T")
+
+
+def _batched(iterable: Iterable[T], batch_size: int) -> Iterable[List[T]]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+@dataclass
+class _PipelineFile:
+    """
+    A file moving through the processing pipeline, gaining more information at each stage.
+    """
+
+    path: str
+    file_entry: os.DirEntry
+    file_is_immutable: bool
+    summary: ProcessingSummary
+    device: Optional[int] = None
+    file_record: Optional[FileRecord] = None
+    file_result: Optional[FileResult] = None
+    # Whether the file has been added to its summary, so that a file is never counted twice
+    counted: bool = False
+
+    @classmethod
+    def from_entries(
+        cls, path: str, file_entries: Iterable[os.DirEntry], file_is_immutable: bool, summary: ProcessingSummary
+    ) -> Iterator["_PipelineFile"]:
+        for file_entry in file_entries:
+            yield cls(path, file_entry, file_is_immutable, summary)
 
 
 class FileProcessor:
-    def __init__(self, recency_util: RecencyUtil, mongo_util: MongoUtil, logger: LoggerUtil):
+    def __init__(
+        self,
+        recency_util: RecencyUtil,
+        mongo_util: MongoUtil,
+        logger: LoggerUtil,
+        workers_per_device: int = WORKERS_PER_DEVICE,
+        max_in_flight_bytes: int = MAX_IN_FLIGHT_BYTES,
+        checksum_checkpoint_util: Optional[ChecksumCheckpointUtil] = None,
+        device_workers: Optional[Dict[int, int]] = None,
+        verbose: bool = False,
+        progress_reporter: Optional[ProgressReporter] = None,
+    ):
         self.recency_util = recency_util
         self.mongo_util = mongo_util
         self.logger = logger
+        self.workers_per_device = workers_per_device
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.checksum_checkpoint_util = checksum_checkpoint_util
+        # Each inode with several hard links is only read once while this processor is used, which is a single run
+        self.inode_checksum_cache = InodeChecksumCache()
+        # The number of workers for specific devices (by st_dev), overriding workers_per_device
+        self.device_workers = device_workers
+        # Whether to print a line for every file. Failures are always written to the log.
+        self.verbose = verbose
+        self.progress_reporter = progress_reporter
+
+        # Guards the counters and the failed files when processing files concurrently
+        self.lock = threading.Lock()
 
         self.total_skips = 0
         self.num_success = 0
         self.num_failures = 0
         self.failed_files = []
+        # The metrics of each stage from the last time files were processed
+        self.stage_metrics: List[StageMetrics] = []
+        # Whether the last files processed stopped early because the deadline passed or stop() was called
+        self.deadline_reached = False
+        # The exceptions logged while the last files were processed, each of which may have left a file unrecorded
+        self.exceptions_logged = 0
+        self._stop_requested = threading.Event()
+        # The stages of the pipeline while files are being processed, to report their queue sizes
+        self._running_stages: List[PipelineStage] = []
+        self._running_device_pool: Optional[DevicePool] = None
 
-    def _process_file(self, root: str, path: str, true_file_path: str, file_is_immutable: bool) -> Optional[bool]:
-        if should_skip_file(true_file_path):
-            self.total_skips += 1
-            print(f"Skipping {true_file_path} as ignored")
+    def _prepare_file(
+        self, path: str, true_file_path: str, stat_result: os.stat_result, skip_recently_processed: bool = True
+    ) -> Optional[FileRecord]:
+        """
+        Does the cheap checks that can skip a file without reading it.
+        Returns a snapshot of the file if it needs to be verified.
+        """
+        file_path = true_file_path.replace(path, "")
+        file_record = FileRecord.from_stat(
+            file_path=file_path,
+            full_file_path=true_file_path,
+            stat_result=stat_result,
+            checksum_checkpoint_util=self.checksum_checkpoint_util,
+            inode_checksum_cache=self.inode_checksum_cache,
+        )
+
+        if skip_recently_processed and self.recency_util.file_processed_recently(
+            true_file_path, file_record.modified_time
+        ):
+            with self.lock:
+                self.total_skips += 1
+            METRICS.increment("files_skipped", reason="recently_verified")
+            if self.verbose:
+                print(f"Skipping {true_file_path} as processed recently")
             return None
 
-        file_modified_time = os.path.getmtime(true_file_path)
+        return file_record
 
-        if self.recency_util.file_processed_recently(true_file_path, file_modified_time):
-            self.total_skips += 1
-            print(f"Skipping {true_file_path} as processed recently")
-            return None
+    def _verify_file(self, file_record: FileRecord, file_is_immutable: bool) -> Optional[bool]:
+        return self._record_result(file_record, self._check_file(file_record, file_is_immutable))
+
+    def _check_file(self, file_record: FileRecord, file_is_immutable: bool) -> FileResult:
+        """
+        Reads the file and compares it against the database.
+        """
+        start_time = time.perf_counter()
+        with METRICS.time("verify"):
+            file_result = self.mongo_util.process_file_record(
+                file_record.full_file_path, file_record, self.logger, file_is_immutable
+            )
+        file_result.duration_seconds = time.perf_counter() - start_time
+        return file_result
+
+    def _record_result(self, file_record: FileRecord, file_result: FileResult) -> Optional[bool]:
+        true_file_path = file_record.full_file_path
+        METRICS.increment("files_verified", result=file_result.value.name.lower())
+        # Only failures are logged unless verbose, so only build the events that will be written
+        if file_result.value is FileResultValue.FAIL or self.verbose:
+            self._write_result_event(file_record, file_result)
 
-        file_path = true_file_path.replace(path, "")
-        file_record = FileRecord(file_path=file_path, full_file_path=true_file_path)
-        file_result = self.mongo_util.process_file_record(true_file_path, file_record, self.logger, file_is_immutable)
         if file_result.value is FileResultValue.PASS:
-            print(f"PASS: {file_result.message} - {file_record}")
-            # We only want to log successful files as processed
-            self.recency_util.record_file_processed(true_file_path, file_modified_time)
+            if self.verbose:
+                print(f"PASS: {file_result.message} - {file_record}")
+            # We only want to log successful files as processed, and only once the whole file has been verified
+            # and its record is in the database
+            if file_result.complete:
+                if file_result.written is None:
+                    self.recency_util.record_file_processed(true_file_path, file_record.modified_time)
+                else:
+                    file_result.written.add_done_callback(
+                        lambda written: self._run_safely(self._record_written, file_record, written)
+                    )
             # Return the success
             return True
         elif file_result.value is file_result.value.FAIL:
-            self.logger.write(f"FAIL: {file_result.message} - {file_record}")
-            self.failed_files.append(f"{true_file_path} - {file_result.message}")
+            with self.lock:
+                self.failed_files.append(f"{true_file_path} - {file_result.message}")
             # Return the failures
             return False
         elif file_result.value is file_result.value.SKIP:
-            print(f"SKIP: {file_result.message} - {file_record}")
+            if self.verbose:
+                print(f"SKIP: {file_result.message} - {file_record}")
             return None
 
-    def process_file(self, root: str, path: str, true_file_path: str, file_is_immutable: bool) -> Optional[bool]:
+    def _record_written(self, file_record: FileRecord, written: Future):
+        """
+        Records a file as processed once the buffered write of its record has been sent to the database.
+        If the write failed, the file is verified again by the next run.
+        """
+        error = written.exception()
+        if error is None:
+            self.recency_util.record_file_processed(file_record.full_file_path, file_record.modified_time)
+            return
+        with self.lock:
+            self.exceptions_logged += 1
+        self.logger.write(
+            f"EXCEPTION: Could not write the record of {file_record.full_file_path}: {error}",
+            event="exception",
+            exception_type=type(error).__name__,
+            path=file_record.full_file_path,
+        )
+
+    def _write_result_event(self, file_record: FileRecord, file_result: FileResult):
+        event_fields = {
+            "result": file_result.value.name.lower(),
+            "path": file_record.full_file_path,
+            "file_id": file_record.file_id,
+            "size": file_record.size,
+            "duration_seconds": file_result.duration_seconds,
+            **file_result.details,
+        }
+        if file_result.value is FileResultValue.FAIL:
+            self.logger.write(f"FAIL: {file_result.message} - {file_record}", event="file_result", **event_fields)
+        else:
+            self.logger.write_event("file_result", message=file_result.message, **event_fields)
+
+    def _process_file(self, root: str, path: str, true_file_path: str, file_is_immutable: bool) -> Optional[bool]:
+        if should_skip_file(true_file_path):
+            with self.lock:
+                self.total_skips += 1
+            METRICS.increment("files_skipped", reason="ignored")
+            if self.verbose:
+                print(f"Skipping {true_file_path} as ignored")
+            return None
+
+        file_record = self._prepare_file(path, true_file_path, os.stat(true_file_path))
+        if file_record is None:
+            return None
+
+        return self._verify_file(file_record, file_is_immutable)
+
+    def _run_safely(self, function: Callable[..., T], *args) -> Optional[T]:
         try:
-            return self._process_file(root, path, true_file_path, file_is_immutable)
+            return function(*args)
         except Exception as e:
-            self.logger.write(f"EXCEPTION: {e}")
+            self._log_exception(e)
             return None
+
+    def _log_exception(self, e: Exception):
+        with self.lock:
+            self.exceptions_logged += 1
+        self.logger.write(f"EXCEPTION: {e}", event="exception", exception_type=type(e).__name__)
+
+    def _run_stage_safely(
+        self,
+        function: Callable[[List["_PipelineFile"]], Optional[Iterable["_PipelineFile"]]],
+        pipeline_files: List["_PipelineFile"],
+    ) -> Optional[Iterable["_PipelineFile"]]:
+        """
+        Runs a stage of the pipeline on a batch of files. If it raises, the files of the batch that were not counted
+        yet are counted as skipped, so that the summaries still add up to every file.
+        """
+        try:
+            return function(pipeline_files)
+        except Exception as e:
+            self._log_exception(e)
+            self._skip_files(pipeline_files, reason="error")
+            return None
+
+    def process_file(self, root: str, path: str, true_file_path: str, file_is_immutable: bool) -> Optional[bool]:
+        return self._run_safely(self._process_file, root, path, true_file_path, file_is_immutable)
+
+    def process_files(
+        self, path: str, file_entries: Iterable[os.DirEntry], file_is_immutable: bool
+    ) -> ProcessingSummary:
+        """
+        Processes every given file under the given path.
+        The entries are expected to come from walk_files, which has already left out files that should be skipped.
+        """
+        return self.process_paths([(path, file_entries, file_is_immutable)])[path]
+
+    def process_paths(
+        self, paths: List[Tuple[str, Iterable[os.DirEntry], bool]], deadline: Optional[float] = None
+    ) -> Dict[str, ProcessingSummary]:
+        """
+        Processes the (path, file entries, file is immutable) paths at the same time, with one thread walking each path.
+        Files are read by the workers of the device they are on, so paths on different devices are read in parallel
+        while each device only has workers_per_device readers.
+        No more files are started once the time.monotonic() deadline has passed.
+        Returns the summary of each path.
+        """
+        summaries = {path: ProcessingSummary() for path, _, _ in paths}
+        walks = [
+            _PipelineFile.from_entries(path, file_entries, file_is_immutable, summaries[path])
+            for path, file_entries, file_is_immutable in paths
+        ]
+        self._run_pipeline(walks, deadline=deadline)
+        return summaries
+
+    def process_scheduled_files(
+        self, scheduled_entries: Iterable[Tuple[str, os.DirEntry, bool]], deadline: Optional[float] = None
+    ) -> ProcessingSummary:
+        """
+        Processes (path, file entry, file is immutable) entries picked by the VerificationScheduler.
+        Every entry is verified even if it was processed recently, since the scheduler has already picked the files
+        that are most overdue. No more files are started once the time.monotonic() deadline has passed.
+        """
+        summary = ProcessingSummary()
+        walk = (
+            _PipelineFile(path, file_entry, file_is_immutable, summary)
+            for path, file_entry, file_is_immutable in scheduled_entries
+        )
+        self._run_pipeline([walk], skip_recently_processed=False, deadline=deadline)
+        return summary
+
+    def stop(self):
+        """
+        Stops starting new files, such as when the program is asked to exit. Files already started are finished,
+        except for files that are paused by the read limits, which are abandoned and verified again by the next run.
+        """
+        self._stop_requested.set()
+        IO_THROTTLE.stop()
+
+    def get_queue_sizes(self) -> Dict[str, int]:
+        """
+        Returns the number of files waiting in front of each stage of the pipeline, while files are being processed.
+        """
+        queue_sizes = {stage.name: stage.queue.qsize() for stage in self._running_stages}
+        if self._running_device_pool is not None:
+            queue_sizes.update(self._running_device_pool.get_queue_sizes())
+        return queue_sizes
+
+    def _create_device_pool(self) -> DevicePool:
+        return DevicePool(
+            self.workers_per_device, self.max_in_flight_bytes, self.device_workers, queue_size=PIPELINE_QUEUE_SIZE
+        )
+
+    def _run_pipeline(
+        self,
+        walks: List[Iterable["_PipelineFile"]],
+        skip_recently_processed: bool = True,
+        deadline: Optional[float] = None,
+    ):
+        """
+        Runs the walked files through the stages walk -> prepare -> look up -> read and verify -> record.
+        Each stage has its own workers and a bounded queue in front of it, so a file that was processed recently
+        never waits behind a large file being read, and database lookups happen while other files are being read.
+        The read and verify stage has its own workers and queue for each device, so the lookup workers never wait
+        for a slow device unless it already has a full queue of files.
+        """
+        out_of_time = threading.Event()
+
+        def _deadline_passed() -> bool:
+            if not out_of_time.is_set() and deadline is not None and time.monotonic() >= deadline:
+                print("Time budget used up. Not starting any more files.")
+                out_of_time.set()
+            if not out_of_time.is_set() and self._stop_requested.is_set():
+                print("Stopping. Not starting any more files.")
+                out_of_time.set()
+            return out_of_time.is_set()
+
+        record_stage = PipelineStage(
+            "record",
+            lambda batch: self._run_stage_safely(self._record_files, batch),
+            RECORD_WORKERS,
+            PIPELINE_QUEUE_SIZE,
+            on_error=self._log_exception,
+        )
+        device_pool = self._create_device_pool()
+        lookup_stage = PipelineStage(
+            "look up",
+            lambda batch: self._run_stage_safely(
+                lambda pipeline_files: self._look_up_files(pipeline_files, device_pool, record_stage, _deadline_passed),
+                batch,
+            ),
+            LOOKUP_WORKERS,
+            PIPELINE_QUEUE_SIZE,
+            batch_size=self.mongo_util.lookup_batch_size,
+            on_error=self._log_exception,
+        )
+        prepare_stage = PipelineStage(
+            "prepare",
+            lambda batch: self._run_stage_safely(
+                lambda pipeline_files: self._prepare_files(pipeline_files, skip_recently_processed), batch
+            ),
+            PREPARE_WORKERS,
+            PIPELINE_QUEUE_SIZE,
+            output=lookup_stage.put,
+            on_error=self._log_exception,
+        )
+        walk_metrics = StageMetrics("walk", len(walks), queue_size=0)
+        self._running_stages = [prepare_stage, lookup_stage, record_stage]
+        with self.lock:
+            self.exceptions_logged = 0
+        self._running_device_pool = device_pool
+        if not self._stop_requested.is_set():
+            IO_THROTTLE.resume()
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(walks)), thread_name_prefix="walk") as walkers:
+                futures = [
+                    walkers.submit(self._walk, walk, prepare_stage, walk_metrics, _deadline_passed) for walk in walks
+                ]
+        finally:
+            # Each stage is only closed once every stage before it has finished, so no file is left behind
+            prepare_stage.close()
+            lookup_stage.close()
+            device_pool.shutdown()
+            record_stage.close()
+            self._running_stages = []
+            self._running_device_pool = None
+            self.deadline_reached = out_of_time.is_set()
+            if self.progress_reporter is not None:
+                self.progress_reporter.finish()
+            # Files are only recorded as processed once their buffered writes are sent, which happens here for the
+            # last batch. A failure must not hide an exception from the pipeline itself.
+            self._run_safely(self.mongo_util.flush)
+
+        self.stage_metrics = [
+            walk_metrics,
+            prepare_stage.metrics,
+            lookup_stage.metrics,
+            *device_pool.metrics.values(),
+            record_stage.metrics,
+        ]
+        print("\nPipeline stages:")
+        for stage_metrics in self.stage_metrics:
+            print(f"  {stage_metrics}")
+
+        for future in futures:
+            future.result()
+
+    def _walk(
+        self,
+        walk: Iterable["_PipelineFile"],
+        prepare_stage: PipelineStage,
+        walk_metrics: StageMetrics,
+        deadline_passed: Callable[[], bool],
+    ):
+        iterator = iter(walk)
+        while True:
+            start_time = time.monotonic()
+            pipeline_file = next(iterator, None)
+            walk_seconds = time.monotonic() - start_time
+            walk_metrics.record_work(0 if pipeline_file is None else 1, walk_seconds)
+            METRICS.observe("walk", walk_seconds)
+            if pipeline_file is None:
+                return
+            if deadline_passed():
+                self._skip_files([pipeline_file], reason="deadline")
+                return
+            prepare_stage.put(pipeline_file)
+
+    def _prepare_files(
+        self, pipeline_files: List["_PipelineFile"], skip_recently_processed: bool
+    ) -> Iterable["_PipelineFile"]:
+        prepared_files = []
+        for pipeline_file in pipeline_files:
+            stat_result = self._run_safely(pipeline_file.file_entry.stat)
+            if stat_result is not None:
+                pipeline_file.device = stat_result.st_dev
+                pipeline_file.file_record = self._run_safely(
+                    self._prepare_file,
+                    pipeline_file.path,
+                    pipeline_file.file_entry.path,
+                    stat_result,
+                    skip_recently_processed,
+                )
+
+            if pipeline_file.file_record is None:
+                self._add_result(pipeline_file, None, 0 if stat_result is None else stat_result.st_size)
+            else:
+                prepared_files.append(pipeline_file)
+
+        return prepared_files
+
+    def _look_up_files(
+        self,
+        pipeline_files: List["_PipelineFile"],
+        device_pool: DevicePool,
+        record_stage: PipelineStage,
+        deadline_passed: Callable[[], bool],
+    ):
+        # If the lookup fails, each file falls back to looking itself up
+        self._run_safely(
+            self.mongo_util.prefetch_file_ids, [pipeline_file.file_record.file_id for pipeline_file in pipeline_files]
+        )
+
+        def _on_checked(pipeline_file: _PipelineFile, future: Future):
+            pipeline_file.file_result = future.result()
+            record_stage.put(pipeline_file)
+
+        for index, pipeline_file in enumerate(pipeline_files):
+            if deadline_passed():
+                self._skip_files(pipeline_files[index:], reason="deadline")
+                return
+
+            file_record = pipeline_file.file_record
+            future = device_pool.submit(
+                pipeline_file.device,
+                self._get_in_flight_bytes(file_record),
+                self._run_safely,
+                self._check_file,
+                file_record,
+                pipeline_file.file_is_immutable,
+            )
+            future.add_done_callback(lambda f, p=pipeline_file: _on_checked(p, f))
+
+    def _record_files(self, pipeline_files: List["_PipelineFile"]):
+        for pipeline_file in pipeline_files:
+            success = None
+            if pipeline_file.file_result is not None:
+                success = self._run_safely(self._record_result, pipeline_file.file_record, pipeline_file.file_result)
+            self._add_result(pipeline_file, success, pipeline_file.file_record.size)
+
+    def _add_result(self, pipeline_file: "_PipelineFile", success: Optional[bool], num_bytes: int) -> bool:
+        """
+        Adds the result of the file to its summary, unless it has already been counted.
+        Returns whether it was counted now.
+        """
+        with self.lock:
+            if pipeline_file.counted:
+                return False
+            pipeline_file.counted = True
+            pipeline_file.summary.add_result(success)
+        if self.progress_reporter is not None:
+            # Skipped files were not read, so they do not count towards the read throughput or the time left
+            self.progress_reporter.add(1, num_bytes, skipped=success is None)
+        return True
+
+    def _skip_files(self, pipeline_files: List["_PipelineFile"], reason: str):
+        """
+        Counts files that are dropped from the pipeline without being verified as skipped.
+        """
+        for pipeline_file in pipeline_files:
+            if self._add_result(pipeline_file, None, self._get_size(pipeline_file)):
+                METRICS.increment("files_skipped", reason=reason)
+
+    @staticmethod
+    def _get_size(pipeline_file: "_PipelineFile") -> int:
+        if pipeline_file.file_record is not None:
+            return pipeline_file.file_record.size
+        try:
+            return pipeline_file.file_entry.stat().st_size
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _get_in_flight_bytes(file_record: FileRecord) -> int:
+        # A file only ever holds the read strategy's chunk buffers in memory while it is being read
+        return max(MINIMUM_IN_FLIGHT_BYTES, min(file_record.size, CHUNK_SIZE) * get_buffers_per_file())
@@ -0,0 +1,159 @@
+import io
+import mmap
+import os
+import queue
+import threading
+from typing import IO, Iterator, Optional, Union
+
+from bitrotchecker.src.constants import CHUNK_SIZE, READ_STRATEGY, DROP_READ_DATA_FROM_PAGE_CACHE
+from bitrotchecker.src.io_throttle import IO_THROTTLE
+from bitrotchecker.src.run_metrics import METRICS
+
+# Calls file.read for every chunk, allocating a new bytes object each time
+READ = "read"
+# Reads every chunk into the same preallocated buffer
+READ_INTO = "readinto"
+# Maps the file into memory and hands out views of it, so nothing is copied
+MMAP = "mmap"
+# Reads the next chunk on a background thread while the current chunk is being checksummed
+DOUBLE_BUFFER = "double_buffer"
+
+READ_STRATEGIES = [READ, READ_INTO, MMAP, DOUBLE_BUFFER]
+
+
+def get_buffers_per_file(read_strategy: str = READ_STRATEGY) -> int:
+    """
+    Returns how many chunks of up to CHUNK_SIZE bytes the read strategy holds in memory at once for a file.
+    """
+    # The double buffered strategy reads the next chunk into a second buffer while the first is checksummed
+    return 2 if read_strategy == DOUBLE_BUFFER else 1
+
+
+def read_chunks(
+    file: IO,
+    read_strategy: str = READ_STRATEGY,
+    drop_from_page_cache: bool = DROP_READ_DATA_FROM_PAGE_CACHE,
+) -> Iterator[Union[bytes, memoryview]]:
+    """
+    Yields the rest of the file in chunks of up to CHUNK_SIZE bytes, starting from the current position.
+
+    Chunks may be views into a reused buffer, so each chunk is only valid until the next one is requested.
+    Where the platform supports it, the kernel is told that the file is read sequentially, and data that has
+    already been read is dropped from the page cache so that cold archive data does not push out everything else.
+    Every chunk counts towards the shared read limits in IO_THROTTLE.
+    """
+    file_descriptor = _get_file_descriptor(file)
+    # Lets the read limits tell this program's reads of each disk apart from other programs'
+    device = None if file_descriptor is None else os.fstat(file_descriptor).st_dev
+    offset = file.tell()
+    _advise(file_descriptor, offset, 0, "POSIX_FADV_SEQUENTIAL")
+
+    if read_strategy == READ:
+        chunks = _read_chunks_with_read(file)
+    elif read_strategy == READ_INTO:
+        chunks = _read_chunks_with_readinto(file)
+    elif read_strategy == MMAP:
+        # mmap needs a real file
+        chunks = _read_chunks_with_readinto(file) if file_descriptor is None else _read_chunks_with_mmap(file, offset)
+    elif read_strategy == DOUBLE_BUFFER:
+        chunks = _read_chunks_double_buffered(file)
+    else:
+        raise ValueError(f"Unknown read strategy {read_strategy!r}. Options are: {', '.join(READ_STRATEGIES)}")
+
+    for chunk in chunks:
+        chunk_size = len(chunk)
+        IO_THROTTLE.consume(chunk_size, device)
+        METRICS.increment("bytes_hashed", chunk_size)
+        yield chunk
+        if drop_from_page_cache:
+            _advise(file_descriptor, offset, chunk_size, "POSIX_FADV_DONTNEED")
+        offset += chunk_size
+
+
+def _get_file_descriptor(file: IO) -> Optional[int]:
+    try:
+        return file.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        # In-memory files do not have a file descriptor
+        return None
+
+
+def _advise(file_descriptor: Optional[int], offset: int, length: int, advice_name: str):
+    # posix_fadvise only exists on some platforms (not Windows)
+    advice = getattr(os, advice_name, None)
+    if file_descriptor is None or advice is None:
+        return
+
+    try:
+        os.posix_fadvise(file_descriptor, offset, length, advice)
+    except OSError:
+        # Advice is only a hint, so it is fine if the file system does not support it
+        pass
+
+
+def _read_chunks_with_read(file: IO) -> Iterator[bytes]:
+    while chunk := file.read(CHUNK_SIZE):
+        yield chunk
+
+
+def _read_chunks_with_readinto(file: IO) -> Iterator[memoryview]:
+    buffer = bytearray(CHUNK_SIZE)
+    with memoryview(buffer) as buffer_view:
+        while num_bytes := file.readinto(buffer):
+            with buffer_view[:num_bytes] as chunk:
+                yield chunk
+
+
+def _read_chunks_with_mmap(file: IO, offset: int) -> Iterator[memoryview]:
+    file_size = os.fstat(file.fileno()).st_size
+    if file_size <= offset:
+        # Empty files cannot be mapped
+        return
+
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as file_map:
+        if hasattr(file_map, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            file_map.madvise(mmap.MADV_SEQUENTIAL)
+
+        with memoryview(file_map) as file_view:
+            for chunk_start in range(offset, file_size, CHUNK_SIZE):
+                chunk_end = min(chunk_start + CHUNK_SIZE, file_size)
+                with file_view[chunk_start:chunk_end] as chunk:
+                    yield chunk
+
+    # Keep the file position consistent with the other strategies
+    file.seek(file_size)
+
+
+def _read_chunks_double_buffered(file: IO) -> Iterator[memoryview]:
+    free_buffers: queue.Queue = queue.Queue()
+    for _ in range(2):
+        free_buffers.put(bytearray(CHUNK_SIZE))
+    filled_buffers: queue.Queue = queue.Queue()
+
+    def _read_into_free_buffers():
+        try:
+            while (buffer := free_buffers.get()) is not None:
+                num_bytes = file.readinto(buffer)
+                filled_buffers.put((buffer, num_bytes))
+                if not num_bytes:
+                    return
+        except Exception as e:
+            filled_buffers.put((e, 0))
+
+    reader_thread = threading.Thread(target=_read_into_free_buffers, name="double-buffer-reader", daemon=True)
+    reader_thread.start()
+    try:
+        while True:
+            buffer, num_bytes = filled_buffers.get()
+            if isinstance(buffer, Exception):
+                raise buffer
+            if not num_bytes:
+                return
+
+            with memoryview(buffer) as buffer_view, buffer_view[:num_bytes] as chunk:
+                yield chunk
+            free_buffers.put(buffer)
+    finally:
+        # Wake up the reader if it is waiting for a buffer, then wait for any read in progress to finish
+        free_buffers.put(None)
+        reader_thread.join()
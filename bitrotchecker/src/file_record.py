@@ -1,44 +1,214 @@
 import hashlib
 import os
 from datetime import datetime, timezone
-from typing import Dict, Any
+from decimal import Decimal
+from typing import Dict, Any, Optional, Iterable, Set
 
-from bitrotchecker.src.constants import FILE_ID_KEY, SIZE_KEY, CHECKSUM_KEY, MODIFIED_TIME_KEY, LAST_ACCESSED_KEY, \
-    MODIFIED_TIME_S_KEY
-from bitrotchecker.src.file_util import get_checksum_of_file
+import bson
+
+from bitrotchecker.src.constants import (
+    FILE_ID_KEY,
+    SIZE_KEY,
+    CHECKSUM_KEY,
+    MODIFIED_TIME_NS_KEY,
+    LAST_ACCESSED_KEY,
+    CHECKSUM_ALGORITHM,
+    CHECKSUM_ALGORITHM_KEY,
+    BLOCK_CHECKSUMS_KEY,
+    BLOCK_SIZE_KEY,
+    BLOCK_CHECKSUM_BLOCK_SIZE,
+    NEXT_BLOCK_KEY,
+)
+from bitrotchecker.src.block_checksums import should_have_block_checksums
+from bitrotchecker.src.checksum_algorithms import CRC32_BLOCKS
+from bitrotchecker.src.checksum_checkpoint_util import ChecksumCheckpointUtil
+from bitrotchecker.src.file_util import get_checksums_of_file
+from bitrotchecker.src.inode_checksum_cache import InodeChecksumCache, InodeKey, get_inode_key
+
+# File IDs are SHA-256 hashes
+FILE_ID_SIZE_BYTES = 32
+
+
+def get_file_id(file_path: str) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(file_path.encode())
+    return hasher.hexdigest().lower()
+
+
+def encode_file_id(file_id: str) -> bson.Binary:
+    """
+    Converts a hex file ID into the 32 bytes stored in the database.
+    """
+    return bson.Binary(bytes.fromhex(file_id))
+
+
+def decode_file_id(database_file_id: bytes) -> str:
+    return bytes(database_file_id).hex()
+
+
+def get_nanos_from_mtime(modified_time: float) -> int:
+    """
+    Converts a float modified time into integer nanoseconds the way it is written, such as 1700000000.1234567,
+    rather than with the float's binary rounding error.
+    This is how modified times stored as floats by older versions are converted.
+    """
+    return round(Decimal(repr(modified_time)) * 1_000_000_000)
 
 
 class FileRecord:
-    def __init__(self, file_path: str, full_file_path: str):
-        self.file_path = file_path
-        self.full_file_path = full_file_path
+    """
+    An immutable snapshot of a file, taken from a single stat of the file.
 
-    @property
-    def size(self) -> float:
-        return os.path.getsize(self.full_file_path)
+    The file ID and checksums are only calculated when first needed, and never more than once.
+    """
 
-    @property
-    def modified_time(self) -> float:
-        return os.path.getmtime(self.full_file_path)
+    __slots__ = (
+        "file_path",
+        "full_file_path",
+        "modified_time",
+        "modified_time_ns",
+        "size",
+        "checksum_checkpoint_util",
+        "inode_checksum_cache",
+        "inode_key",
+        "links",
+        "_file_id",
+        "_checksums",
+    )
+
+    def __init__(
+        self,
+        file_path: str,
+        modified_time: float,
+        size: int,
+        checksum: Optional[Any] = None,
+        full_file_path: Optional[str] = None,
+        checksum_algorithm: str = CHECKSUM_ALGORITHM,
+        checksum_checkpoint_util: Optional[ChecksumCheckpointUtil] = None,
+        modified_time_ns: Optional[int] = None,
+        inode_checksum_cache: Optional[InodeChecksumCache] = None,
+        inode_key: Optional[InodeKey] = None,
+        links: int = 1,
+    ):
+        object.__setattr__(self, "file_path", file_path)
+        object.__setattr__(self, "full_file_path", full_file_path)
+        object.__setattr__(self, "modified_time", modified_time)
+        # The exact modified time, since a float of seconds cannot hold every nanosecond
+        if modified_time_ns is None:
+            modified_time_ns = get_nanos_from_mtime(modified_time)
+        object.__setattr__(self, "modified_time_ns", modified_time_ns)
+        object.__setattr__(self, "size", size)
+        # Lets the checksums of large files resume from where an interrupted run stopped
+        object.__setattr__(self, "checksum_checkpoint_util", checksum_checkpoint_util)
+        # Lets the hard links to the same inode share the checksums of a single read
+        object.__setattr__(self, "inode_checksum_cache", inode_checksum_cache)
+        object.__setattr__(self, "inode_key", inode_key)
+        object.__setattr__(self, "links", links)
+        object.__setattr__(self, "_file_id", None)
+        object.__setattr__(self, "_checksums", {} if checksum is None else {checksum_algorithm: checksum})
+
+    @classmethod
+    def from_stat(
+        cls,
+        file_path: str,
+        full_file_path: str,
+        stat_result: os.stat_result,
+        checksum_checkpoint_util: Optional[ChecksumCheckpointUtil] = None,
+        inode_checksum_cache: Optional[InodeChecksumCache] = None,
+    ) -> "FileRecord":
+        return cls(
+            file_path=file_path,
+            modified_time=stat_result.st_mtime,
+            modified_time_ns=stat_result.st_mtime_ns,
+            size=stat_result.st_size,
+            full_file_path=full_file_path,
+            checksum_checkpoint_util=checksum_checkpoint_util,
+            inode_checksum_cache=inode_checksum_cache,
+            inode_key=get_inode_key(stat_result),
+            links=stat_result.st_nlink,
+        )
+
+    @classmethod
+    def from_path(
+        cls, file_path: str, full_file_path: str, checksum_checkpoint_util: Optional[ChecksumCheckpointUtil] = None
+    ) -> "FileRecord":
+        return cls.from_stat(file_path, full_file_path, os.stat(full_file_path), checksum_checkpoint_util)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"FileRecord is immutable. Cannot set {name!r}.")
 
     @property
-    def checksum(self) -> int:
-        return get_checksum_of_file(self.full_file_path)
+    def checksum(self) -> Any:
+        return self.get_checksum(CHECKSUM_ALGORITHM)
+
+    def get_checksum(self, algorithm: str) -> Any:
+        return self.get_checksums([algorithm])[algorithm]
+
+    def get_checksums(self, algorithms: Iterable[str]) -> Dict[str, Any]:
+        """
+        Returns the checksum of the file for every given algorithm.
+        Any checksums that are not known yet are calculated together with a single read of the file,
+        or reused from another hard link to the same inode.
+        """
+        algorithms = set(algorithms)
+        missing_algorithms = algorithms.difference(self._checksums)
+        if missing_algorithms:
+            if self.full_file_path is None:
+                raise ValueError(f"Cannot calculate the checksum of {self.file_path} without its full file path")
+            if self.inode_checksum_cache is None or self.inode_key is None:
+                self._checksums.update(self._read_checksums(missing_algorithms))
+            else:
+                self._checksums.update(
+                    self.inode_checksum_cache.get_checksums(
+                        self.inode_key, self.links, self.size, missing_algorithms, self._read_checksums
+                    )
+                )
+        return {algorithm: self._checksums[algorithm] for algorithm in algorithms}
+
+    def _read_checksums(self, algorithms: Set[str]) -> Dict[str, Any]:
+        return get_checksums_of_file(
+            self.full_file_path,
+            algorithms,
+            self.checksum_checkpoint_util,
+            self.size,
+            self.modified_time,
+        )
 
     @property
     def file_id(self) -> str:
-        hasher = hashlib.sha256()
-        hasher.update(self.file_path.encode())
-        return hasher.hexdigest().lower()
+        if self._file_id is None:
+            object.__setattr__(self, "_file_id", get_file_id(self.file_path))
+        return self._file_id
+
+    @property
+    def legacy_modified_time_ns(self) -> int:
+        """
+        The modified time in nanoseconds as it was converted from a float when migrating from the legacy schema.
+        This can differ from modified_time_ns by a few hundred nanoseconds on file systems with nanosecond timestamps.
+        """
+        return get_nanos_from_mtime(self.modified_time)
 
     def get_mongo_document(self) -> Dict[str, Any]:
+        if not should_have_block_checksums(self.size):
+            return self._get_base_mongo_document()
+
+        # Calculate both in a single read of the file
+        checksums = self.get_checksums([CHECKSUM_ALGORITHM, CRC32_BLOCKS])
+        return {
+            **self._get_base_mongo_document(),
+            BLOCK_CHECKSUMS_KEY: checksums[CRC32_BLOCKS],
+            BLOCK_SIZE_KEY: BLOCK_CHECKSUM_BLOCK_SIZE,
+            NEXT_BLOCK_KEY: 0,
+        }
+
+    def _get_base_mongo_document(self) -> Dict[str, Any]:
         return {
-            FILE_ID_KEY: self.file_id,
+            FILE_ID_KEY: encode_file_id(self.file_id),
             # We do not save the file_path for privacy reasons
-            MODIFIED_TIME_KEY: self.modified_time,
-            MODIFIED_TIME_S_KEY: int(self.modified_time),
+            MODIFIED_TIME_NS_KEY: self.modified_time_ns,
             SIZE_KEY: self.size,
             CHECKSUM_KEY: self.checksum,
+            CHECKSUM_ALGORITHM_KEY: CHECKSUM_ALGORITHM,
             # Set the last accessed time to now since we are likely accessing the document
             LAST_ACCESSED_KEY: datetime.now(),
         }
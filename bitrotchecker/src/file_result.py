@@ -1,4 +1,6 @@
-from dataclasses import dataclass
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
 
 from bitrotchecker.src.file_result_enum import FileResultValue
 
@@ -7,3 +9,12 @@ from bitrotchecker.src.file_result_enum import FileResultValue
 class FileResult:
     value: FileResultValue
     message: str
+    # False if only part of the file was verified, so it should be verified again on the next run
+    complete: bool = True
+    # Structured details for the event log, such as which check failed and the expected and actual values
+    details: Dict[str, Any] = field(default_factory=dict)
+    # How long the file took to verify
+    duration_seconds: Optional[float] = None
+    # The buffered write of the file's record, if any, which is resolved once it has been sent to the database.
+    # The file is only recorded as processed once its record has been written.
+    written: Optional[Future] = None
@@ -1,31 +1,197 @@
 import os.path
-import zlib
-from typing import IO
+import re
+import stat
+from typing import IO, Iterator, Optional, Pattern, Iterable, Dict, Any, Callable
 
-from bitrotchecker.src.constants import CHUNK_SIZE, SKIP_PREFIXES, SKIP_SUFFIXES
+from bitrotchecker.src.checksum_algorithms import get_checksum_algorithm, is_resumable
+from bitrotchecker.src.checksum_checkpoint_util import ChecksumCheckpointUtil
+from bitrotchecker.src.constants import (
+    SKIP_PREFIXES,
+    SKIP_SUFFIXES,
+    RESUMABLE_CHECKSUM_MIN_FILE_SIZE,
+    CHECKSUM_CHECKPOINT_INTERVAL_BYTES,
+)
+from bitrotchecker.src.file_reader import read_chunks
+from bitrotchecker.src.run_metrics import METRICS
 
 
-def get_checksum_of_file(file_path: str) -> int:
-    with open(file_path, "rb") as file:
-        return _get_checksum(file)
+def _compile_skip_pattern() -> Optional[Pattern]:
+    alternatives = [rf"\A{re.escape(prefix)}" for prefix in SKIP_PREFIXES]
+    alternatives += [rf"{re.escape(suffix)}\Z" for suffix in SKIP_SUFFIXES]
+    if not alternatives:
+        return None
+    return re.compile("|".join(alternatives))
 
 
-def _get_checksum(file: IO):
-    checksum = 0
-    while chunk := file.read(CHUNK_SIZE):
-        checksum = zlib.crc32(chunk, checksum)
-    return checksum & 0xFFFFFFFF
+# All skip prefixes and suffixes combined so that each name only needs to be matched once
+_SKIP_PATTERN = _compile_skip_pattern()
+
+
+def get_checksums_of_file(
+    file_path: str,
+    algorithms: Iterable[str],
+    checkpoint_util: Optional[ChecksumCheckpointUtil] = None,
+    file_size: Optional[int] = None,
+    modified_time: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Calculates the checksum of the file with every given algorithm, reading the file only once.
+
+    If a checkpoint util is given along with the size and modified time of the file, progress through large files
+    is saved as they are read, and a previous interrupted read of the same file is resumed.
+    """
+    algorithms = set(algorithms)
+    with METRICS.time("hash"), open(file_path, "rb") as file:
+        if (
+            checkpoint_util is None
+            or file_size is None
+            or modified_time is None
+            or RESUMABLE_CHECKSUM_MIN_FILE_SIZE is None
+            or file_size < RESUMABLE_CHECKSUM_MIN_FILE_SIZE
+        ):
+            return _get_checksums(file, algorithms)
+
+        return _get_checksums_resumably(file, file_path, algorithms, checkpoint_util, file_size, modified_time)
+
+
+def _get_checksums(file: IO, algorithms: Iterable[str]) -> Dict[str, Any]:
+    hashers = {algorithm: get_checksum_algorithm(algorithm).create_hasher() for algorithm in algorithms}
+    for chunk in read_chunks(file):
+        for hasher in hashers.values():
+            hasher.update(chunk)
+    return {algorithm: hasher.result() for algorithm, hasher in hashers.items()}
+
+
+def _get_checksums_resumably(
+    file: IO,
+    file_path: str,
+    algorithms: Iterable[str],
+    checkpoint_util: ChecksumCheckpointUtil,
+    file_size: int,
+    modified_time: float,
+) -> Dict[str, Any]:
+    hashers = {algorithm: get_checksum_algorithm(algorithm).create_hasher() for algorithm in algorithms}
+    if not all(is_resumable(hasher) for hasher in hashers.values()):
+        return _get_checksums(file, algorithms)
+
+    offset = 0
+    checkpoint = checkpoint_util.load_checkpoint(file_path, file_size, modified_time, algorithms)
+    if checkpoint is not None:
+        offset, states = checkpoint
+        for algorithm, hasher in hashers.items():
+            hasher.set_state(states[algorithm])
+        file.seek(offset)
+        print(f"Resuming checksum of {file_path} from byte {offset}")
+
+    next_checkpoint_offset = offset + CHECKSUM_CHECKPOINT_INTERVAL_BYTES
+    for chunk in read_chunks(file):
+        for hasher in hashers.values():
+            hasher.update(chunk)
+        offset += len(chunk)
+
+        if offset >= next_checkpoint_offset:
+            states = {algorithm: hasher.get_state() for algorithm, hasher in hashers.items()}
+            checkpoint_util.save_checkpoint(file_path, file_size, modified_time, algorithms, offset, states)
+            next_checkpoint_offset = offset + CHECKSUM_CHECKPOINT_INTERVAL_BYTES
+
+    checkpoint_util.remove_checkpoint(file_path)
+    return {algorithm: hasher.result() for algorithm, hasher in hashers.items()}
+
+
+def should_skip_name(name: str) -> bool:
+    return _SKIP_PATTERN is not None and _SKIP_PATTERN.search(name) is not None
 
 
 def should_skip_file(file_path: str) -> bool:
-    path_parts = file_path.split(os.path.sep)
+    return any(should_skip_name(path_part) for path_part in file_path.split(os.path.sep))
+
+
+def is_inside(path: str, directory: str) -> bool:
+    """
+    Returns whether the path is the directory or anywhere under it, so /data/foo2 is not inside /data/foo.
+    """
+    return path == directory or path.startswith(os.path.join(directory, ""))
+
+
+def walk_files(root_path: str, on_error: Optional[Callable[[OSError], None]] = None) -> Iterator[os.DirEntry]:
+    """
+    Yields every file under the given path that should not be skipped.
+
+    Directories that should be skipped are never listed, and are counted apart from the skipped files.
+    Files are yielded as they are listed rather than collected per directory.
+    Symbolic links to directories are not followed, matching os.walk.
+    Each entry caches its stat result, so calling stat() on it more than once is free.
+
+    A directory or entry that cannot be read is printed and left out, unless on_error is given, in which case it is
+    called with the error instead, like the onerror of os.walk. It can raise the error to stop the walk.
+    """
+    if should_skip_file(root_path):
+        return
+
+    directories_to_walk = [root_path]
+    while directories_to_walk:
+        directory = directories_to_walk.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if should_skip_name(entry.name):
+                                METRICS.increment("directories_skipped", reason="ignored")
+                            else:
+                                directories_to_walk.append(entry.path)
+                        elif entry.is_file():
+                            if should_skip_name(entry.name):
+                                METRICS.increment("files_skipped", reason="ignored")
+                            else:
+                                yield entry
+                    except OSError as e:
+                        if on_error is None:
+                            print(f"Could not read {entry.path}: {e}")
+                        else:
+                            on_error(e)
+        except OSError as e:
+            if on_error is None:
+                print(f"Could not list {directory}: {e}")
+            else:
+                on_error(e)
+
+
+class FileEntry:
+    """
+    A file known by its path rather than found by listing a directory, with the path and cached stat() of an
+    os.DirEntry so that it can be processed the same way as the entries from walk_files.
+    """
+
+    __slots__ = ("path", "name", "_stat_result")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._stat_result: Optional[os.stat_result] = None
+
+    def stat(self) -> os.stat_result:
+        if self._stat_result is None:
+            self._stat_result = os.stat(self.path)
+        return self._stat_result
+
 
-    for path_parth in path_parts:
-        for prefix in SKIP_PREFIXES:
-            if path_parth.startswith(prefix):
-                return True
-        for suffix in SKIP_SUFFIXES:
-            if path_parth.endswith(suffix):
-                return True
+def get_file_entries(file_paths: Iterable[str]) -> Iterator[FileEntry]:
+    """
+    Yields an entry for each of the paths that is still a file and should not be skipped.
+    """
+    for file_path in file_paths:
+        if should_skip_file(file_path):
+            continue
 
-    return False
+        file_entry = FileEntry(file_path)
+        try:
+            if not stat.S_ISREG(file_entry.stat().st_mode):
+                continue
+        except FileNotFoundError:
+            # The file was deleted or moved after it changed
+            continue
+        except OSError as e:
+            print(f"Could not read {file_path}: {e}")
+            continue
+        yield file_entry
@@ -1,6 +1,8 @@
 import sys
 
-from bitrotchecker.src.file_record import FileRecord
+from bitrotchecker.src.checksum_algorithms import LEGACY_CHECKSUM_ALGORITHM, format_checksum
+from bitrotchecker.src.constants import CHECKSUM_ALGORITHM_KEY, CHECKSUM_KEY
+from bitrotchecker.src.file_record import get_file_id
 from bitrotchecker.src.mongo_util import MongoUtil
 
 
@@ -11,17 +13,18 @@ def main():
         file_path = "\\" + file_path
 
     print("File: " + file_path)
-    file_record = FileRecord(file_path=file_path, full_file_path="")
-    print(file_record.file_id)
+    file_id = get_file_id(file_path)
+    print(file_id)
 
     mongo_util = MongoUtil()
-    records = mongo_util.get_all_records_for_file_id(file_record.file_id)
+    records = mongo_util.get_all_records_for_file_id(file_id)
     for record in records:
         print("=" * 50)
         print(record)
-        print(format(record["checksum"], 'X'))
+        checksum_algorithm = record.get(CHECKSUM_ALGORITHM_KEY, LEGACY_CHECKSUM_ALGORITHM)
+        print(f"{checksum_algorithm}: {format_checksum(record[CHECKSUM_KEY])}")
         print("=" * 50)
 
 
-if __name__ == '__main__':
+if __name__ == "__main__":
     main()
@@ -0,0 +1,122 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from bitrotchecker.src.constants import INODE_CHECKSUM_CACHE_MAX_ENTRIES
+from bitrotchecker.src.run_metrics import METRICS
+
+# The device, inode, size and modified time in nanoseconds of a file
+InodeKey = Tuple[int, int, int, int]
+
+
+def get_inode_key(stat_result: os.stat_result) -> Optional[InodeKey]:
+    """
+    Returns the key that every hard link to the file shares, or None if the file only has one link.
+    The size and modified time are part of the key so that a file that changes during a run is read again.
+    """
+    if stat_result.st_nlink < 2:
+        return None
+    return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+class _InodeEntry:
+    __slots__ = ("checksums", "links_left", "reading")
+
+    def __init__(self, links: int):
+        self.checksums: Dict[str, Any] = {}
+        # The entry is dropped once every link has used it, so that memory use does not grow with the run
+        self.links_left = links
+        # Set while one of the links is being read, so that the other links wait for its checksums
+        self.reading: Optional[threading.Event] = None
+
+
+class InodeChecksumCache:
+    """
+    Remembers the checksums of files with more than one hard link for the rest of a run,
+    so that each inode is read once and its checksums are reused for the verification and record of every link.
+
+    An inode is dropped once every link has used it, and the least recently used inodes are dropped beyond
+    max_entries, since some links may never be reached.
+    """
+
+    def __init__(self, max_entries: int = INODE_CHECKSUM_CACHE_MAX_ENTRIES):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[InodeKey, _InodeEntry]" = OrderedDict()
+        self.files_deduplicated = 0
+        self.bytes_deduplicated = 0
+
+    def get_checksums(
+        self,
+        inode_key: InodeKey,
+        links: int,
+        size: int,
+        algorithms: Set[str],
+        read_checksums: Callable[[Set[str]], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """
+        Returns the checksums of the inode for every given algorithm, calling read_checksums with the algorithms that
+        no link has been read with yet. If another link is being read, waits for it instead of reading it again.
+        """
+        while True:
+            with self.lock:
+                entry = self._entries.get(inode_key)
+                if entry is None:
+                    entry = _InodeEntry(links)
+                    self._entries[inode_key] = entry
+                    self._evict()
+                else:
+                    self._entries.move_to_end(inode_key)
+                missing_algorithms = algorithms.difference(entry.checksums)
+                if not missing_algorithms:
+                    self._use_entry(inode_key, entry)
+                    self.files_deduplicated += 1
+                    self.bytes_deduplicated += size
+                    METRICS.increment("files_deduplicated")
+                    METRICS.increment("bytes_deduplicated", size)
+                    return {algorithm: entry.checksums[algorithm] for algorithm in algorithms}
+                reading = entry.reading
+                if reading is None:
+                    entry.reading = threading.Event()
+                    break
+            reading.wait()
+
+        checksums = {}
+        try:
+            checksums = read_checksums(missing_algorithms)
+        finally:
+            with self.lock:
+                # If the read failed, the next link to need the checksums reads the file itself
+                entry.checksums.update(checksums)
+                entry.reading.set()
+                entry.reading = None
+                if checksums:
+                    self._use_entry(inode_key, entry)
+        return {algorithm: entry.checksums[algorithm] for algorithm in algorithms}
+
+    def _use_entry(self, inode_key: InodeKey, entry: _InodeEntry):
+        entry.links_left -= 1
+        if entry.links_left <= 0 and entry.reading is None and self._entries.get(inode_key) is entry:
+            self._entries.pop(inode_key)
+
+    def _evict(self):
+        """
+        Drops the least recently used inodes that are not being read until there are at most max_entries.
+        """
+        num_to_evict = len(self._entries) - self.max_entries
+        if num_to_evict <= 0:
+            return
+        evicted_keys = []
+        for inode_key, entry in self._entries.items():
+            if len(evicted_keys) >= num_to_evict:
+                break
+            if entry.reading is None:
+                evicted_keys.append(inode_key)
+        for inode_key in evicted_keys:
+            del self._entries[inode_key]
+        METRICS.increment("inode_checksums_evicted", len(evicted_keys))
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self._entries)
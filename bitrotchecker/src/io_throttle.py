@@ -0,0 +1,383 @@
+import math
+import os
+import signal
+import threading
+import time
+from typing import Dict, Optional, List, Tuple
+
+from bitrotchecker.src.configuration_util import (
+    get_max_read_bytes_per_second,
+    get_max_load_average,
+    get_max_disk_utilization_percent,
+    get_throttle_disks,
+)
+from bitrotchecker.src.constants import THROTTLE_LOAD_CHECK_INTERVAL_SECONDS
+
+DISKSTATS_FILE_PATH = "/proc/diskstats"
+# The bytes this process has had read from storage, and the state of each of its threads (Linux only)
+OWN_IO_FILE_PATH = "/proc/self/io"
+OWN_TASKS_DIRECTORY = "/proc/self/task"
+# Each block device by name, and by its device number, which lead to the disk a partition is on
+BLOCK_DEVICES_DIRECTORY = "/sys/class/block"
+BLOCK_DEVICE_NUMBERS_DIRECTORY = "/sys/dev/block"
+
+# The kernel averages the 1-minute load average over this many seconds
+LOAD_AVERAGE_PERIOD_SECONDS = 60
+SECTOR_SIZE_BYTES = 512
+
+
+class ReadsStopped(Exception):
+    """
+    Raised to a read that is waiting for the limits when the program is asked to stop.
+    """
+
+
+class IoThrottle:
+    """
+    Limits how fast files are read for checksumming, across every thread.
+
+    Reads are limited to a number of bytes per second with a token bucket, and can be paused entirely while the
+    system load average or the utilization of the disks is too high. Every limit is optional.
+
+    The load and utilization caused by this program's own reads are subtracted before comparing them with the limits,
+    so that a run that keeps its own disk busy does not keep pausing and resuming itself. Reads are counted per device,
+    so only the disks they came from are discounted.
+    """
+
+    def __init__(
+        self,
+        max_bytes_per_second: Optional[int] = None,
+        max_load_average: Optional[float] = None,
+        max_disk_utilization_percent: Optional[float] = None,
+        disks: Optional[List[str]] = None,
+    ):
+        self.lock = threading.Lock()
+        self.set_limits(max_bytes_per_second, max_load_average, max_disk_utilization_percent, disks)
+
+        self._available_bytes = 0.0
+        self._last_refill_time = time.monotonic()
+
+        self._last_load_check_time = 0.0
+        self._overloaded_reason: Optional[str] = None
+        self._last_disk_stats: Optional[Dict[str, Tuple[int, int]]] = None
+        self._last_own_read_bytes: Optional[int] = None
+        # The bytes read through consume() from each device, by device number, and the disks each device is counted on
+        self._own_device_bytes: Dict[int, int] = {}
+        self._last_own_device_bytes: Dict[int, int] = {}
+        self._device_disks: Dict[int, List[str]] = {}
+        self._last_disk_check_time = 0.0
+        # This process's share of the 1-minute load average, averaged the same way as the kernel does
+        self._own_load_average = 0.0
+        self._last_own_load_time: Optional[float] = None
+        # Set by stop() to wake up and abandon any read waiting for the limits
+        self._stopped = threading.Event()
+
+    def set_limits(
+        self,
+        max_bytes_per_second: Optional[int],
+        max_load_average: Optional[float],
+        max_disk_utilization_percent: Optional[float],
+        disks: Optional[List[str]] = None,
+    ):
+        with self.lock:
+            self.max_bytes_per_second = max_bytes_per_second
+            self.max_load_average = max_load_average
+            self.max_disk_utilization_percent = max_disk_utilization_percent
+            self.disks = disks
+
+    def reload_from_config(self):
+        self.set_limits(
+            get_max_read_bytes_per_second(),
+            get_max_load_average(),
+            get_max_disk_utilization_percent(),
+            get_throttle_disks(),
+        )
+        print(
+            f"Read limits: {self.max_bytes_per_second} bytes per second, {self.max_load_average} load average,"
+            f" {self.max_disk_utilization_percent}% disk utilization"
+        )
+
+    def stop(self):
+        """
+        Wakes up every read waiting for the limits and makes it raise ReadsStopped, such as when asked to exit.
+        """
+        self._stopped.set()
+
+    def resume(self):
+        self._stopped.clear()
+
+    def consume(self, num_bytes: int, device: Optional[int] = None):
+        """
+        Waits until the given number of bytes may be read from the device, given by the st_dev of the file.
+        Raises ReadsStopped if stop() is called while waiting.
+        """
+        limits = [self.max_bytes_per_second, self.max_load_average, self.max_disk_utilization_percent]
+        if all(limit is None for limit in limits):
+            return
+
+        if device is not None:
+            with self.lock:
+                self._own_device_bytes[device] = self._own_device_bytes.get(device, 0) + num_bytes
+
+        self._wait_while_overloaded()
+        self._wait_for_bytes(num_bytes)
+
+    def _wait_for_bytes(self, num_bytes: int):
+        with self.lock:
+            max_bytes_per_second = self.max_bytes_per_second
+            if max_bytes_per_second is None:
+                return
+
+            # Refill the bucket, allowing at most one second of reads to build up
+            now = time.monotonic()
+            refilled_bytes = (now - self._last_refill_time) * max_bytes_per_second
+            self._available_bytes = min(max_bytes_per_second, self._available_bytes + refilled_bytes)
+            self._last_refill_time = now
+
+            # Reads can be larger than the bucket, so let the bucket go negative and wait for it to refill
+            self._available_bytes -= num_bytes
+            wait_seconds = max(0.0, -self._available_bytes / max_bytes_per_second)
+
+        if wait_seconds > 0:
+            self._wait(wait_seconds)
+
+    def _wait(self, seconds: float):
+        if self._stopped.wait(seconds):
+            raise ReadsStopped("Reads were stopped while waiting for the read limits")
+
+    def _wait_while_overloaded(self):
+        was_overloaded = False
+        while (reason := self._get_overloaded_reason()) is not None:
+            if not was_overloaded:
+                print(f"Pausing reads because {reason}")
+                was_overloaded = True
+            self._wait(THROTTLE_LOAD_CHECK_INTERVAL_SECONDS)
+
+        if was_overloaded:
+            print("Resuming reads")
+
+    def _get_overloaded_reason(self) -> Optional[str]:
+        with self.lock:
+            # Only look at the system every so often since every chunk read calls this
+            now = time.monotonic()
+            if now - self._last_load_check_time < THROTTLE_LOAD_CHECK_INTERVAL_SECONDS:
+                return self._overloaded_reason
+            self._last_load_check_time = now
+
+            self._overloaded_reason = None
+            if self.max_load_average is not None and hasattr(os, "getloadavg"):
+                load_average = os.getloadavg()[0] - self._get_own_load_average(now)
+                if load_average > self.max_load_average:
+                    self._overloaded_reason = (
+                        f"the load average from other programs {load_average:.2f} is above {self.max_load_average}"
+                    )
+
+            if self.max_disk_utilization_percent is not None and os.path.exists(DISKSTATS_FILE_PATH):
+                disk_utilization_percent = self._get_disk_utilization_percent(now)
+                if disk_utilization_percent is not None and (
+                    disk_utilization_percent > self.max_disk_utilization_percent
+                ):
+                    self._overloaded_reason = (
+                        f"disk utilization from other programs {disk_utilization_percent:.0f}%"
+                        f" is above {self.max_disk_utilization_percent}%"
+                    )
+
+            return self._overloaded_reason
+
+    def _get_own_load_average(self, now: float) -> float:
+        """
+        Returns this process's share of the 1-minute load average: its threads that are running or waiting for I/O,
+        such as the threads reading files, averaged over time the same way as the kernel.
+        """
+        active_threads = count_own_active_threads()
+        if self._last_own_load_time is None:
+            self._own_load_average = active_threads
+        else:
+            decay = math.exp(-(now - self._last_own_load_time) / LOAD_AVERAGE_PERIOD_SECONDS)
+            self._own_load_average = self._own_load_average * decay + active_threads * (1 - decay)
+        self._last_own_load_time = now
+        return self._own_load_average
+
+    def _get_disk_utilization_percent(self, now: float) -> Optional[float]:
+        """
+        Returns the highest utilization of any watched disk by other programs since the last check.
+        A disk's utilization is scaled down by the share of the bytes it transferred that this process read from it.
+        """
+        with open(DISKSTATS_FILE_PATH) as diskstats_file:
+            disk_stats = parse_disk_stats(diskstats_file.read(), self.disks)
+        own_read_bytes = get_own_read_bytes()
+        own_device_bytes = dict(self._own_device_bytes)
+
+        last_disk_stats = self._last_disk_stats
+        last_own_read_bytes = self._last_own_read_bytes
+        last_own_device_bytes = self._last_own_device_bytes
+        elapsed_milliseconds = (now - self._last_disk_check_time) * 1000
+        self._last_disk_stats = disk_stats
+        self._last_own_read_bytes = own_read_bytes
+        self._last_own_device_bytes = own_device_bytes
+        self._last_disk_check_time = now
+
+        if last_disk_stats is None or elapsed_milliseconds <= 0:
+            return None
+
+        own_storage_bytes = None
+        if own_read_bytes is not None and last_own_read_bytes is not None:
+            own_storage_bytes = own_read_bytes - last_own_read_bytes
+        own_disk_bytes = self._get_own_disk_bytes(own_device_bytes, last_own_device_bytes, own_storage_bytes)
+
+        utilization_percents = []
+        for disk, (io_ticks, transferred_bytes) in disk_stats.items():
+            if disk not in last_disk_stats:
+                continue
+            last_io_ticks, last_transferred_bytes = last_disk_stats[disk]
+            disk_bytes = transferred_bytes - last_transferred_bytes
+            own_share = min(1.0, own_disk_bytes.get(disk, 0) / disk_bytes) if disk_bytes > 0 else 0.0
+            busy_milliseconds = io_ticks - last_io_ticks
+            utilization_percents.append(busy_milliseconds / elapsed_milliseconds * 100 * (1 - own_share))
+        if not utilization_percents:
+            return None
+        return max(utilization_percents)
+
+    def _get_own_disk_bytes(
+        self, own_device_bytes: Dict[int, int], last_own_device_bytes: Dict[int, int], own_storage_bytes: Optional[int]
+    ) -> Dict[str, float]:
+        """
+        Returns the bytes this process read from each disk since the last check, counting reads from a partition
+        towards the partition and the disk it is on.
+        Reads served from the page cache never reach a disk, so the reads are scaled down to the bytes the process
+        actually had read from storage, when the platform reports them.
+        """
+        device_bytes = {
+            device: num_bytes - last_own_device_bytes.get(device, 0) for device, num_bytes in own_device_bytes.items()
+        }
+        total_bytes = sum(device_bytes.values())
+        scale = 1.0
+        if own_storage_bytes is not None and total_bytes > own_storage_bytes:
+            scale = max(0, own_storage_bytes) / total_bytes
+
+        own_disk_bytes: Dict[str, float] = {}
+        for device, num_bytes in device_bytes.items():
+            if device not in self._device_disks:
+                self._device_disks[device] = get_device_disks(device)
+            for disk in self._device_disks[device]:
+                own_disk_bytes[disk] = own_disk_bytes.get(disk, 0) + num_bytes * scale
+        return own_disk_bytes
+
+
+def get_own_read_bytes() -> Optional[int]:
+    """
+    Returns the bytes this process has had read from storage, or None if the platform does not report them.
+    """
+    try:
+        with open(OWN_IO_FILE_PATH) as own_io_file:
+            for line in own_io_file:
+                name, _, value = line.partition(":")
+                if name == "read_bytes":
+                    return int(value)
+    except OSError:
+        pass
+    return None
+
+
+def get_device_disks(device: int) -> List[str]:
+    """
+    Returns the names in /proc/diskstats of the block device with the given device number,
+    and of the disk it is on if it is a partition. Returns an empty list if the device is not a block device.
+    """
+    try:
+        device_path = os.path.realpath(
+            os.path.join(BLOCK_DEVICE_NUMBERS_DIRECTORY, f"{os.major(device)}:{os.minor(device)}")
+        )
+    except (OSError, AttributeError):
+        # os.major does not exist on Windows
+        return []
+    if not os.path.isdir(device_path):
+        return []
+
+    disks = [os.path.basename(device_path)]
+    if is_partition(disks[0]):
+        disks.append(os.path.basename(os.path.dirname(device_path)))
+    return disks
+
+
+def is_partition(disk: str) -> bool:
+    return os.path.exists(os.path.join(BLOCK_DEVICES_DIRECTORY, disk, "partition"))
+
+
+def count_own_active_threads() -> int:
+    """
+    Returns the number of this process's threads that count towards the load average (running or waiting for I/O).
+    """
+    active_threads = 0
+    try:
+        thread_ids = os.listdir(OWN_TASKS_DIRECTORY)
+    except OSError:
+        return 0
+    for thread_id in thread_ids:
+        try:
+            with open(os.path.join(OWN_TASKS_DIRECTORY, thread_id, "stat")) as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            # The thread has exited
+            continue
+        # The state follows the thread name, which is in parentheses and can contain spaces
+        if stat[stat.rindex(")") + 2] in "RD":
+            active_threads += 1
+    return active_threads
+
+
+def parse_disk_stats(diskstats: str, disks: Optional[List[str]] = None) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the total milliseconds each disk has spent doing I/O and the total bytes it has read and written,
+    from the contents of /proc/diskstats.
+    If no disks are given, every whole disk except loop and RAM devices is included, but not their partitions,
+    whose I/O is already part of the disk they are on.
+    """
+    disk_stats = {}
+    for line in diskstats.splitlines():
+        fields = line.split()
+        if len(fields) < 13:
+            continue
+
+        disk = fields[2]
+        if disks is not None and disk not in disks:
+            continue
+        if disks is None and (disk.startswith(("loop", "ram")) or is_partition(disk)):
+            continue
+
+        # The third and seventh stats after the device name are the sectors read and written,
+        # and the tenth is the time spent doing I/O
+        transferred_bytes = (int(fields[5]) + int(fields[9])) * SECTOR_SIZE_BYTES
+        disk_stats[disk] = (int(fields[12]), transferred_bytes)
+
+    return disk_stats
+
+
+# Shared by every read so that the limits apply to the whole program
+IO_THROTTLE = IoThrottle()
+
+
+def reload_limits_safely():
+    """
+    Reloads the read limits from the configuration file, keeping the old limits if it cannot be read.
+    """
+    try:
+        IO_THROTTLE.reload_from_config()
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Could not reload the read limits, so the old ones are kept: {e}")
+
+
+def install_reload_signal_handler():
+    """
+    Reloads the read limits from the configuration file whenever the program receives SIGHUP.
+    """
+    if not hasattr(signal, "SIGHUP"):
+        # Windows does not have SIGHUP
+        return
+
+    def _on_reload(signal_number, frame):
+        # The handler runs in the main thread wherever it happens to be, which may be holding the throttle's lock,
+        # so the limits are reloaded on a thread of their own
+        threading.Thread(target=reload_limits_safely, name="reload-limits", daemon=True).start()
+
+    signal.signal(signal.SIGHUP, _on_reload)
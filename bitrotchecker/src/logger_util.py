@@ -1,33 +1,134 @@
+import atexit
+import json
 import os
+import threading
 from datetime import datetime
-from typing import IO, Optional
+from typing import IO, Optional, Any
+
+from bitrotchecker.src.constants import LOG_FLUSH_INTERVAL_SECONDS, LOG_BUFFER_SIZE
+
+LOGS_DIRECTORY = "logs"
+LATEST_LOG_FILE_NAME = "latest.txt"
+LATEST_EVENT_LOG_FILE_NAME = "latest.jsonl"
 
 
 class LoggerUtil:
-    def __init__(self):
-        self.latest_log_file: Optional[IO] = None
-        self.dated_log_file: Optional[IO] = None
+    """
+    Writes a run's messages to a dated text log, and a structured event for each of them to a dated JSONL event log.
+
+    Writes are buffered in memory and flushed by a background thread every LOG_FLUSH_INTERVAL_SECONDS,
+    and always when the logger is closed, even if the run crashed.
+    latest.txt and latest.jsonl link to the logs of the most recent run.
+    """
+
+    def __init__(
+        self, logs_directory: str = LOGS_DIRECTORY, flush_interval_seconds: float = LOG_FLUSH_INTERVAL_SECONDS
+    ):
+        self.logs_directory = logs_directory
+        self.flush_interval_seconds = flush_interval_seconds
+        self.log_file: Optional[IO] = None
+        self.event_log_file: Optional[IO] = None
+        # Files can be processed concurrently, so make sure messages do not interleave
+        self.lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
 
     def __enter__(self):
-        log_file_name = f"{datetime.now()}.txt".replace(":", "_")
-        self.latest_log_file = open(os.path.join("logs", "latest.txt"), mode="w", encoding="utf-8")
-        self.dated_log_file = open(os.path.join("logs", log_file_name), mode="w", encoding="utf-8")
+        log_name = f"{datetime.now()}".replace(":", "_")
+        log_file_name = f"{log_name}.txt"
+        event_log_file_name = f"{log_name}.jsonl"
+        self.log_file = open(
+            os.path.join(self.logs_directory, log_file_name), mode="w", encoding="utf-8", buffering=LOG_BUFFER_SIZE
+        )
+        self.event_log_file = open(
+            os.path.join(self.logs_directory, event_log_file_name),
+            mode="w",
+            encoding="utf-8",
+            buffering=LOG_BUFFER_SIZE,
+        )
+        self._link_latest(log_file_name, LATEST_LOG_FILE_NAME)
+        self._link_latest(event_log_file_name, LATEST_EVENT_LOG_FILE_NAME)
+
+        self._closed.clear()
+        self._flush_thread = threading.Thread(target=self._flush_periodically, name="log-flush", daemon=True)
+        self._flush_thread.start()
+        # The flush thread is a daemon, so make sure nothing buffered is lost if the program exits without __exit__
+        atexit.register(self.close)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.latest_log_file:
-            self.latest_log_file.close()
+        self.close()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+        atexit.unregister(self.close)
+
+        with self.lock:
+            if self.log_file:
+                self.log_file.close()
+
+            if self.event_log_file:
+                self.event_log_file.close()
+
+    def _link_latest(self, log_file_name: str, latest_file_name: str):
+        """
+        Points the latest log file at the given log file, instead of writing every message to a second copy.
+        """
+        latest_path = os.path.join(self.logs_directory, latest_file_name)
+        temporary_latest_path = f"{latest_path}.tmp"
+        if os.path.lexists(temporary_latest_path):
+            os.remove(temporary_latest_path)
+
+        try:
+            # Relative, so the link still works if the logs directory is moved
+            os.symlink(log_file_name, temporary_latest_path)
+        except OSError:
+            # Creating symlinks needs extra privileges on Windows, but hardlinks do not
+            try:
+                os.link(os.path.join(self.logs_directory, log_file_name), temporary_latest_path)
+            except OSError as e:
+                print(f"Could not link {latest_path} to {log_file_name}: {e}")
+                return
+
+        # Replace any previous latest file in one step, so it always exists
+        os.replace(temporary_latest_path, latest_path)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval_seconds):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.log_file:
+                self.log_file.flush()
 
-        if self.dated_log_file:
-            self.dated_log_file.close()
+            if self.event_log_file:
+                self.event_log_file.flush()
 
-    def write(self, message: str):
-        print(message)
+    def write(self, message: str, event: str = "message", **fields: Any):
+        """
+        Prints the message and writes it to the text log, along with an event holding the message and fields.
+        """
+        event_line = self._format_event(event, message=message, **fields)
+        with self.lock:
+            print(message)
+            self.log_file.write(message)
+            self.log_file.write("\n")
+            self.event_log_file.write(event_line)
 
-        self.latest_log_file.write(message)
-        self.latest_log_file.write("\n")
-        self.latest_log_file.flush()
+    def write_event(self, event: str, **fields: Any):
+        """
+        Writes an event to the event log only.
+        """
+        event_line = self._format_event(event, **fields)
+        with self.lock:
+            self.event_log_file.write(event_line)
 
-        self.dated_log_file.write(message)
-        self.dated_log_file.write("\n")
-        self.dated_log_file.flush()
+    @staticmethod
+    def _format_event(event: str, **fields: Any) -> str:
+        # Values from the database are not always JSON types, so fall back to their string form instead of failing
+        return json.dumps({"time": datetime.now().isoformat(), "event": event, **fields}, default=str) + "\n"
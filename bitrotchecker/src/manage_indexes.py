@@ -0,0 +1,31 @@
+from bitrotchecker.src.configuration_util import get_record_expiry_days
+from bitrotchecker.src.database_indexes import ensure_indexes, get_index_sizes, find_collection_scans
+from bitrotchecker.src.mongo_util import MongoUtil
+
+BYTES_IN_A_MIB = 1024 * 1024
+
+
+def main():
+    mongo_util = MongoUtil()
+    files_collection = mongo_util.files_collection
+
+    print("\n===================================")
+    for line in ensure_indexes(files_collection, get_record_expiry_days()):
+        print(line)
+
+    index_sizes = get_index_sizes(files_collection)
+    if index_sizes is None:
+        print("The database did not report the size of the indexes")
+    else:
+        for name, size_bytes in index_sizes.items():
+            print(f"Index {name}: {round(size_bytes / BYTES_IN_A_MIB, 2)} MiB")
+
+    collection_scans = find_collection_scans(files_collection)
+    if collection_scans:
+        print(f"FAIL: These queries still scan the whole collection: {', '.join(collection_scans)}")
+    else:
+        print("Every query that is run for every file uses an index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Dict, List, Mapping
+
+from pymongo import ReplaceOne
+from pymongo.database import Database
+
+from bitrotchecker.src.constants import (
+    MONGO_ID_KEY,
+    MONGO_WRITE_BATCH_SIZE,
+    SCHEMA_COLLECTION_NAME,
+    FILES_SCHEMA_ID,
+    SCHEMA_VERSION_KEY,
+    FILES_SCHEMA_VERSION,
+    LAST_MIGRATED_ID_KEY,
+    PENDING_INDEXES_KEY,
+    LEGACY_FILE_ID_KEY,
+    LEGACY_MODIFIED_TIME_KEY,
+    LEGACY_MODIFIED_TIME_S_KEY,
+    LEGACY_KEYS,
+    FILE_ID_KEY,
+    MODIFIED_TIME_NS_KEY,
+)
+from bitrotchecker.src.file_record import encode_file_id, get_nanos_from_mtime
+from bitrotchecker.src.mongo_util import MongoUtil, get_document_size
+
+# The index options that are kept when an index is recreated on the compact fields
+KEPT_INDEX_OPTIONS = ["unique", "sparse", "expireAfterSeconds"]
+
+
+@dataclass
+class MigrationReport:
+    documents_migrated: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+    def add(self, legacy_document: Mapping[str, Any], compact_document: Mapping[str, Any]):
+        self.documents_migrated += 1
+        self.bytes_before += get_document_size(legacy_document)
+        self.bytes_after += get_document_size(compact_document)
+
+    def get_lines(self) -> List[str]:
+        if self.documents_migrated == 0:
+            return ["No documents were migrated"]
+
+        bytes_saved = self.bytes_before - self.bytes_after
+        return [
+            f"Documents migrated: {self.documents_migrated}",
+            f"Average document size: {round(self.bytes_before / self.documents_migrated, 1)} bytes before,"
+            f" {round(self.bytes_after / self.documents_migrated, 1)} bytes after",
+            f"Space saved: {bytes_saved} bytes ({round(100 * bytes_saved / self.bytes_before, 1)}%)",
+        ]
+
+
+def convert_legacy_document(legacy_document: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Converts a document from the legacy schema into the compact schema, keeping the same _id.
+    The redundant mtime_s field is dropped.
+    """
+    compact_document = {MONGO_ID_KEY: legacy_document[MONGO_ID_KEY]}
+    for legacy_key, key in LEGACY_KEYS.items():
+        if legacy_key in legacy_document:
+            compact_document[key] = legacy_document[legacy_key]
+
+    compact_document[FILE_ID_KEY] = encode_file_id(legacy_document[LEGACY_FILE_ID_KEY])
+    compact_document[MODIFIED_TIME_NS_KEY] = get_nanos_from_mtime(legacy_document[LEGACY_MODIFIED_TIME_KEY])
+    return compact_document
+
+
+def _get_legacy_indexes(files_db: Database) -> List[Dict[str, Any]]:
+    """
+    Returns the indexes on legacy fields, along with the keys and options to recreate them on the compact fields.
+    """
+    # The seconds of the modified time are now part of the modified time in nanoseconds
+    legacy_index_keys = {**LEGACY_KEYS, LEGACY_MODIFIED_TIME_S_KEY: MODIFIED_TIME_NS_KEY}
+
+    legacy_indexes = []
+    for name, index in files_db.files.index_information().items():
+        if not any(field in legacy_index_keys for field, _ in index["key"]):
+            continue
+
+        keys = {}
+        for field, direction in index["key"]:
+            keys.setdefault(legacy_index_keys.get(field, field), direction)
+        legacy_indexes.append(
+            {
+                "name": name,
+                "keys": [[field, direction] for field, direction in keys.items()],
+                "options": {option: index[option] for option in KEPT_INDEX_OPTIONS if option in index},
+            }
+        )
+    return legacy_indexes
+
+
+def migrate_documents(files_db: Database, batch_size: int = MONGO_WRITE_BATCH_SIZE) -> MigrationReport:
+    """
+    Converts every document from the legacy schema into the compact schema, in place and in bulk batches.
+
+    Documents are streamed in _id order and the last migrated _id is saved after each batch,
+    so an interrupted migration continues where it stopped when run again.
+    Indexes on legacy fields are dropped first, since a unique index would reject the converted documents
+    which no longer have the legacy fields, and are recreated on the compact fields at the end.
+    """
+    report = MigrationReport()
+    schema_collection = files_db[SCHEMA_COLLECTION_NAME]
+    schema_filter = {MONGO_ID_KEY: FILES_SCHEMA_ID}
+    schema_document = schema_collection.find_one(schema_filter) or {}
+    if schema_document.get(SCHEMA_VERSION_KEY) == FILES_SCHEMA_VERSION:
+        print("The database has already been migrated")
+        return report
+
+    pending_indexes = schema_document.get(PENDING_INDEXES_KEY)
+    if pending_indexes is None:
+        pending_indexes = _get_legacy_indexes(files_db)
+        # Save the indexes before dropping them so that they are still recreated if the migration is interrupted
+        schema_collection.update_one(
+            schema_filter, {"$set": {SCHEMA_VERSION_KEY: 1, PENDING_INDEXES_KEY: pending_indexes}}, upsert=True
+        )
+        for index in pending_indexes:
+            print(f"Dropping index {index['name']} until the documents are migrated")
+            files_db.files.drop_index(index["name"])
+
+    last_migrated_id = schema_document.get(LAST_MIGRATED_ID_KEY)
+    if last_migrated_id is not None:
+        print(f"Continuing the migration after document {last_migrated_id}")
+    query = {} if last_migrated_id is None else {MONGO_ID_KEY: {"$gt": last_migrated_id}}
+    cursor = files_db.files.find(query, batch_size=batch_size).sort(MONGO_ID_KEY, 1)
+    while batch := list(islice(cursor, batch_size)):
+        writes = []
+        for document in batch:
+            # Documents from a batch that was written before the migration was interrupted are already converted
+            if LEGACY_FILE_ID_KEY not in document:
+                continue
+            compact_document = convert_legacy_document(document)
+            report.add(document, compact_document)
+            writes.append(ReplaceOne({MONGO_ID_KEY: document[MONGO_ID_KEY]}, compact_document))
+
+        if writes:
+            files_db.files.bulk_write(writes, ordered=False)
+        schema_collection.update_one(schema_filter, {"$set": {LAST_MIGRATED_ID_KEY: batch[-1][MONGO_ID_KEY]}})
+        print(f"Migrated {report.documents_migrated} documents")
+
+    for index in pending_indexes:
+        keys = [(field, direction) for field, direction in index["keys"]]
+        print(f"Creating index on {', '.join(field for field, _ in keys)}")
+        files_db.files.create_index(keys, **index["options"])
+
+    schema_collection.update_one(
+        schema_filter,
+        {
+            "$set": {SCHEMA_VERSION_KEY: FILES_SCHEMA_VERSION},
+            "$unset": {LAST_MIGRATED_ID_KEY: "", PENDING_INDEXES_KEY: ""},
+        },
+    )
+    return report
+
+
+def main():
+    answer = input(
+        "This will convert every document in the database to the compact schema."
+        " Back up the database first. Proceed? "
+    )
+    if answer.lower() not in ["y", "yes"]:
+        exit(1)
+
+    mongo_util = MongoUtil(require_current_schema=False)
+    report = migrate_documents(mongo_util.files_db)
+
+    print("\n===================================")
+    for line in report.get_lines():
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,107 @@
 import os.path
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Mapping
+from typing import Any, Mapping, Iterable, Iterator, Dict, List, Optional, Tuple
 
 import bson
-import pymongo
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError, PyMongoError, WriteError
 
+from bitrotchecker.src.block_checksums import (
+    get_block_checksums_of_range,
+    get_differing_byte_ranges,
+    format_byte_ranges,
+    should_have_block_checksums,
+)
+from bitrotchecker.src.checksum_algorithms import (
+    LEGACY_CHECKSUM_ALGORITHM,
+    CRC32_BLOCKS,
+    get_checksum_algorithm,
+    unpack_block_checksums,
+)
 from bitrotchecker.src.configuration_util import get_mongo_connection_string
 from bitrotchecker.src.constants import (
     SIZE_KEY,
     CHECKSUM_KEY,
+    CHECKSUM_ALGORITHM_KEY,
+    CHECKSUM_ALGORITHM,
     FILE_ID_KEY,
     LAST_ACCESSED_KEY,
-    MODIFIED_TIME_KEY,
+    MODIFIED_TIME_NS_KEY,
     MONGO_ID_KEY,
-    SECONDS_IN_A_YEAR,
     IGNORE_FILES_NEWER_THAN_SECONDS,
+    MONGO_LOOKUP_BATCH_SIZE,
+    MONGO_WRITE_BATCH_SIZE,
+    BLOCK_CHECKSUMS_KEY,
+    BLOCK_SIZE_KEY,
+    BLOCK_CHECKSUM_BLOCK_SIZE,
+    BLOCK_VERIFICATION_BYTES_PER_RUN,
+    NEXT_BLOCK_KEY,
+    SCHEMA_COLLECTION_NAME,
+    FILES_SCHEMA_ID,
+    SCHEMA_VERSION_KEY,
+    FILES_SCHEMA_VERSION,
 )
-from bitrotchecker.src.file_record import FileRecord
+from bitrotchecker.src.database_indexes import ensure_indexes
+from bitrotchecker.src.file_record import FileRecord, encode_file_id, decode_file_id
 from bitrotchecker.src.file_result import FileResult
 from bitrotchecker.src.file_result_enum import FileResultValue
 from bitrotchecker.src.logger_util import LoggerUtil
+from bitrotchecker.src.run_metrics import METRICS
+
+
+def get_document_size(document: Mapping[str, Any]) -> int:
+    return len(bson.BSON.encode(document))
+
+
+def _get_modified_time_filter(file_record: FileRecord) -> Any:
+    # Records migrated from the legacy schema have the modified time that was converted from a float
+    if file_record.legacy_modified_time_ns == file_record.modified_time_ns:
+        return file_record.modified_time_ns
+    return {"$in": [file_record.modified_time_ns, file_record.legacy_modified_time_ns]}
+
+
+def matches_modified_time(file_record: FileRecord, database_modified_time_ns: int) -> bool:
+    """
+    Returns whether the modified time of a record is the modified time of the file, including records whose float
+    modified time was converted to nanoseconds when migrating from the legacy schema.
+    """
+    return database_modified_time_ns in (file_record.modified_time_ns, file_record.legacy_modified_time_ns)
+
+
+@contextmanager
+def _round_trip(operation: str) -> Iterator[None]:
+    METRICS.increment("db_round_trips", operation=operation)
+    with METRICS.time(f"db_{operation}"):
+        yield
 
 
 class MongoUtil:
-    def __init__(self, database: Database = None):
+    def __init__(
+        self,
+        database: Database = None,
+        lookup_batch_size: int = MONGO_LOOKUP_BATCH_SIZE,
+        write_batch_size: int = MONGO_WRITE_BATCH_SIZE,
+        verbose: bool = False,
+        require_current_schema: bool = True,
+    ):
+        self.lookup_batch_size = lookup_batch_size
+        self.write_batch_size = write_batch_size
+        # Whether to print a line for every modified mutable file
+        self.verbose = verbose
+
+        # Documents fetched ahead of time by prefetch_file_ids, keyed by file ID.
+        # Each entry is consumed by the first process_file_record call for that file ID.
+        self._prefetched_documents: Dict[str, List[Mapping[str, Any]]] = dict()
+        # Writes for prefetched files are buffered and sent together with bulk_write.
+        # Each write has a future that is resolved once the bulk write it was sent in has succeeded or failed.
+        self._pending_writes: List[Tuple[UpdateOne, Future]] = []
+        self.lock = threading.Lock()
+
         if database:
             print("Using provided database object")
             self.files_db: Database = database
@@ -35,28 +110,182 @@ class MongoUtil:
             mongo_client = MongoClient(get_mongo_connection_string())
             self.files_db: Database = mongo_client.bitrot
 
+        # Indexes are created by manage_indexes, or below for a new database
         self.files_collection: Collection = self.files_db.files
-        # self.files_collection.create_index(
-        #     [(FILE_ID_KEY, pymongo.ASCENDING), (MODIFIED_TIME_KEY, pymongo.ASCENDING)], unique=True
-        # )
-        # self.files_collection.create_index(LAST_ACCESSED_KEY, expireAfterSeconds=SECONDS_IN_A_YEAR)
         print("Successfully connected with Mongo")
 
+        if require_current_schema:
+            self._check_schema_version()
+
+    def _check_schema_version(self):
+        """
+        Makes sure the documents are in the current schema, since documents in an older schema would never be found.
+        """
+        schema_collection = self.files_db[SCHEMA_COLLECTION_NAME]
+        schema_document = schema_collection.find_one({MONGO_ID_KEY: FILES_SCHEMA_ID})
+        if schema_document is not None and schema_document.get(SCHEMA_VERSION_KEY) == FILES_SCHEMA_VERSION:
+            return
+
+        if schema_document is None and self.files_collection.find_one({}, {MONGO_ID_KEY: 1}) is None:
+            # A new database starts out with the current schema and its indexes
+            schema_collection.update_one(
+                {MONGO_ID_KEY: FILES_SCHEMA_ID}, {"$set": {SCHEMA_VERSION_KEY: FILES_SCHEMA_VERSION}}, upsert=True
+            )
+            for line in ensure_indexes(self.files_collection):
+                print(line)
+            return
+
+        raise ValueError(
+            "The database is in an older schema. Run `python -m bitrotchecker.src.migrate_database` to migrate it."
+        )
+
+    def find_documents_by_file_ids(self, file_ids: Iterable[str]) -> Dict[str, List[Mapping[str, Any]]]:
+        """
+        Returns every document for the given hex file IDs, keyed by file ID.
+        File IDs with no documents map to an empty list.
+        """
+        documents_by_file_id: Dict[str, List[Mapping[str, Any]]] = {file_id: [] for file_id in file_ids}
+
+        unique_file_ids = list(documents_by_file_id.keys())
+        for batch_start in range(0, len(unique_file_ids), self.lookup_batch_size):
+            batch_end = batch_start + self.lookup_batch_size
+            batch = unique_file_ids[batch_start:batch_end]
+            with _round_trip("find"):
+                documents = list(
+                    self.files_collection.find({FILE_ID_KEY: {"$in": [encode_file_id(file_id) for file_id in batch]}})
+                )
+            for document in documents:
+                documents_by_file_id[decode_file_id(document[FILE_ID_KEY])].append(document)
+
+        return documents_by_file_id
+
+    def prefetch_file_ids(self, file_ids: Iterable[str]):
+        """
+        Looks up the given file IDs ahead of time so that process_file_record does not need to query the database.
+        Writes for prefetched files are buffered, so flush must be called once processing is done.
+        """
+        documents_by_file_id = self.find_documents_by_file_ids(file_ids)
+        with self.lock:
+            self._prefetched_documents.update(documents_by_file_id)
+
+    def flush(self):
+        """
+        Sends every buffered write to the database and forgets any prefetched documents that were not used.
+        """
+        with self.lock:
+            self._prefetched_documents.clear()
+        self._flush_writes(minimum_writes=1)
+
+    def _update_one(
+        self, record_filter: Mapping[str, Any], update: Mapping[str, Any], upsert: bool, buffered: bool
+    ) -> Optional[Future]:
+        """
+        Updates a single document, either right away or as part of the next bulk write if buffered.
+        Returns a future that is resolved once a buffered write has been sent, or None if it was written right away.
+        """
+        if not buffered:
+            with _round_trip("update_one"):
+                self.files_collection.update_one(filter=record_filter, update=update, upsert=upsert)
+            return None
+
+        written = Future()
+        with self.lock:
+            self._pending_writes.append((UpdateOne(filter=record_filter, update=update, upsert=upsert), written))
+        self._flush_writes(minimum_writes=self.write_batch_size)
+        return written
+
+    def _flush_writes(self, minimum_writes: int):
+        with self.lock:
+            if len(self._pending_writes) < minimum_writes:
+                return
+            writes = self._pending_writes
+            self._pending_writes = []
+
+        for batch_start in range(0, len(writes), self.write_batch_size):
+            batch_end = batch_start + self.write_batch_size
+            self._bulk_write(writes[batch_start:batch_end])
+
+    def _bulk_write(self, writes: List[Tuple[UpdateOne, Future]]):
+        """
+        Sends a batch of buffered writes and resolves the future of each one.
+        A write that fails only fails its own future, rather than raising in whichever file's worker filled the batch.
+        """
+        try:
+            with _round_trip("bulk_write"):
+                self.files_collection.bulk_write([operation for operation, _ in writes], ordered=False)
+        except BulkWriteError as e:
+            # The writes are unordered, so every write without an error of its own was written
+            write_errors = {write_error["index"]: write_error for write_error in e.details.get("writeErrors", [])}
+            write_concern_errors = e.details.get("writeConcernErrors", [])
+            for index, (_, written) in enumerate(writes):
+                write_error = write_errors.get(index)
+                if write_error is not None:
+                    written.set_exception(WriteError(write_error["errmsg"], write_error["code"], write_error))
+                elif write_concern_errors:
+                    written.set_exception(
+                        WriteError(write_concern_errors[0]["errmsg"], write_concern_errors[0]["code"])
+                    )
+                else:
+                    written.set_result(None)
+            num_failed = len(writes) if write_concern_errors else len(write_errors)
+            METRICS.increment("db_write_errors", num_failed)
+            print(f"WARNING: {num_failed} of {len(writes)} database writes failed: {e}")
+        except PyMongoError as e:
+            for _, written in writes:
+                written.set_exception(e)
+            METRICS.increment("db_write_errors", len(writes))
+            print(f"WARNING: {len(writes)} database writes failed: {e}")
+        else:
+            for _, written in writes:
+                written.set_result(None)
+
+    def _pop_prefetched_documents(self, file_id: str) -> Optional[List[Mapping[str, Any]]]:
+        with self.lock:
+            return self._prefetched_documents.pop(file_id, None)
+
     def _find_document(
-        self, file_record: FileRecord, logger: LoggerUtil, file_is_immutable: bool
+        self,
+        file_record: FileRecord,
+        logger: LoggerUtil,
+        file_is_immutable: bool,
+        prefetched_documents: Optional[List[Mapping[str, Any]]] = None,
     ) -> Mapping[str, Any] | None:
-        database_document = self.files_collection.find_one(
-            {FILE_ID_KEY: file_record.file_id, MODIFIED_TIME_KEY: file_record.modified_time}
-        )
+        if prefetched_documents is None:
+            with _round_trip("find_one"):
+                database_document = self.files_collection.find_one(
+                    {
+                        FILE_ID_KEY: encode_file_id(file_record.file_id),
+                        MODIFIED_TIME_NS_KEY: _get_modified_time_filter(file_record),
+                    }
+                )
+        else:
+            database_document = next(
+                (
+                    document
+                    for document in prefetched_documents
+                    if matches_modified_time(file_record, document[MODIFIED_TIME_NS_KEY])
+                ),
+                None,
+            )
 
         if database_document:
             # If the document exists, update its last accessed time so that it is not cleaned up
             current_datetime = datetime.now()
-            update_result = self.files_collection.update_one(
-                filter={MONGO_ID_KEY: database_document[MONGO_ID_KEY]},
-                update={"$set": {LAST_ACCESSED_KEY: current_datetime}},
-                upsert=False,
-            )
+            if prefetched_documents is not None:
+                self._update_one(
+                    {MONGO_ID_KEY: database_document[MONGO_ID_KEY]},
+                    {"$set": {LAST_ACCESSED_KEY: current_datetime}},
+                    upsert=False,
+                    buffered=True,
+                )
+                return {**database_document, LAST_ACCESSED_KEY: current_datetime}
+
+            with _round_trip("update_one"):
+                update_result = self.files_collection.update_one(
+                    filter={MONGO_ID_KEY: database_document[MONGO_ID_KEY]},
+                    update={"$set": {LAST_ACCESSED_KEY: current_datetime}},
+                    upsert=False,
+                )
 
             # Don't look at modified_count as MongoDB may choose to not update the document
             # if the timestamps are too close together.
@@ -64,9 +293,16 @@ class MongoUtil:
                 raise ValueError(f"Could not update last accessed time for {file_record.file_id}")
 
             # We want to return the updated document, not the stale one we got earlier
-            return self.files_collection.find_one({MONGO_ID_KEY: database_document[MONGO_ID_KEY]})
+            with _round_trip("find_one"):
+                return self.files_collection.find_one({MONGO_ID_KEY: database_document[MONGO_ID_KEY]})
         else:
-            file_record_with_different_mtime = self.files_collection.find_one({FILE_ID_KEY: file_record.file_id})
+            if prefetched_documents is None:
+                with _round_trip("find_one"):
+                    file_record_with_different_mtime = self.files_collection.find_one(
+                        {FILE_ID_KEY: encode_file_id(file_record.file_id)}
+                    )
+            else:
+                file_record_with_different_mtime = prefetched_documents[0] if prefetched_documents else None
             if file_record_with_different_mtime is None:
                 # We have never seen this file before.
                 return None
@@ -84,23 +320,77 @@ class MongoUtil:
                     return file_record_with_different_mtime
                 else:
                     # The file is mutable, so we should just create a new record.
-                    print(
-                        f"File has been seen before but has been modified: "
-                        f"{file_record.file_path} - "
-                        f"{datetime.fromtimestamp(file_record.modified_time, tz=timezone.utc)}"
-                    )
+                    if self.verbose:
+                        print(
+                            f"File has been seen before but has been modified: "
+                            f"{file_record.file_path} - "
+                            f"{datetime.fromtimestamp(file_record.modified_time, tz=timezone.utc)}"
+                        )
                     return None
 
+    def _verify_blocks_partially(
+        self, true_file_path: str, file_record: FileRecord, database_document: Mapping[str, Any], buffered: bool
+    ) -> Optional[FileResult]:
+        """
+        Verifies the next BLOCK_VERIFICATION_BYTES_PER_RUN bytes of blocks of a file, continuing from the last run.
+        Returns None if the whole file should be verified at once instead.
+        """
+        if BLOCK_VERIFICATION_BYTES_PER_RUN is None:
+            return None
+
+        block_size = database_document[BLOCK_SIZE_KEY]
+        database_block_checksums = unpack_block_checksums(database_document[BLOCK_CHECKSUMS_KEY])
+        num_blocks = len(database_block_checksums)
+        blocks_per_run = max(1, BLOCK_VERIFICATION_BYTES_PER_RUN // block_size)
+        if num_blocks <= blocks_per_run:
+            return None
+
+        first_block = database_document.get(NEXT_BLOCK_KEY, 0)
+        if first_block >= num_blocks:
+            first_block = 0
+        end_block = min(first_block + blocks_per_run, num_blocks)
+
+        local_block_checksums = get_block_checksums_of_range(
+            file_record.full_file_path, block_size, first_block, end_block - first_block
+        )
+        byte_ranges = get_differing_byte_ranges(
+            database_block_checksums[first_block:end_block], local_block_checksums, block_size, first_block
+        )
+        if byte_ranges or len(local_block_checksums) != end_block - first_block:
+            return FileResult(
+                FileResultValue.FAIL,
+                f"File {true_file_path} has different block checksums than expected."
+                f" Changed bytes: {format_byte_ranges(byte_ranges, file_record.size)}",
+                details={"check": "block_checksums", "changed_byte_ranges": byte_ranges},
+            )
+
+        # Pick up from the next block on the next run, starting over once every block has been verified
+        next_block = end_block % num_blocks
+        written = self._update_one(
+            {MONGO_ID_KEY: database_document[MONGO_ID_KEY]},
+            {"$set": {NEXT_BLOCK_KEY: next_block}},
+            upsert=False,
+            buffered=buffered,
+        )
+        return FileResult(
+            FileResultValue.PASS,
+            f"File {true_file_path} blocks {first_block}-{end_block - 1} of {num_blocks} passed verification",
+            complete=next_block == 0,
+            written=written,
+        )
+
     def process_file_record(
         self, true_file_path: str, file_record: FileRecord, logger: LoggerUtil, file_is_immutable: bool
     ) -> FileResult:
-        database_document = self._find_document(file_record, logger, file_is_immutable)
+        prefetched_documents = self._pop_prefetched_documents(file_record.file_id)
+        database_document = self._find_document(file_record, logger, file_is_immutable, prefetched_documents)
         if database_document:
             # We have already seen this file before so check to see if there is bit-rot
-            database_file_id = database_document[FILE_ID_KEY]
-            database_file_mtime = database_document[MODIFIED_TIME_KEY]
+            database_file_id = decode_file_id(database_document[FILE_ID_KEY])
+            database_file_mtime = database_document[MODIFIED_TIME_NS_KEY]
             database_file_size = database_document[SIZE_KEY]
             database_file_crc = database_document[CHECKSUM_KEY]
+            database_checksum_algorithm = database_document.get(CHECKSUM_ALGORITHM_KEY, LEGACY_CHECKSUM_ALGORITHM)
 
             if file_record.file_id != database_file_id:
                 raise ValueError(
@@ -108,11 +398,12 @@ class MongoUtil:
                     f" but Database={database_file_id!r}."
                 )
 
-            if file_record.modified_time != database_file_mtime:
+            if not matches_modified_time(file_record, database_file_mtime):
                 return FileResult(
                     FileResultValue.FAIL,
-                    f"File {true_file_path} mtime mismatch: Local File={file_record.modified_time!r}"
-                    f" but Database={database_file_mtime!r}.",
+                    f"File {true_file_path} mtime mismatch: Local File={file_record.modified_time_ns!r}"
+                    f" but Database={database_file_mtime!r} nanoseconds.",
+                    details={"check": "mtime", "expected": database_file_mtime, "actual": file_record.modified_time_ns},
                 )
 
             if file_record.size != database_file_size:
@@ -120,13 +411,73 @@ class MongoUtil:
                     FileResultValue.FAIL,
                     f"File {true_file_path} has a different size than expected. "
                     f"Database={database_file_size!r} but Local File={file_record.size!r}",
+                    details={"check": "size", "expected": database_file_size, "actual": file_record.size},
                 )
 
-            if file_record.checksum != database_file_crc:
+            buffered = prefetched_documents is not None
+            database_block_checksums = database_document.get(BLOCK_CHECKSUMS_KEY)
+            if database_block_checksums is not None:
+                partial_result = self._verify_blocks_partially(true_file_path, file_record, database_document, buffered)
+                if partial_result is not None:
+                    return partial_result
+
+            # Calculate the configured algorithms in the same read, in case the record needs to be upgraded to them
+            wants_block_checksums = should_have_block_checksums(file_record.size)
+            algorithms = {database_checksum_algorithm, CHECKSUM_ALGORITHM}
+            if wants_block_checksums or database_block_checksums is not None:
+                algorithms.add(CRC32_BLOCKS)
+            local_checksums = file_record.get_checksums(algorithms)
+
+            local_file_crc = local_checksums[database_checksum_algorithm]
+            if local_file_crc != database_file_crc:
+                algorithm_name = get_checksum_algorithm(database_checksum_algorithm).display_name
+                message = (
+                    f"File {true_file_path} has a different {algorithm_name} checksum than expected. "
+                    f"Database={database_file_crc!r} but Local File={local_file_crc!r}"
+                )
+                details = {
+                    "check": "checksum",
+                    "checksum_algorithm": database_checksum_algorithm,
+                    "expected": database_file_crc,
+                    "actual": local_file_crc,
+                }
+                if (
+                    database_block_checksums is not None
+                    and database_document[BLOCK_SIZE_KEY] == BLOCK_CHECKSUM_BLOCK_SIZE
+                ):
+                    byte_ranges = get_differing_byte_ranges(
+                        unpack_block_checksums(database_block_checksums),
+                        unpack_block_checksums(local_checksums[CRC32_BLOCKS]),
+                        BLOCK_CHECKSUM_BLOCK_SIZE,
+                    )
+                    message += f". Changed bytes: {format_byte_ranges(byte_ranges, file_record.size)}"
+                    details["changed_byte_ranges"] = byte_ranges
+                return FileResult(FileResultValue.FAIL, message, details=details)
+
+            upgraded_fields = {}
+            if database_file_mtime != file_record.modified_time_ns:
+                # Replace the modified time converted from a float with the exact one
+                upgraded_fields[MODIFIED_TIME_NS_KEY] = file_record.modified_time_ns
+            if database_checksum_algorithm != CHECKSUM_ALGORITHM:
+                upgraded_fields[CHECKSUM_KEY] = local_checksums[CHECKSUM_ALGORITHM]
+                upgraded_fields[CHECKSUM_ALGORITHM_KEY] = CHECKSUM_ALGORITHM
+            if wants_block_checksums and database_document.get(BLOCK_SIZE_KEY) != BLOCK_CHECKSUM_BLOCK_SIZE:
+                upgraded_fields[BLOCK_CHECKSUMS_KEY] = local_checksums[CRC32_BLOCKS]
+                upgraded_fields[BLOCK_SIZE_KEY] = BLOCK_CHECKSUM_BLOCK_SIZE
+                upgraded_fields[NEXT_BLOCK_KEY] = 0
+
+            if upgraded_fields:
+                written = self._update_one(
+                    {MONGO_ID_KEY: database_document[MONGO_ID_KEY]},
+                    {"$set": upgraded_fields},
+                    upsert=False,
+                    buffered=buffered,
+                )
                 return FileResult(
-                    FileResultValue.FAIL,
-                    f"File {true_file_path} has a different CRC than expected. "
-                    f"Database={database_file_crc!r} but Local File={file_record.checksum!r}",
+                    FileResultValue.PASS,
+                    f"File {true_file_path} passed verification and its record was upgraded"
+                    f" with new {', '.join(upgraded_fields)} fields",
+                    written=written,
                 )
         else:
             # We need to be confident that a new immutable file is completely done being modified.
@@ -139,6 +490,7 @@ class MongoUtil:
                 now = datetime.now()
                 seconds_since_file_created = (now - file_creation_datetime).total_seconds()
                 if seconds_since_file_created <= IGNORE_FILES_NEWER_THAN_SECONDS:
+                    METRICS.increment("files_skipped", reason="recently_created")
                     return FileResult(
                         FileResultValue.SKIP,
                         f"Immutable file {true_file_path} skipped because it was created"
@@ -146,12 +498,13 @@ class MongoUtil:
                     )
 
             # This file record is not in the database. Time to create a new document.
-            self.files_collection.update_one(
-                filter={FILE_ID_KEY: file_record.file_id, MODIFIED_TIME_KEY: file_record.modified_time},
-                update={"$set": (file_record.get_mongo_document())},
+            written = self._update_one(
+                {FILE_ID_KEY: encode_file_id(file_record.file_id), MODIFIED_TIME_NS_KEY: file_record.modified_time_ns},
+                {"$set": (file_record.get_mongo_document())},
                 upsert=True,
+                buffered=prefetched_documents is not None,
             )
-            return FileResult(FileResultValue.PASS, f"New file {true_file_path} record created: {file_record}")
+            return FileResult(FileResultValue.PASS, f"New file {true_file_path} record created", written=written)
 
         return FileResult(FileResultValue.PASS, f"File {true_file_path} passed verification")
 
@@ -163,7 +516,7 @@ class MongoUtil:
         total_size_bytes = 0
         total_documents = 0
         for document in documents:
-            size_bytes = len(bson.BSON.encode(document))
+            size_bytes = get_document_size(document)
 
             smallest_size_bytes = min(smallest_size_bytes, size_bytes)
             largest_size_bytes = max(largest_size_bytes, size_bytes)
@@ -179,8 +532,31 @@ class MongoUtil:
         print(f"Average document size: {average_document_size_bytes} bytes")
 
     def get_all_records_for_file_id(self, file_id: str):
-        return self.files_collection.find({FILE_ID_KEY: file_id})
+        return self.files_collection.find({FILE_ID_KEY: encode_file_id(file_id)})
 
-    def remove_records_with_file_id(self, file_id: str) -> int:
-        result = self.files_collection.delete_many(filter={"file_id": file_id})
+    def remove_records_with_file_ids(self, file_ids: List[str]) -> int:
+        """
+        Deletes every record of the given hex file IDs with a single query.
+        Returns the number of documents deleted.
+        """
+        with _round_trip("delete_many"):
+            result = self.files_collection.delete_many(
+                filter={FILE_ID_KEY: {"$in": [encode_file_id(file_id) for file_id in file_ids]}}
+            )
         return result.deleted_count
+
+    def count_records_with_file_ids(self, file_ids: List[str]) -> Tuple[int, int]:
+        """
+        Counts the records of the given hex file IDs with a single aggregation.
+        Returns the number of documents and the number of file IDs that have at least one document.
+        """
+        pipeline = [
+            {"$match": {FILE_ID_KEY: {"$in": [encode_file_id(file_id) for file_id in file_ids]}}},
+            {"$group": {MONGO_ID_KEY: f"${FILE_ID_KEY}", "documents": {"$sum": 1}}},
+            {"$group": {MONGO_ID_KEY: None, "documents": {"$sum": "$documents"}, "file_ids": {"$sum": 1}}},
+        ]
+        with _round_trip("aggregate"):
+            counts = next(self.files_collection.aggregate(pipeline), None)
+        if counts is None:
+            return 0, 0
+        return counts["documents"], counts["file_ids"]
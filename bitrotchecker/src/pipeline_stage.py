@@ -0,0 +1,133 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional
+
+# Put on a stage's queue to tell its workers that no more items are coming
+_DONE = object()
+
+
+class StageMetrics:
+    """
+    Counts the work done by a stage and how deep its queue got.
+    A queue that is often full means the stage is the bottleneck, and one that is always empty means it is waiting.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._total_queue_depth = 0
+        self._queue_depth_samples = 0
+
+    def record_queue_depth(self, queue_depth: int):
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+            self._total_queue_depth += queue_depth
+            self._queue_depth_samples += 1
+
+    def record_work(self, items: int, seconds: float):
+        with self.lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    @property
+    def average_queue_depth(self) -> float:
+        with self.lock:
+            return self._total_queue_depth / max(1, self._queue_depth_samples)
+
+    def __str__(self) -> str:
+        queue_size = "unbounded" if self.queue_size <= 0 else self.queue_size
+        return (
+            f"{self.name}: {self.items} items, {self.workers} workers busy for {self.busy_seconds:.1f}s,"
+            f" queue depth average {self.average_queue_depth:.1f} max {self.max_queue_depth} of {queue_size}"
+        )
+
+
+class PipelineStage:
+    """
+    One stage of a pipeline: a bounded queue of items and the workers that take items from it.
+
+    Putting an item blocks while the queue is full, so a slow stage holds back the stages before it
+    instead of letting work pile up in memory. Each batch of items is passed to the function,
+    and everything the function returns is passed to the output (usually the put of the next stage).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable[[List[Any]], Optional[Iterable[Any]]],
+        workers: int = 1,
+        queue_size: int = 0,
+        batch_size: int = 1,
+        output: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+    ):
+        self.name = name
+        self.function = function
+        self.batch_size = batch_size
+        self.output = output
+        self.on_error = on_error
+        self.metrics = StageMetrics(name, workers, queue_size)
+
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item: Any):
+        self.queue.put(item)
+        self.metrics.record_queue_depth(self.queue.qsize())
+
+    def close(self):
+        """
+        Waits for every item that was put to be processed and stops the workers.
+        """
+        self.queue.put(_DONE)
+        for thread in self._threads:
+            thread.join()
+
+    def _take_batch(self) -> Optional[List[Any]]:
+        """
+        Waits for an item, then takes whatever else is already queued up to the batch size without waiting.
+        Returns None once the stage is closed.
+        """
+        item = self.queue.get()
+        if item is _DONE:
+            # Leave the marker for the other workers
+            self.queue.put(_DONE)
+            return None
+
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                self.queue.put(_DONE)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _work(self):
+        while (batch := self._take_batch()) is not None:
+            try:
+                start_time = time.monotonic()
+                outputs = list(self.function(batch) or [])
+                # Time spent waiting on the next stage is not counted as busy
+                self.metrics.record_work(len(batch), time.monotonic() - start_time)
+
+                if self.output is not None:
+                    for output in outputs:
+                        self.output(output)
+            except Exception as e:
+                # A worker that dies would leave the stages before it blocked forever
+                if self.on_error is not None:
+                    self.on_error(e)
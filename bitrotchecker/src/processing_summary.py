@@ -0,0 +1,17 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class ProcessingSummary:
+    successes: int = 0
+    failures: int = 0
+    skips: int = 0
+
+    def add_result(self, success: Optional[bool]):
+        if success is None:
+            self.skips += 1
+        elif success:
+            self.successes += 1
+        else:
+            self.failures += 1
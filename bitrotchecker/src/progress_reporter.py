@@ -0,0 +1,165 @@
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional, TextIO, Tuple
+
+from bitrotchecker.src.constants import PROGRESS_REPORT_INTERVAL_SECONDS
+from bitrotchecker.src.run_metrics import METRICS
+
+BYTES_IN_A_GIB = 1024 * 1024 * 1024
+BYTES_IN_A_MIB = 1024 * 1024
+
+
+class ProgressReporter:
+    """
+    Shows how far through a run the program is, instead of a line for every file.
+
+    At most one line is written every interval, no matter how many threads report files.
+    On a terminal the line is rewritten in place. Otherwise, such as when output goes to a log, a new line is written.
+    The totals are estimates (from a count before the run or from the previous run), so they can be missing or wrong.
+    """
+
+    def __init__(
+        self,
+        total_files: Optional[int] = None,
+        total_bytes: Optional[int] = None,
+        interval_seconds: float = PROGRESS_REPORT_INTERVAL_SECONDS,
+        output: TextIO = sys.stdout,
+    ):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval_seconds = interval_seconds
+        self.output = output
+        self.rewrite_line = output.isatty()
+        self.lock = threading.Lock()
+
+        self.start()
+
+    def start(self):
+        """
+        Starts measuring from now, so that time spent before processing (such as finding files) is not counted.
+        """
+        with self.lock:
+            # Every file seen, including the files skipped without being read
+            self.files_done = 0
+            self.bytes_done = 0
+            self.files_skipped = 0
+            self.bytes_skipped = 0
+            self.start_time = time.monotonic()
+            self._last_report_time = self.start_time
+            self._starting_bytes_hashed = METRICS.get_counter("bytes_hashed")
+
+    def add(self, num_files: int = 1, num_bytes: int = 0, skipped: bool = False):
+        """
+        Counts files that are done. Skipped files, such as those verified recently, were not read.
+        """
+        with self.lock:
+            self.files_done += num_files
+            self.bytes_done += num_bytes
+            if skipped:
+                self.files_skipped += num_files
+                self.bytes_skipped += num_bytes
+
+            now = time.monotonic()
+            if now - self._last_report_time < self.interval_seconds:
+                return
+            self._last_report_time = now
+            self._write(self.format_progress(now))
+
+    def finish(self):
+        with self.lock:
+            self._write(self.format_progress(time.monotonic()))
+            if self.rewrite_line:
+                self.output.write("\n")
+                self.output.flush()
+
+    def _write(self, line: str):
+        if self.rewrite_line:
+            # Pad so that a shorter line fully covers the previous one
+            self.output.write(f"\r{line:<120}")
+        else:
+            self.output.write(f"{line}\n")
+        self.output.flush()
+
+    def get_progress(self) -> Dict[str, float]:
+        """
+        Returns the files and bytes done so far and the throughput, such as for a status endpoint.
+        """
+        with self.lock:
+            elapsed_seconds = max(time.monotonic() - self.start_time, 1e-9)
+            bytes_hashed = METRICS.get_counter("bytes_hashed") - self._starting_bytes_hashed
+            return {
+                "files_done": self.files_done,
+                "bytes_done": self.bytes_done,
+                "files_skipped": self.files_skipped,
+                "bytes_skipped": self.bytes_skipped,
+                "elapsed_seconds": round(elapsed_seconds, 1),
+                "files_per_second": round(self.files_done / elapsed_seconds, 1),
+                "bytes_read_per_second": round(bytes_hashed / elapsed_seconds),
+            }
+
+    def format_progress(self, now: float) -> str:
+        elapsed_seconds = max(now - self.start_time, 1e-9)
+        bytes_hashed = METRICS.get_counter("bytes_hashed") - self._starting_bytes_hashed
+
+        files = f"{self.files_done}" if self.total_files is None else f"{self.files_done}/{self.total_files}"
+        data = f"{self.bytes_done / BYTES_IN_A_GIB:.2f}"
+        if self.total_bytes is not None:
+            data += f"/{self.total_bytes / BYTES_IN_A_GIB:.2f}"
+        parts = [
+            f"{files} files",
+            f"{data} GiB",
+            f"{self.files_done / elapsed_seconds:.0f} files/s",
+            f"{bytes_hashed / BYTES_IN_A_MIB / elapsed_seconds:.1f} MiB/s read",
+        ]
+
+        remaining_seconds = self._estimate_remaining_seconds(elapsed_seconds)
+        if remaining_seconds is not None:
+            parts.append(f"ETA {_format_duration(remaining_seconds)}")
+
+        return ", ".join(parts)
+
+    def _estimate_remaining_seconds(self, elapsed_seconds: float) -> Optional[float]:
+        # Skipped files take almost no time, so the estimate is of the files that are read: the files read so far
+        # out of the total minus the files skipped so far.
+        # Bytes are a better measure of the work left than files, since large files take far longer
+        bytes_read = self.bytes_done - self.bytes_skipped
+        files_read = self.files_done - self.files_skipped
+        if self.total_bytes and bytes_read > 0:
+            fraction_done = bytes_read / max(self.total_bytes - self.bytes_skipped, bytes_read)
+        elif self.total_files and files_read > 0:
+            fraction_done = files_read / max(self.total_files - self.files_skipped, files_read)
+        else:
+            return None
+
+        # The totals are estimates, so the run may go past them
+        fraction_done = min(fraction_done, 1.0)
+        return elapsed_seconds / fraction_done - elapsed_seconds
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def load_previous_totals(totals_file_path: str) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Returns the number of files and bytes seen by the previous run, if there was one.
+    """
+    if not os.path.exists(totals_file_path):
+        return None, None
+
+    with open(totals_file_path) as totals_file:
+        totals = json.load(totals_file)
+    return totals["files"], totals["bytes"]
+
+
+def save_totals(totals_file_path: str, files: int, num_bytes: int):
+    """
+    Saves the number of files and bytes seen by this run, for the next run's progress.
+    """
+    with open(totals_file_path, mode="w") as totals_file:
+        json.dump({"files": files, "bytes": num_bytes}, totals_file)
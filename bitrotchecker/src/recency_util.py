@@ -1,36 +1,93 @@
 import os
 import pickle
+import sqlite3
+import threading
+import time
 from datetime import datetime
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List
 
-from atomicwrites import atomic_write
+from bitrotchecker.src.constants import RECENCY_FILE_NAME, RECENCY_MINIMUM_AGE_DAYS, LEGACY_RECENCY_FILE_NAME
+from bitrotchecker.src.run_metrics import METRICS
 
-from bitrotchecker.src.constants import RECENCY_FILE_NAME, RECENCY_MINIMUM_AGE_DAYS
+SECONDS_IN_A_DAY = 60 * 60 * 24
 
 
 class RecencyUtil:
-    def __init__(self, recency_file_path=RECENCY_FILE_NAME):
-        self.recency_dict = dict()
-        self.recency_file_path = recency_file_path
+    """
+    Keeps track of when each file last passed verification.
 
-        if os.path.exists(self.recency_file_path):
-            with open(self.recency_file_path, mode="rb") as recency_file:
-                self.recency_dict: Dict[str, Tuple] = pickle.load(recency_file)
+    Records are kept in an SQLite database so that each processed file is a single small write
+    instead of a rewrite of every record.
+    """
 
-    def _save_pickle(self):
-        with atomic_write(self.recency_file_path, mode="wb", overwrite=True) as recency_file:
-            recency_file.write(pickle.dumps(self.recency_dict, protocol=pickle.HIGHEST_PROTOCOL))
+    def __init__(self, recency_file_path=RECENCY_FILE_NAME):
+        self.recency_file_path = recency_file_path
+        self.lock = threading.Lock()
+
+        # Every statement commits on its own, and the write-ahead log keeps those commits cheap and crash safe
+        self.connection = sqlite3.connect(self.recency_file_path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS recency ("
+            " file_path TEXT PRIMARY KEY,"
+            " processed_time REAL NOT NULL,"
+            " modified_time REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS recency_processed_time ON recency (processed_time)")
+
+    def import_legacy_pickle(self, legacy_recency_file_path: str = LEGACY_RECENCY_FILE_NAME):
+        """
+        Imports the records that older versions saved to a pickle, if it exists, and renames it so it is only
+        imported once.
+        """
+        if not os.path.exists(legacy_recency_file_path):
+            return
+
+        with open(legacy_recency_file_path, mode="rb") as recency_file:
+            recency_dict: Dict[str, Tuple[datetime, float]] = pickle.load(recency_file)
+
+        print(f"Importing {len(recency_dict)} records from {legacy_recency_file_path}...")
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                # Never overwrite a record that was written after the pickle
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO recency (file_path, processed_time, modified_time) VALUES (?, ?, ?)",
+                    (
+                        (file_path, datetime_last_processed.timestamp(), file_modified_time)
+                        for file_path, (datetime_last_processed, file_modified_time) in recency_dict.items()
+                    ),
+                )
+
+        # Only move the pickle out of the way once its records are safely committed
+        os.replace(legacy_recency_file_path, legacy_recency_file_path + ".imported")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM recency").fetchone()[0]
 
     def record_file_processed(self, true_file_path: str, file_modified_time: float):
-        self.recency_dict[true_file_path] = (datetime.now(), file_modified_time)
-        self._save_pickle()
+        with METRICS.time("recency_record"), self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO recency (file_path, processed_time, modified_time) VALUES (?, ?, ?)",
+                (true_file_path, time.time(), file_modified_time),
+            )
 
     def file_processed_recently(self, true_file_path: str, file_modified_time: float) -> bool:
-        recency_tuple: Optional[Tuple[datetime, datetime]] = self.recency_dict.get(true_file_path, None)
+        with METRICS.time("recency_lookup"), self.lock:
+            recency_tuple: Optional[Tuple[float, float]] = self.connection.execute(
+                "SELECT processed_time, modified_time FROM recency WHERE file_path = ?", (true_file_path,)
+            ).fetchone()
         if recency_tuple is None:
             return False
 
-        datetime_last_processed = recency_tuple[0]
+        time_last_processed = recency_tuple[0]
         recorded_last_modified_time = recency_tuple[1]
 
         # If the file was modified since the last time we saw it, we need to check it again
@@ -39,25 +96,48 @@ class RecencyUtil:
             return False
 
         # If the file is not modified, check if we should read it fully
-        datetime_diff = datetime.now() - datetime_last_processed
-        return datetime_diff.days < RECENCY_MINIMUM_AGE_DAYS
+        days_since_processed = (time.time() - time_last_processed) // SECONDS_IN_A_DAY
+        return days_since_processed < RECENCY_MINIMUM_AGE_DAYS
+
+    def get_last_processed_time(self, true_file_path: str, file_modified_time: float) -> Optional[float]:
+        """
+        Returns when the file last passed verification, or None if it never has since it was last modified.
+        """
+        with self.lock:
+            recency_tuple: Optional[Tuple[float, float]] = self.connection.execute(
+                "SELECT processed_time, modified_time FROM recency WHERE file_path = ?", (true_file_path,)
+            ).fetchone()
+        if recency_tuple is None or recency_tuple[1] != file_modified_time:
+            return None
+
+        return recency_tuple[0]
+
+    def get_last_processed_times(self, files: List[Tuple[str, float]]) -> Dict[str, float]:
+        """
+        Returns when each of the (path, modified time) files last passed verification with a single query,
+        leaving out the files that never have since they were last modified.
+        """
+        modified_times = dict(files)
+        with METRICS.time("recency_lookup"), self.lock:
+            rows = self.connection.execute(
+                "SELECT file_path, processed_time, modified_time FROM recency"
+                f" WHERE file_path IN ({', '.join('?' * len(modified_times))})",
+                list(modified_times),
+            ).fetchall()
+        return {
+            file_path: processed_time
+            for file_path, processed_time, modified_time in rows
+            if modified_times[file_path] == modified_time
+        }
 
     def clean_records(self, age_in_days_to_clean=RECENCY_MINIMUM_AGE_DAYS):
-        file_paths_to_remove = []
-
-        for file_path, information_tuple in self.recency_dict.items():
-            days_since_record = (datetime.now() - information_tuple[0]).days
-            if days_since_record >= age_in_days_to_clean:
-                file_paths_to_remove.append(file_path)
-
-        for file_path in file_paths_to_remove:
-            self.recency_dict.pop(file_path)
-        self._save_pickle()
+        cutoff_time = time.time() - age_in_days_to_clean * SECONDS_IN_A_DAY
+        with self.lock:
+            self.connection.execute("DELETE FROM recency WHERE processed_time <= ?", (cutoff_time,))
 
     def _remove_recency_record(self, true_file_path: str):
-        removed_record = self.recency_dict.pop(true_file_path, None)
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM recency WHERE file_path = ?", (true_file_path,))
 
-        if removed_record is None:
+        if cursor.rowcount == 0:
             print(f"File path {true_file_path} was not in the recency dictionary")
-        else:
-            self._save_pickle()
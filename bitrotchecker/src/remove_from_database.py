@@ -0,0 +1,130 @@
+import argparse
+from itertools import islice
+from typing import Callable, Iterator, Optional, Iterable, List
+
+from bitrotchecker.src.configuration_util import get_immutable_paths, get_mutable_paths
+from bitrotchecker.src.constants import MONGO_DELETE_BATCH_SIZE
+from bitrotchecker.src.file_record import FILE_ID_SIZE_BYTES, get_file_id
+from bitrotchecker.src.file_util import is_inside, walk_files
+from bitrotchecker.src.mongo_util import MongoUtil
+
+DEFAULT_IDS_FILE_PATH = "ids_to_remove_from_database.txt"
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Removes every record of some files from the database.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--ids-file",
+        default=DEFAULT_IDS_FILE_PATH,
+        help="A file with one file ID per line, such as the IDs printed by get_file_info",
+    )
+    source.add_argument("--folder", help="Remove the records of every file under this folder")
+    parser.add_argument(
+        "--root",
+        help="The configured path that the folder is under, which is not part of the file paths in the database."
+        " Defaults to the configured path that contains the folder.",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only count the records that would be removed")
+    parser.add_argument("--yes", action="store_true", help="Do not ask for confirmation")
+    return parser.parse_args()
+
+
+def read_file_ids(ids_file_path: str) -> Iterator[str]:
+    """
+    Yields the file ID on each line of the file, one line at a time.
+    """
+    with open(ids_file_path, encoding="utf-8") as ids_file:
+        for line in ids_file:
+            file_id = line.strip()
+            if not file_id:
+                continue
+            if not is_file_id(file_id):
+                print(f"Skipping {file_id!r} as it is not a file ID")
+                continue
+            yield file_id
+
+
+def is_file_id(value: str) -> bool:
+    """
+    Returns whether the value is a hex file ID of FILE_ID_SIZE_BYTES bytes, as printed by get_file_info.
+    """
+    try:
+        return len(bytes.fromhex(value)) == FILE_ID_SIZE_BYTES
+    except ValueError:
+        return False
+
+
+def walk_file_ids(folder: str, root: str, on_error: Optional[Callable[[OSError], None]] = None) -> Iterator[str]:
+    """
+    Yields the file ID of every file under the folder, as it would be recorded when processing the root path.
+    """
+    for file_entry in walk_files(folder, on_error):
+        yield get_file_id(file_entry.path.replace(root, ""))
+
+
+def _find_root(folder: str) -> Optional[str]:
+    for path in get_immutable_paths() + get_mutable_paths():
+        if is_inside(folder, path):
+            return path
+    return None
+
+
+def _batched(file_ids: Iterable[str], batch_size: int) -> Iterator[List[str]]:
+    iterator = iter(file_ids)
+    # A file ID that is listed twice in a batch would be counted twice in a dry run
+    while batch := list(dict.fromkeys(islice(iterator, batch_size))):
+        yield batch
+
+
+def remove_file_ids(
+    mongo_util: MongoUtil, file_ids: Iterable[str], dry_run: bool, batch_size: int = MONGO_DELETE_BATCH_SIZE
+) -> int:
+    """
+    Removes the records of the file IDs with one query for each batch, without holding every file ID in memory.
+    In a dry run, the records that would be removed are only counted.
+    Returns the number of documents removed, or that would be removed.
+    """
+    total_file_ids = 0
+    total_documents = 0
+    for batch in _batched(file_ids, batch_size):
+        total_file_ids += len(batch)
+        if dry_run:
+            num_documents, num_matched_file_ids = mongo_util.count_records_with_file_ids(batch)
+            total_documents += num_documents
+            print(f"{num_documents} documents for {num_matched_file_ids} of {len(batch)} file IDs would be removed")
+        else:
+            num_documents = mongo_util.remove_records_with_file_ids(batch)
+            total_documents += num_documents
+            print(f"Removed {num_documents} documents for {len(batch)} file IDs")
+
+    action = "would be removed" if dry_run else "removed"
+    print(f"\nIn total, {total_documents} documents {action} for {total_file_ids} file IDs")
+    return total_documents
+
+
+def main():
+    args = _parse_args()
+
+    if args.folder is None:
+        description = f"the file IDs in {args.ids_file}"
+        file_ids = read_file_ids(args.ids_file)
+    else:
+        root = args.root or _find_root(args.folder)
+        if root is None:
+            print(f"{args.folder} is not under a configured path. Use --root to give the path it is under.")
+            exit(1)
+        description = f"every file under {args.folder}"
+        file_ids = walk_file_ids(args.folder, root)
+
+    if not args.dry_run and not args.yes:
+        answer = input(f"This will delete every record of {description} from the database. Proceed? ")
+        if answer.lower() not in ["y", "yes"]:
+            exit(1)
+
+    mongo_util = MongoUtil()
+    remove_file_ids(mongo_util, file_ids, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
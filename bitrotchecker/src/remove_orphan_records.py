@@ -0,0 +1,200 @@
+import argparse
+import heapq
+import os
+import tempfile
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from pymongo.collection import Collection
+
+from bitrotchecker.src.configuration_util import get_immutable_paths, get_mutable_paths
+from bitrotchecker.src.constants import (
+    FILE_ID_KEY,
+    MONGO_ID_KEY,
+    MONGO_DELETE_BATCH_SIZE,
+    MONGO_LOOKUP_BATCH_SIZE,
+    ORPHAN_SORT_RUN_SIZE,
+)
+from bitrotchecker.src.file_record import FILE_ID_SIZE_BYTES
+from bitrotchecker.src.mongo_util import MongoUtil
+from bitrotchecker.src.remove_from_database import walk_file_ids, remove_file_ids
+
+# The size of the read buffer of each sorted run while they are merged
+_RUN_READ_BUFFER_SIZE = 1024 * 1024
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Removes the records of files that no longer exist under any configured path."
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only count the records that would be removed")
+    parser.add_argument("--yes", action="store_true", help="Do not ask for confirmation")
+    return parser.parse_args()
+
+
+@dataclass
+class OrphanReport:
+    live_file_ids: int = 0
+    database_file_ids: int = 0
+    orphan_file_ids: int = 0
+    documents: int = 0
+
+    def get_lines(self, dry_run: bool) -> List[str]:
+        return [
+            f"Files under the configured paths: {self.live_file_ids}",
+            f"File IDs in the database: {self.database_file_ids}",
+            f"Orphan file IDs: {self.orphan_file_ids}",
+            f"Documents {'that would be removed' if dry_run else 'removed'}: {self.documents}",
+        ]
+
+
+def _unique(sorted_file_ids: Iterable[bytes]) -> Iterator[bytes]:
+    previous_file_id = None
+    for file_id in sorted_file_ids:
+        if file_id != previous_file_id:
+            yield file_id
+            previous_file_id = file_id
+
+
+def _write_sorted_run(file_ids: List[bytes], directory: str) -> str:
+    file_ids.sort()
+    with tempfile.NamedTemporaryFile(mode="wb", dir=directory, suffix=".run", delete=False) as run_file:
+        for file_id in _unique(file_ids):
+            run_file.write(file_id)
+    return run_file.name
+
+
+def _read_sorted_run(run_file_path: str) -> Iterator[bytes]:
+    with open(run_file_path, mode="rb", buffering=_RUN_READ_BUFFER_SIZE) as run_file:
+        while file_id := run_file.read(FILE_ID_SIZE_BYTES):
+            yield file_id
+
+
+def sort_file_ids(file_ids: Iterable[str], directory: str, run_size: int = ORPHAN_SORT_RUN_SIZE) -> Iterator[bytes]:
+    """
+    Yields the given hex file IDs as bytes in sorted order, without duplicates.
+
+    Only run_size file IDs are held in memory at a time. Each run is sorted and written to a temporary file in the
+    directory, and the runs are merged as they are read back.
+    """
+    run_file_paths = []
+    num_file_ids = 0
+    iterator = iter(file_ids)
+    while run := [bytes.fromhex(file_id) for file_id in islice(iterator, run_size)]:
+        num_file_ids += len(run)
+        run_file_paths.append(_write_sorted_run(run, directory))
+        print(f"Sorted {num_file_ids} file IDs")
+
+    yield from _unique(heapq.merge(*[_read_sorted_run(run_file_path) for run_file_path in run_file_paths]))
+
+
+def iterate_database_file_ids(
+    files_collection: Collection, batch_size: int = MONGO_LOOKUP_BATCH_SIZE
+) -> Iterator[bytes]:
+    """
+    Yields every file ID in the database in sorted order, without duplicates.
+    The unique index on the file ID and modified time returns them sorted without sorting in memory.
+    """
+    cursor = files_collection.find({}, {FILE_ID_KEY: 1, MONGO_ID_KEY: 0}, batch_size=batch_size).sort(FILE_ID_KEY, 1)
+    return _unique(bytes(document[FILE_ID_KEY]) for document in cursor)
+
+
+def find_orphans(
+    live_file_ids: Iterable[bytes], database_file_ids: Iterable[bytes], report: OrphanReport
+) -> Iterator[bytes]:
+    """
+    Yields the database file IDs that are not live file IDs, by merging both sorted streams.
+    """
+    live_iterator = iter(live_file_ids)
+    live_file_id = next(live_iterator, None)
+    if live_file_id is not None:
+        report.live_file_ids += 1
+
+    for database_file_id in database_file_ids:
+        report.database_file_ids += 1
+        while live_file_id is not None and live_file_id < database_file_id:
+            live_file_id = next(live_iterator, None)
+            if live_file_id is not None:
+                report.live_file_ids += 1
+        if live_file_id != database_file_id:
+            report.orphan_file_ids += 1
+            yield database_file_id
+
+    # Count the rest of the live files for the report
+    report.live_file_ids += sum(1 for _ in live_iterator)
+
+
+def _raise_walk_error(error: OSError):
+    raise error
+
+
+def walk_live_file_ids(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Yields the file ID of every file under the paths, as it is recorded when the path is processed.
+
+    Raises the OSError of any directory or entry that cannot be read, since every record under it would otherwise
+    look like an orphan.
+    """
+    for path in paths:
+        yield from walk_file_ids(path, path, on_error=_raise_walk_error)
+
+
+def remove_orphan_records(
+    mongo_util: MongoUtil,
+    paths: List[str],
+    dry_run: bool,
+    run_size: int = ORPHAN_SORT_RUN_SIZE,
+    batch_size: int = MONGO_DELETE_BATCH_SIZE,
+    temporary_directory: Optional[str] = None,
+) -> OrphanReport:
+    """
+    Removes, or in a dry run counts, the records of files that are not under any of the paths.
+
+    The file IDs of the live tree are sorted on disk, then merged with the file IDs of the database read in sorted
+    order, so neither side is ever held in memory. Orphans are removed batch_size file IDs at a time while merging.
+
+    Raises an OSError if any part of the paths cannot be read. The whole live tree is walked and sorted before the
+    first orphan is found, so nothing has been removed when it is raised.
+    """
+    report = OrphanReport()
+    with tempfile.TemporaryDirectory(dir=temporary_directory, prefix="orphans-") as run_directory:
+        live_file_ids = sort_file_ids(walk_live_file_ids(paths), run_directory, run_size)
+        database_file_ids = iterate_database_file_ids(mongo_util.files_collection)
+        orphans = (orphan.hex() for orphan in find_orphans(live_file_ids, database_file_ids, report))
+        report.documents = remove_file_ids(mongo_util, orphans, dry_run, batch_size)
+    return report
+
+
+def main():
+    args = _parse_args()
+
+    paths = get_immutable_paths() + get_mutable_paths()
+    missing_paths = [path for path in paths if not os.path.isdir(path)]
+    if missing_paths:
+        # Every record of a path that is not mounted would look like an orphan
+        print(f"These configured paths do not exist, so no records will be removed: {', '.join(missing_paths)}")
+        exit(1)
+
+    if not args.dry_run and not args.yes:
+        answer = input(
+            "This will delete the records of every file that is not under a configured path. Do not run it while"
+            " files are being checked. Proceed? "
+        )
+        if answer.lower() not in ["y", "yes"]:
+            exit(1)
+
+    mongo_util = MongoUtil()
+    try:
+        report = remove_orphan_records(mongo_util, paths, args.dry_run)
+    except OSError as e:
+        print(f"Could not read every file under the configured paths, so no records were removed: {e}")
+        exit(1)
+
+    print("\n===================================")
+    for line in report.get_lines(args.dry_run):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple, Any
+
+# The upper bound of each histogram bucket, in seconds
+DURATION_BUCKETS_SECONDS = [
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+    1800,
+]
+
+METRIC_NAME_PREFIX = "bitrot_"
+
+# A metric name and its sorted labels
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _get_key(name: str, labels: Dict[str, Any]) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        # The last count is for values larger than every bucket
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def get_cumulative_counts(self) -> List[Tuple[str, int]]:
+        cumulative_counts = []
+        total = 0
+        for bucket, bucket_count in zip([*self.buckets, "+Inf"], self.bucket_counts):
+            total += bucket_count
+            cumulative_counts.append((str(bucket), total))
+        return cumulative_counts
+
+
+class RunMetrics:
+    """
+    Collects how long each phase of a run takes and counts what happened, from every thread.
+
+    At the end of a run the metrics can be written as a Prometheus textfile (for the node exporter's textfile collector)
+    and as a JSON summary.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations: Dict[MetricKey, Histogram] = {}
+        self.counters: Dict[MetricKey, float] = {}
+        self.gauges: Dict[MetricKey, float] = {}
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    @contextmanager
+    def time(self, phase: str, **labels) -> Iterator[None]:
+        """
+        Records how long the body takes as one observation of the phase.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start_time, **labels)
+
+    def observe(self, phase: str, seconds: float, **labels):
+        key = _get_key("phase_duration_seconds", {"phase": phase, **labels})
+        with self.lock:
+            if key not in self.durations:
+                self.durations[key] = Histogram(DURATION_BUCKETS_SECONDS)
+            self.durations[key].observe(seconds)
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = _get_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[_get_key(name, labels)] = value
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self.lock:
+            return self.counters.get(_get_key(name, labels), 0)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            duration_names = {name for name, _ in self.durations}
+            for name in sorted(duration_names):
+                lines.append(f"# TYPE {METRIC_NAME_PREFIX}{name} histogram")
+                for (key_name, labels), histogram in sorted(self.durations.items()):
+                    if key_name != name:
+                        continue
+                    for bucket, cumulative_count in histogram.get_cumulative_counts():
+                        bucket_labels = _format_labels((*labels, ("le", bucket)))
+                        lines.append(f"{METRIC_NAME_PREFIX}{name}_bucket{bucket_labels} {cumulative_count}")
+                    lines.append(f"{METRIC_NAME_PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{METRIC_NAME_PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+
+            lines.extend(_format_simple_metrics(self.counters, "counter", "_total"))
+            lines.extend(_format_simple_metrics(self.gauges, "gauge", ""))
+
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "phases": [
+                    {
+                        **dict(labels),
+                        "count": histogram.count,
+                        "total_seconds": histogram.sum,
+                        "mean_seconds": histogram.sum / max(1, histogram.count),
+                        "max_seconds": histogram.max,
+                        "buckets": dict(histogram.get_cumulative_counts()),
+                    }
+                    for (_, labels), histogram in sorted(self.durations.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.gauges.items())
+                ],
+            }
+
+    def write_prometheus_textfile(self, file_path: str):
+        # The textfile collector may read the file at any time, so never let it see a partly written file
+        _write_atomically(file_path, self.to_prometheus())
+
+    def write_json(self, file_path: str):
+        _write_atomically(file_path, json.dumps(self.to_dict(), indent=2))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    formatted_labels = ",".join(f'{label}="{_escape_label_value(value)}"' for label, value in labels)
+    return "{" + formatted_labels + "}"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_simple_metrics(metrics: Dict[MetricKey, float], metric_type: str, suffix: str) -> List[str]:
+    lines = []
+    for name in sorted({name for name, _ in metrics}):
+        lines.append(f"# TYPE {METRIC_NAME_PREFIX}{name}{suffix} {metric_type}")
+        for (key_name, labels), value in sorted(metrics.items()):
+            if key_name == name:
+                lines.append(f"{METRIC_NAME_PREFIX}{name}{suffix}{_format_labels(labels)} {value}")
+    return lines
+
+
+def _write_atomically(file_path: str, contents: str):
+    temporary_file_path = f"{file_path}.tmp"
+    with open(temporary_file_path, mode="w", encoding="utf-8") as file:
+        file.write(contents)
+    os.replace(temporary_file_path, file_path)
+
+
+# Shared by every part of the program so that a whole run is measured in one place
+METRICS = RunMetrics()
@@ -0,0 +1,71 @@
+import cProfile
+import pstats
+import sys
+import threading
+from typing import List, Optional
+
+# How many of the most expensive functions to print when profiling finishes
+PRINTED_FUNCTIONS = 30
+
+# From Python 3.12, cProfile uses sys.monitoring, which profiles every thread but only allows one profiler at a time
+_PROFILES_EVERY_THREAD = sys.version_info >= (3, 12)
+
+
+class RunProfiler:
+    """
+    Profiles every thread of a run with cProfile and writes the combined profile to a file,
+    which can be opened with pstats or a viewer such as snakeviz.
+
+    Before Python 3.12, cProfile only profiles the thread that enabled it, and files are processed on worker threads,
+    so each thread started while profiling gets its own profiler. From 3.12, a single profiler covers every thread.
+    """
+
+    def __init__(self, profile_file_path: str):
+        self.profile_file_path = profile_file_path
+        self.lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+
+    def __enter__(self) -> "RunProfiler":
+        if not _PROFILES_EVERY_THREAD:
+            threading.setprofile(self._profile_new_thread)
+        self._start_profile()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not _PROFILES_EVERY_THREAD:
+            threading.setprofile(None)
+        with self.lock:
+            profiles = self._profiles
+            self._profiles = []
+
+        stats: Optional[pstats.Stats] = None
+        for profile in profiles:
+            profile.disable()
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+        if stats is None:
+            print("\nNothing was profiled")
+            return
+
+        stats.dump_stats(self.profile_file_path)
+        threads = "every thread" if _PROFILES_EVERY_THREAD else f"{len(profiles)} threads"
+        print(f"\nWrote the profile of {threads} to {self.profile_file_path}")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PRINTED_FUNCTIONS)
+
+    def _start_profile(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Such as when running under a debugger, which is also a profiling tool
+            print(f"WARNING: Could not profile {threading.current_thread().name}: {e}")
+            return
+        with self.lock:
+            self._profiles.append(profile)
+
+    def _profile_new_thread(self, frame, event, arg):
+        # Called by the first event in each new thread. Enabling the profiler replaces this function.
+        self._start_profile()
@@ -0,0 +1,363 @@
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Mapping
+
+import mongomock
+from pymongo import UpdateOne
+
+from bitrotchecker.src.constants import FILE_ID_KEY, MONGO_ID_KEY
+from bitrotchecker.src.file_processor import FileProcessor
+from bitrotchecker.src.file_util import walk_files
+from bitrotchecker.src.mongo_util import MongoUtil
+from bitrotchecker.src.recency_util import RecencyUtil
+
+# Where results are saved so that runs on different commits can be compared
+DEFAULT_RESULTS_FILE_PATH = "scan_benchmark_results.jsonl"
+
+# The name of the file in a generated tree that describes how it was generated
+TREE_SPEC_FILE_NAME = "tree.json"
+
+# The directory in a generated tree that holds the files, so that the spec file is not scanned
+TREE_FILES_DIRECTORY_NAME = "files"
+
+BYTES_IN_A_MIB = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class TreeSpec:
+    """
+    Describes a synthetic tree. The same spec always generates the same files.
+    Small files are uniformly sized up to max_small_file_bytes, and the rest are log-uniformly sized
+    up to max_large_file_bytes so that there are many more medium files than huge ones.
+    """
+
+    num_files: int
+    small_file_fraction: float
+    max_small_file_bytes: int
+    max_large_file_bytes: int
+    files_per_directory: int
+    seed: int
+
+
+class _IndexedCollection:
+    """
+    An in-process stand-in for the files collection that supports the queries MongoUtil makes.
+
+    mongomock scans every document for every query, which would make the benchmark measure mongomock instead of
+    this program. Documents are instead kept in a separate mongomock collection for each file ID,
+    the same way a real database narrows queries down with its file_id index.
+    """
+
+    def __init__(self):
+        self._database = mongomock.MongoClient().bitrot
+        self._collections: Dict[str, Any] = {}
+        self._file_ids_by_mongo_id: Dict[Any, str] = {}
+        self.lock = threading.Lock()
+
+    def _get_collection(self, record_filter: Mapping[str, Any]) -> Any:
+        if FILE_ID_KEY in record_filter:
+            file_id = record_filter[FILE_ID_KEY]
+        else:
+            file_id = self._file_ids_by_mongo_id[record_filter[MONGO_ID_KEY]]
+
+        if file_id not in self._collections:
+            self._collections[file_id] = self._database[f"files{len(self._collections)}"]
+        return self._collections[file_id]
+
+    def find(self, record_filter: Mapping[str, Any]) -> List[Mapping[str, Any]]:
+        file_ids = record_filter[FILE_ID_KEY]["$in"]
+        with self.lock:
+            collections = [self._collections[file_id] for file_id in file_ids if file_id in self._collections]
+            return [document for collection in collections for document in collection.find()]
+
+    def find_one(self, record_filter: Mapping[str, Any]) -> Optional[Mapping[str, Any]]:
+        with self.lock:
+            return self._get_collection(record_filter).find_one(record_filter)
+
+    def update_one(self, filter: Mapping[str, Any], update: Mapping[str, Any], upsert: bool = False) -> Any:
+        with self.lock:
+            update_result = self._get_collection(filter).update_one(filter, update, upsert=upsert)
+            if update_result.upserted_id is not None:
+                self._file_ids_by_mongo_id[update_result.upserted_id] = filter[FILE_ID_KEY]
+            return update_result
+
+    def bulk_write(self, requests: List[UpdateOne], ordered: bool = True):
+        for request in requests:
+            self.update_one(request._filter, request._doc, upsert=request._upsert)
+
+
+class _CountingCollection:
+    """
+    Wraps a collection and counts every method call, each of which is a round trip to a real database.
+    """
+
+    def __init__(self, collection: Any):
+        self._collection = collection
+        self.lock = threading.Lock()
+        self.operations: Counter = Counter()
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def _counted(*args, **kwargs):
+            with self.lock:
+                self.operations[name] += 1
+            return attribute(*args, **kwargs)
+
+        return _counted
+
+
+class _BenchmarkLogger:
+    """
+    Stands in for LoggerUtil so that benchmarks do not overwrite the real logs.
+    """
+
+    def __init__(self):
+        self.messages: List[str] = []
+
+    def write(self, message: str, event: str = "message", **fields):
+        self.messages.append(message)
+
+    def write_event(self, event: str, **fields):
+        pass
+
+
+def generate_tree(root_path: str, tree_spec: TreeSpec):
+    """
+    Writes the files described by the spec under the root path, unless the root already holds that tree.
+    """
+    spec_file_path = os.path.join(root_path, TREE_SPEC_FILE_NAME)
+    if os.path.exists(spec_file_path):
+        with open(spec_file_path) as spec_file:
+            if json.load(spec_file) == asdict(tree_spec):
+                print(f"Reusing the tree in {root_path}")
+                return
+        raise ValueError(f"{root_path} holds a tree with a different spec. Delete it or use another path.")
+
+    print(f"Generating {tree_spec.num_files} files in {root_path}...")
+    rng = random.Random(tree_spec.seed)
+    min_large_file_log = math.log(tree_spec.max_small_file_bytes + 1)
+    max_large_file_log = math.log(max(tree_spec.max_large_file_bytes, tree_spec.max_small_file_bytes + 1))
+    for i in range(tree_spec.num_files):
+        # Spread directories over two levels so that no directory gets too large
+        directory_index = i // tree_spec.files_per_directory
+        directory_path = os.path.join(
+            root_path, TREE_FILES_DIRECTORY_NAME, f"{directory_index // 100:05d}", f"{directory_index % 100:02d}"
+        )
+        os.makedirs(directory_path, exist_ok=True)
+
+        if rng.random() < tree_spec.small_file_fraction:
+            size = rng.randint(0, tree_spec.max_small_file_bytes)
+        else:
+            size = int(math.exp(rng.uniform(min_large_file_log, max_large_file_log)))
+
+        with open(os.path.join(directory_path, f"file{i}.bin"), mode="wb") as file:
+            file.write(rng.randbytes(size))
+
+    # Written last so that an interrupted generation is not reused
+    with open(spec_file_path, mode="w") as spec_file:
+        json.dump(asdict(tree_spec), spec_file)
+
+
+def _read_proc_io() -> Dict[str, int]:
+    """
+    Returns the I/O counters of this process, which are only available on Linux.
+    """
+    try:
+        with open("/proc/self/io") as io_file:
+            return {key: int(value) for key, value in (line.split(": ") for line in io_file.read().splitlines())}
+    except OSError:
+        return {}
+
+
+def _reset_peak_rss():
+    # Lets each phase measure its own peak memory use on Linux. Elsewhere the peak is for the whole benchmark.
+    try:
+        with open("/proc/self/clear_refs", mode="w") as clear_refs_file:
+            clear_refs_file.write("5")
+    except OSError:
+        pass
+
+
+def _get_peak_rss_mib() -> float:
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in bytes on macOS and kibibytes elsewhere
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / BYTES_IN_A_MIB if sys.platform == "darwin" else max_rss / 1024
+
+
+def run_phase(
+    name: str, root_path: str, recency_util: RecencyUtil, mongo_util: MongoUtil, collection: _CountingCollection
+) -> Dict[str, Any]:
+    """
+    Processes every file in the tree with the real FileProcessor and measures how it went.
+    """
+    file_processor = FileProcessor(recency_util, mongo_util, _BenchmarkLogger())
+    collection.operations.clear()
+    _reset_peak_rss()
+    io_before = _read_proc_io()
+
+    start_time = time.perf_counter()
+    # Printing every file is part of a real run, but should not fill the terminal
+    with open(os.devnull, mode="w") as devnull, contextlib.redirect_stdout(devnull):
+        summary = file_processor.process_files(root_path, walk_files(root_path), file_is_immutable=False)
+    elapsed_seconds = time.perf_counter() - start_time
+
+    io_after = _read_proc_io()
+    num_files = summary.successes + summary.failures + summary.skips
+    per_file = 1 / max(1, num_files)
+
+    result: Dict[str, Any] = {
+        "phase": name,
+        "files": num_files,
+        "successes": summary.successes,
+        "failures": summary.failures,
+        "skips": summary.skips,
+        "seconds": elapsed_seconds,
+        "files_per_second": num_files / elapsed_seconds,
+        "db_operations_per_file": sum(collection.operations.values()) * per_file,
+        "db_operations": dict(collection.operations),
+        "peak_rss_mib": _get_peak_rss_mib(),
+    }
+    if io_before and io_after:
+        result["read_mib_per_second"] = (io_after["rchar"] - io_before["rchar"]) / BYTES_IN_A_MIB / elapsed_seconds
+        syscalls = io_after["syscr"] - io_before["syscr"] + io_after["syscw"] - io_before["syscw"]
+        result["read_write_syscalls_per_file"] = syscalls * per_file
+
+    return result
+
+
+def run_benchmark(root_path: str, tree_spec: TreeSpec) -> List[Dict[str, Any]]:
+    """
+    Runs a first scan of a new tree, a re-verification of every file, and a run where every file is skipped
+    because it was verified recently.
+    """
+    generate_tree(root_path, tree_spec)
+    files_path = os.path.join(root_path, TREE_FILES_DIRECTORY_NAME)
+
+    with tempfile.TemporaryDirectory() as state_dir_path:
+        collection = _CountingCollection(_IndexedCollection())
+        with open(os.devnull, mode="w") as devnull, contextlib.redirect_stdout(devnull):
+            mongo_util = MongoUtil(database=mongomock.MongoClient().bitrot)
+        mongo_util.files_collection = collection
+
+        results = []
+        first_recency_util = RecencyUtil(os.path.join(state_dir_path, "first.sqlite3"))
+        results.append(run_phase("first scan", files_path, first_recency_util, mongo_util, collection))
+        first_recency_util.close()
+
+        # With no recency records, every file is read and verified against the records from the first scan
+        recency_util = RecencyUtil(os.path.join(state_dir_path, "second.sqlite3"))
+        results.append(run_phase("re-verify", files_path, recency_util, mongo_util, collection))
+        results.append(run_phase("recency skip", files_path, recency_util, mongo_util, collection))
+        recency_util.close()
+
+    return results
+
+
+def _get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _load_previous_run(results_file_path: str, tree_spec: TreeSpec) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(results_file_path):
+        return None
+
+    previous_run = None
+    with open(results_file_path) as results_file:
+        for line in results_file:
+            run = json.loads(line)
+            if run["tree"] == asdict(tree_spec):
+                previous_run = run
+    return previous_run
+
+
+def print_results(results: List[Dict[str, Any]], previous_run: Optional[Dict[str, Any]]):
+    previous_results = {} if previous_run is None else {result["phase"]: result for result in previous_run["phases"]}
+    for result in results:
+        print(
+            f"\n{result['phase']}: {result['successes']} passed, {result['failures']} failed, {result['skips']} skipped"
+        )
+        print(f"  {result['files_per_second']:.0f} files/s in {result['seconds']:.2f}s")
+        if "read_mib_per_second" in result:
+            print(f"  {result['read_mib_per_second']:.1f} MiB/s read")
+            print(f"  {result['read_write_syscalls_per_file']:.1f} read and write syscalls per file")
+        print(f"  {result['db_operations_per_file']:.3f} database operations per file {result['db_operations']}")
+        print(f"  {result['peak_rss_mib']:.1f} MiB peak RSS")
+
+        previous_result = previous_results.get(result["phase"])
+        if previous_result is not None:
+            change = (result["files_per_second"] / previous_result["files_per_second"] - 1) * 100
+            print(f"  {change:+.1f}% files/s compared to {previous_run['commit']} at {previous_run['time']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure end to end scan throughput on a synthetic tree of files.")
+    parser.add_argument("--tree", help="Where to generate the tree. It is reused by later runs with the same spec.")
+    parser.add_argument("--files", type=int, default=10000, help="The number of files to generate")
+    parser.add_argument("--small-file-fraction", type=float, default=0.9, help="The fraction of small files")
+    parser.add_argument("--max-small-file-kib", type=int, default=16, help="The size of the largest small file")
+    parser.add_argument("--max-large-file-mib", type=int, default=64, help="The size of the largest file")
+    parser.add_argument("--files-per-directory", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results", default=DEFAULT_RESULTS_FILE_PATH, help="The file to save results to")
+    arguments = parser.parse_args()
+
+    tree_spec = TreeSpec(
+        num_files=arguments.files,
+        small_file_fraction=arguments.small_file_fraction,
+        max_small_file_bytes=arguments.max_small_file_kib * 1024,
+        max_large_file_bytes=arguments.max_large_file_mib * BYTES_IN_A_MIB,
+        files_per_directory=arguments.files_per_directory,
+        seed=arguments.seed,
+    )
+
+    if arguments.tree is None:
+        with tempfile.TemporaryDirectory() as tree_path:
+            results = run_benchmark(tree_path, tree_spec)
+    else:
+        results = run_benchmark(arguments.tree, tree_spec)
+
+    print_results(results, _load_previous_run(arguments.results, tree_spec))
+
+    run = {
+        "time": datetime.now().isoformat(),
+        "commit": _get_git_commit(),
+        "tree": asdict(tree_spec),
+        "phases": results,
+    }
+    with open(arguments.results, mode="a") as results_file:
+        results_file.write(json.dumps(run))
+        results_file.write("\n")
+    print(f"\nSaved results to {arguments.results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,103 +1,204 @@
+import argparse
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Optional
-
-from bitrotchecker.src.constants import MODIFIED_TIME_KEY, CHECKSUM_KEY, SIZE_KEY
+from itertools import islice
+from typing import Any, List, Mapping, Optional
+
+from bitrotchecker.src.checksum_algorithms import LEGACY_CHECKSUM_ALGORITHM
+from bitrotchecker.src.constants import (
+    MODIFIED_TIME_NS_KEY,
+    CHECKSUM_KEY,
+    SIZE_KEY,
+    CHECKSUM_ALGORITHM_KEY,
+    TIMESTAMP_FIX_HASH_WORKERS,
+)
 from bitrotchecker.src.file_record import FileRecord
-from bitrotchecker.src.file_util import get_checksum_of_file
-from bitrotchecker.src.mongo_util import MongoUtil
-
-
-def fix_file(real_file_path: str, database_file_path: str, mongo_util: MongoUtil, verify_checksum: bool):
-    file_to_fix = FileRecord(file_path=database_file_path, full_file_path=real_file_path)
-
-    # Calculating checksum is expensive, so only do it if necessary
-    file_checksum = get_checksum_of_file(real_file_path) if verify_checksum else None
-
-    print()
-    print(f"Processing {real_file_path} - {file_to_fix.file_id}")
-    print(f"Current Modified Time: {file_to_fix.modified_time}")
-
-    file_records = mongo_util.get_all_records_for_file_id(file_to_fix.file_id)
-    best_match_file_record: Optional[Dict] = None
-    num_id_matches = 0
-    for file_record in file_records:
-        num_id_matches += 1
-        database_size = file_record[SIZE_KEY]
-        database_checksum = file_record[CHECKSUM_KEY]
-
-        if database_size == file_to_fix.size:
-            if file_checksum is None or database_checksum == file_checksum:
-                print(f"Found a match in database: {file_record}")
-                if best_match_file_record is None:
-                    best_match_file_record = file_record
-                else:
-                    print(
-                        "FAIL: Multiple database matches with the same size and checksum found. "
-                        "You will need to manually pick which one to use."
-                    )
-                    return
-            else:
-                print(f"Mismatch checksum: local={file_checksum} vs database={database_checksum}")
-        else:
-            print(f"Mismatch size: local={file_to_fix.size} vs database={database_size}")
-
-    print(f"Found {num_id_matches} ID matches in database.")
-
-    if best_match_file_record is None:
-        print("FAIL: Could not find database entry to fix timestamp.")
-    else:
-        database_mtime = best_match_file_record[MODIFIED_TIME_KEY]
-
-        if database_mtime == file_to_fix.modified_time:
-            print("SKIP: File mtime already matches database")
-            return
-
-        mtime_nanos = _get_nanos_from_mtime(database_mtime)
-        print(f"Setting modified time to: {mtime_nanos} nanos")
-        os.utime(real_file_path, ns=(mtime_nanos, mtime_nanos))
-        print("PASS: Timestamp updated to match with database.")
+from bitrotchecker.src.file_util import walk_files
+from bitrotchecker.src.mongo_util import MongoUtil, matches_modified_time
+
+DEFAULT_PATHS_FILE_PATH = "timestamp_fix_paths.txt"
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Sets the modified time of files back to the time in the database.")
+    parser.add_argument(
+        "--paths-file",
+        default=DEFAULT_PATHS_FILE_PATH,
+        help="A file with a 'prefix,folder' line for each folder to fix, where the prefix is not part of the file paths"
+        " in the database",
+    )
+    parser.add_argument(
+        "--verify-checksum",
+        action="store_true",
+        help="Also check the checksum of files whose size matches a single record",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only print the modified times that would be set")
+    return parser.parse_args()
+
+
+@dataclass
+class TimestampFixReport:
+    fixed: int = 0
+    already_matching: int = 0
+    no_match: int = 0
+    ambiguous: int = 0
+    errors: int = 0
+    files_hashed: int = 0
+
+    def get_lines(self, dry_run: bool) -> List[str]:
+        return [
+            f"{'Timestamps that would be fixed' if dry_run else 'Timestamps fixed'}: {self.fixed}",
+            f"Already matching the database: {self.already_matching}",
+            f"No matching record: {self.no_match}",
+            f"More than one matching record: {self.ambiguous}",
+            f"Errors: {self.errors}",
+            f"Files hashed: {self.files_hashed}",
+        ]
+
+
+def _find_size_matches(file_to_fix: FileRecord, documents: List[Mapping[str, Any]]) -> List[Mapping[str, Any]]:
+    return [document for document in documents if document[SIZE_KEY] == file_to_fix.size]
+
+
+def _find_checksum_matches(file_to_fix: FileRecord, documents: List[Mapping[str, Any]]) -> List[Mapping[str, Any]]:
+    """
+    Returns the documents whose checksum matches the file, reading the file once for every algorithm needed.
+    """
+    algorithms = [document.get(CHECKSUM_ALGORITHM_KEY, LEGACY_CHECKSUM_ALGORITHM) for document in documents]
+    checksums = file_to_fix.get_checksums(algorithms)
+    return [
+        document for document, algorithm in zip(documents, algorithms) if document[CHECKSUM_KEY] == checksums[algorithm]
+    ]
+
+
+def _apply_match(file_to_fix: FileRecord, matches: List[Mapping[str, Any]], dry_run: bool, report: TimestampFixReport):
+    real_file_path = file_to_fix.full_file_path
+    if not matches:
+        report.no_match += 1
+        print(f"FAIL: Could not find database entry to fix timestamp of {real_file_path}")
+        return
+    if len(matches) > 1:
+        report.ambiguous += 1
+        print(
+            f"FAIL: Multiple database matches with the same size and checksum found for {real_file_path}. "
+            "You will need to manually pick which one to use."
+        )
+        return
+
+    mtime_nanos = matches[0][MODIFIED_TIME_NS_KEY]
+    if matches_modified_time(file_to_fix, mtime_nanos):
+        report.already_matching += 1
+        return
+
+    report.fixed += 1
+    if dry_run:
+        print(
+            f"DRY RUN: Would set modified time of {real_file_path} from {file_to_fix.modified_time_ns} to {mtime_nanos}"
+        )
+        return
+    os.utime(real_file_path, ns=(mtime_nanos, mtime_nanos))
+    print(f"PASS: Set modified time of {real_file_path} from {file_to_fix.modified_time_ns} to {mtime_nanos}")
+
+
+def fix_files(
+    files_to_fix: List[FileRecord],
+    mongo_util: MongoUtil,
+    verify_checksum: bool,
+    dry_run: bool,
+    report: TimestampFixReport,
+    hash_executor: ThreadPoolExecutor,
+):
+    """
+    Sets the modified time of each file to the time of its record in the database, fetching the records of every
+    file with batched queries. A file is only hashed when its size matches more than one record, or when checksums
+    are verified, and those files are hashed in parallel.
+    """
+    documents_by_file_id = mongo_util.find_documents_by_file_ids(file.file_id for file in files_to_fix)
 
+    files_to_hash = []
+    for file_to_fix in files_to_fix:
+        size_matches = _find_size_matches(file_to_fix, documents_by_file_id[file_to_fix.file_id])
+        if len(size_matches) > 1 or (verify_checksum and size_matches):
+            files_to_hash.append((file_to_fix, size_matches))
+        else:
+            _apply_match(file_to_fix, size_matches, dry_run, report)
+
+    futures = [
+        (file_to_fix, hash_executor.submit(_find_checksum_matches, file_to_fix, size_matches))
+        for file_to_fix, size_matches in files_to_hash
+    ]
+    for file_to_fix, future in futures:
+        report.files_hashed += 1
+        try:
+            checksum_matches = future.result()
+        except Exception as e:
+            # Such as a file that cannot be read, or a record with an unknown checksum algorithm
+            report.errors += 1
+            print(f"FAIL: Could not check {file_to_fix.full_file_path}: {e}")
+            continue
+        _apply_match(file_to_fix, checksum_matches, dry_run, report)
+
+
+def fix_files_in_folder(
+    prefix: str,
+    folder: str,
+    mongo_util: MongoUtil,
+    verify_checksum: bool,
+    dry_run: bool = False,
+    report: Optional[TimestampFixReport] = None,
+    hash_workers: int = TIMESTAMP_FIX_HASH_WORKERS,
+) -> TimestampFixReport:
+    if report is None:
+        report = TimestampFixReport()
 
-def fix_files_in_folder(prefix: str, folder: str, mongo_util: MongoUtil, verify_checksum: bool):
     root_path = os.path.join(prefix, folder)
-    for root, dirs, files in os.walk(root_path, topdown=False):
-        for file_name in files:
-            real_file_path = os.path.join(root, file_name)
-            database_file_path = real_file_path.replace(prefix, "")
-
-            fix_file(real_file_path, database_file_path, mongo_util, verify_checksum)
-
-
-def _get_nanos_from_mtime(db_mtime: float) -> int:
-    """
-    Floats are annoying and can lead to precision errors when trying to set the modified time of the files.
-    Use integers with nanoseconds to try and avoid these.
-    """
-    truncated_nanos = int(db_mtime) * (10**9)
-    num_digits = len(str(truncated_nanos))
+    file_entries = walk_files(root_path)
+    with ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="timestamp-hash") as hash_executor:
+        while batch := list(islice(file_entries, mongo_util.lookup_batch_size)):
+            files_to_fix = []
+            for file_entry in batch:
+                try:
+                    stat_result = file_entry.stat()
+                except OSError as e:
+                    report.errors += 1
+                    print(f"FAIL: Could not read {file_entry.path}: {e}")
+                    continue
+                database_file_path = file_entry.path.replace(prefix, "")
+                files_to_fix.append(
+                    FileRecord.from_stat(
+                        file_path=database_file_path, full_file_path=file_entry.path, stat_result=stat_result
+                    )
+                )
+            fix_files(files_to_fix, mongo_util, verify_checksum, dry_run, report, hash_executor)
 
-    str_nanos = str(db_mtime).replace(".", "").ljust(num_digits, "0")
-    return int(str_nanos)
+    return report
 
 
 def main():
+    args = _parse_args()
+
     ts = time.time()
     utc_offset = (datetime.fromtimestamp(ts) - datetime.utcfromtimestamp(ts)).total_seconds()
     print(f"Timezone offset: {utc_offset}")
 
     mongo_util = MongoUtil()
-    verify_checksum = False
+    report = TimestampFixReport()
 
-    with open("timestamp_fix_paths.txt", encoding="utf-8") as input_file:
+    with open(args.paths_file, encoding="utf-8") as input_file:
         for line in input_file.readlines():
             splits = line.split(",")
             prefix = splits[0].strip()
             folder = splits[1].strip()
             print("===================================================")
             print(f"Fixing modified timestamp for folder: {folder}")
-            fix_files_in_folder(prefix, folder, mongo_util, verify_checksum)
+            fix_files_in_folder(prefix, folder, mongo_util, args.verify_checksum, args.dry_run, report)
+
+    print("\n===================================")
+    for line in report.get_lines(args.dry_run):
+        print(line)
 
 
 if __name__ == "__main__":
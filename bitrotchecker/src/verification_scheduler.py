@@ -0,0 +1,168 @@
+import heapq
+import itertools
+import math
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional, List, Iterable, Iterator, Tuple
+
+from bitrotchecker.src.constants import RECENCY_MINIMUM_AGE_DAYS, BUDGETED_RUN_INTERVAL_DAYS, BUDGETED_RUN_MAX_FILES
+from bitrotchecker.src.file_util import FileEntry
+from bitrotchecker.src.recency_util import RecencyUtil
+
+BYTES_IN_A_GIB = 1024 * 1024 * 1024
+
+# The number of files to look up in the recency database with a single query
+RECENCY_LOOKUP_BATCH_SIZE = 500
+
+
+@dataclass
+class ScheduledFile:
+    # Declared by hand since dataclass only adds slots from Python 3.10
+    __slots__ = ("path", "file_path", "file_is_immutable", "size", "modified_time", "last_processed_time")
+
+    path: str
+    file_path: str
+    file_is_immutable: bool
+    size: int
+    modified_time: float
+    last_processed_time: Optional[float]
+
+
+class VerificationScheduler:
+    """
+    Picks which files to verify in a run that has a limited byte budget.
+
+    Files are verified in order of how long ago they last passed verification, with files that never have going first.
+    Verifying about the same amount every run spreads the work evenly over the cycle,
+    instead of every file coming due on the same day.
+
+    Only the most overdue files that fit in the byte budget, and at most max_files files, are kept while the paths
+    are walked, so memory use does not grow with the number of files, even with only a time budget.
+    """
+
+    def __init__(
+        self, recency_util: RecencyUtil, max_bytes: Optional[int] = None, max_files: int = BUDGETED_RUN_MAX_FILES
+    ):
+        self.recency_util = recency_util
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+
+        # The candidates as a heap with the most recently verified file on top, so it is the first to be dropped
+        # once the older files fill the budget. Ties are broken by the order the files were found in.
+        self._candidates: List[Tuple[float, int, ScheduledFile]] = []
+        self._candidate_bytes = 0
+        self._order = itertools.count()
+        self.selected_files: List[ScheduledFile] = []
+        self.total_bytes = 0
+        self.never_verified_bytes = 0
+        self.start_time = time.time()
+
+    def add_files(self, path: str, file_entries: Iterable[os.DirEntry], file_is_immutable: bool):
+        file_entries = iter(file_entries)
+        while batch := list(itertools.islice(file_entries, RECENCY_LOOKUP_BATCH_SIZE)):
+            self._add_batch(path, batch, file_is_immutable)
+
+    def _add_batch(self, path: str, file_entries: List[os.DirEntry], file_is_immutable: bool):
+        scheduled_files = []
+        for file_entry in file_entries:
+            try:
+                stat_result = file_entry.stat()
+            except OSError as e:
+                print(f"Could not stat {file_entry.path}: {e}")
+                continue
+            scheduled_files.append(
+                ScheduledFile(path, file_entry.path, file_is_immutable, stat_result.st_size, stat_result.st_mtime, None)
+            )
+        if not scheduled_files:
+            return
+
+        last_processed_times = self.recency_util.get_last_processed_times(
+            [(scheduled_file.file_path, scheduled_file.modified_time) for scheduled_file in scheduled_files]
+        )
+        for scheduled_file in scheduled_files:
+            scheduled_file.last_processed_time = last_processed_times.get(scheduled_file.file_path)
+            self.total_bytes += scheduled_file.size
+            if scheduled_file.last_processed_time is None:
+                self.never_verified_bytes += scheduled_file.size
+            self._add_candidate(scheduled_file)
+
+    def _add_candidate(self, scheduled_file: ScheduledFile):
+        heapq.heappush(
+            self._candidates, (-(scheduled_file.last_processed_time or 0.0), -next(self._order), scheduled_file)
+        )
+        self._candidate_bytes += scheduled_file.size
+        # Once the candidates are over the budget, the most recently verified one can never be picked,
+        # since every older file (including any found later) would be picked before it
+        while len(self._candidates) > self.max_files or (
+            self.max_bytes is not None and len(self._candidates) > 1 and self._candidate_bytes > self.max_bytes
+        ):
+            self._candidate_bytes -= heapq.heappop(self._candidates)[2].size
+
+    def get_files_to_verify(self) -> Iterator[Tuple[str, FileEntry, bool]]:
+        """
+        Yields the files that have gone the longest without being verified until the byte budget is used up.
+        The first file is always yielded so that a file larger than the budget still gets verified eventually.
+        """
+        candidates = [scheduled_file for _, _, scheduled_file in sorted(self._candidates, reverse=True)]
+        self._candidates = []
+
+        selected_bytes = 0
+        for scheduled_file in candidates:
+            if (
+                self.max_bytes is not None
+                and self.selected_files
+                and selected_bytes + scheduled_file.size > self.max_bytes
+            ):
+                return
+
+            selected_bytes += scheduled_file.size
+            self.selected_files.append(scheduled_file)
+            yield scheduled_file.path, FileEntry(scheduled_file.file_path), scheduled_file.file_is_immutable
+
+    def get_report(self) -> List[str]:
+        """
+        Describes how much was verified this run and projects when every file will have been verified at least once,
+        assuming every run verifies as much as this one.
+        """
+        verified_bytes = 0
+        never_verified_bytes = self.never_verified_bytes
+        for batch_start in range(0, len(self.selected_files), RECENCY_LOOKUP_BATCH_SIZE):
+            batch_end = batch_start + RECENCY_LOOKUP_BATCH_SIZE
+            batch = self.selected_files[batch_start:batch_end]
+            last_processed_times = self.recency_util.get_last_processed_times(
+                [(scheduled_file.file_path, scheduled_file.modified_time) for scheduled_file in batch]
+            )
+            for scheduled_file in batch:
+                last_processed_time = last_processed_times.get(scheduled_file.file_path)
+                if last_processed_time is not None and last_processed_time >= self.start_time:
+                    verified_bytes += scheduled_file.size
+                    if scheduled_file.last_processed_time is None:
+                        never_verified_bytes -= scheduled_file.size
+
+        total_bytes = self.total_bytes
+        report = [
+            f"Verified {verified_bytes / BYTES_IN_A_GIB:.2f} GiB of {total_bytes / BYTES_IN_A_GIB:.2f} GiB this run",
+            f"Never verified: {never_verified_bytes / BYTES_IN_A_GIB:.2f} GiB",
+        ]
+        if never_verified_bytes == 0:
+            report.append("Every file has been verified at least once")
+        elif verified_bytes == 0:
+            report.append("Nothing was verified this run, so there is no projection for when every file will be")
+        else:
+            remaining_runs = math.ceil(never_verified_bytes / verified_bytes)
+            projected_date = date.today() + timedelta(days=remaining_runs * BUDGETED_RUN_INTERVAL_DAYS)
+            report.append(f"Every file will have been verified at least once by {projected_date.isoformat()}")
+
+        if verified_bytes > 0:
+            cycle_days = math.ceil(total_bytes / verified_bytes) * BUDGETED_RUN_INTERVAL_DAYS
+            report.append(f"At this rate, each file is verified every {cycle_days} days")
+            if cycle_days > RECENCY_MINIMUM_AGE_DAYS:
+                bytes_per_run = total_bytes * BUDGETED_RUN_INTERVAL_DAYS / RECENCY_MINIMUM_AGE_DAYS
+                report.append(
+                    f"To verify each file every {RECENCY_MINIMUM_AGE_DAYS} days,"
+                    f" each run needs to verify {bytes_per_run / BYTES_IN_A_GIB:.2f} GiB"
+                )
+
+        return report
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import zlib
+
+from bitrotchecker.src.block_checksums import (
+    get_block_checksums_of_range,
+    get_differing_byte_ranges,
+    format_byte_ranges,
+)
+from bitrotchecker.src.checksum_algorithms import BlockCrc32Hasher, unpack_block_checksums
+
+
+class TestBlockChecksums:
+    def test_block_hasher(self):
+        data = bytes(range(256)) * 4
+        hasher = BlockCrc32Hasher(block_size=300)
+
+        # Chunks do not need to line up with blocks
+        for chunk in [data[:70], data[70:500], data[500:]]:
+            hasher.update(chunk)
+
+        expected_block_checksums = [zlib.crc32(data[:300]), zlib.crc32(data[300:600]), zlib.crc32(data[600:900])]
+        expected_block_checksums.append(zlib.crc32(data[900:]))
+        assert unpack_block_checksums(hasher.result()) == expected_block_checksums
+
+    def test_get_block_checksums_of_range(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            file_path = os.path.join(tmp_dir_path, "test.bin")
+            data = bytes(range(256)) * 4
+            with open(file_path, mode="wb") as file:
+                file.write(data)
+
+            hasher = BlockCrc32Hasher(block_size=100)
+            hasher.update(data)
+            all_block_checksums = unpack_block_checksums(hasher.result())
+
+            assert get_block_checksums_of_range(file_path, 100, 2, 3) == all_block_checksums[2:5]
+            # The last block is shorter than the rest
+            assert get_block_checksums_of_range(file_path, 100, 9, 5) == all_block_checksums[9:]
+
+    def test_get_differing_byte_ranges(self):
+        expected = [1, 2, 3, 4, 5, 6]
+        actual = [1, 0, 0, 4, 5, 0]
+        byte_ranges = get_differing_byte_ranges(expected, actual, block_size=10)
+        assert byte_ranges == [(10, 30), (50, 60)]
+        assert format_byte_ranges(byte_ranges, file_size=55) == "10-29, 50-54"
+
+        # Ranges are offset by the first block
+        assert get_differing_byte_ranges([1, 2], [1, 0], block_size=10, first_block=3) == [(40, 50)]
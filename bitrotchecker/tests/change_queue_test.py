@@ -0,0 +1,75 @@
+import os
+import tempfile
+import time
+
+from bitrotchecker.src.change_queue import ChangeQueue, walk_changes
+
+
+class TestChangeQueue:
+    def test_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            change_queue = ChangeQueue(os.path.join(tmp_dir_path, "change_queue.sqlite3"))
+            root = os.path.join(tmp_dir_path, "root")
+            change_queue.add_changes(
+                root,
+                [os.path.join(root, "a.txt"), os.path.join(root, "new", "b.txt"), os.path.join(root, "newer.txt")],
+                [os.path.join(root, "new"), os.path.join(root, "new", "inner")],
+            )
+            change_queue.add_changes("other root", ["other.txt"])
+
+            changes = change_queue.get_changes(root)
+            assert len(changes) == 5
+            # Files and directories inside a changed directory are walked as part of it
+            assert changes.directories == [os.path.join(root, "new")]
+            assert changes.file_paths == [os.path.join(root, "a.txt"), os.path.join(root, "newer.txt")]
+
+            # A file that changes again while the changes are being processed stays queued
+            time.sleep(0.01)
+            change_queue.add_changes(root, [os.path.join(root, "a.txt")])
+            change_queue.remove_changes(changes)
+            changes = change_queue.get_changes(root)
+            assert changes.file_paths == [os.path.join(root, "a.txt")]
+            assert changes.directories == []
+            assert len(change_queue.get_changes("other root")) == 1
+            change_queue.close()
+
+    def test_walk_changes(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "new"))
+            for name in ["a.txt", "b.tmp", os.path.join("new", "c.txt")]:
+                with open(os.path.join(root, name), mode="w") as file:
+                    file.write(name)
+
+            change_queue = ChangeQueue(os.path.join(root, "change_queue.sqlite3"))
+            change_queue.add_changes(
+                root,
+                [os.path.join(root, "a.txt"), os.path.join(root, "b.tmp"), os.path.join(root, "deleted.txt")],
+                [os.path.join(root, "new")],
+            )
+
+            # Deleted and skipped files are left out
+            file_paths = [file_entry.path for file_entry in walk_changes(change_queue.get_changes(root))]
+            assert file_paths == [os.path.join(root, "a.txt"), os.path.join(root, "new", "c.txt")]
+            change_queue.close()
+
+    def test_can_skip_full_walk(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            change_queue = ChangeQueue(os.path.join(tmp_dir_path, "change_queue.sqlite3"))
+            assert not change_queue.can_skip_full_walk("root")
+
+            # A full walk that started before the watcher could have missed changes the watcher did not see
+            change_queue.record_full_walk("root", time.time())
+            time.sleep(0.01)
+            change_queue.start_watching("root")
+            assert not change_queue.can_skip_full_walk("root")
+
+            change_queue.record_full_walk("root", time.time())
+            assert change_queue.can_skip_full_walk("root")
+            # The watcher stopped sending heartbeats
+            assert not change_queue.can_skip_full_walk("root", heartbeat_seconds=0)
+            # Every path is still walked in full once in a while
+            assert not change_queue.can_skip_full_walk("root", full_walk_interval_days=0)
+
+            change_queue.stop_watching("root")
+            assert not change_queue.can_skip_full_walk("root")
+            change_queue.close()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+
+import pytest
+
+from bitrotchecker.src.change_queue import ChangeQueue
+from bitrotchecker.src.change_watcher import ChangeWatcher, IN_Q_OVERFLOW, is_supported
+
+
+@pytest.mark.skipif(not is_supported(), reason="inotify is only available on Linux")
+class TestChangeWatcher:
+    def test_watch_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            root = os.path.join(tmp_dir_path, "root")
+            os.makedirs(os.path.join(root, "existing"))
+            change_queue = ChangeQueue(os.path.join(tmp_dir_path, "change_queue.sqlite3"))
+            change_watcher = ChangeWatcher([root], change_queue)
+            change_watcher.start()
+
+            with open(os.path.join(root, "existing", "a.txt"), mode="w") as file:
+                file.write("a")
+            with open(os.path.join(root, "b.tmp"), mode="w") as file:
+                file.write("b")
+            os.makedirs(os.path.join(root, "new"))
+            change_watcher.poll(1)
+
+            changes = change_queue.get_changes(root)
+            assert changes.file_paths == [os.path.join(root, "existing", "a.txt")]
+            assert changes.directories == [os.path.join(root, "new")]
+            change_queue.remove_changes(changes)
+
+            # The new directory is watched too
+            with open(os.path.join(root, "new", "c.txt"), mode="w") as file:
+                file.write("c")
+            os.utime(os.path.join(root, "existing", "a.txt"), ns=(0, 0))
+            change_watcher.poll(1)
+            changes = change_queue.get_changes(root)
+            assert changes.file_paths == [os.path.join(root, "existing", "a.txt"), os.path.join(root, "new", "c.txt")]
+
+            change_watcher.close()
+            change_queue.close()
+
+    def test_overflow(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            root = os.path.join(tmp_dir_path, "root")
+            os.makedirs(root)
+            change_queue = ChangeQueue(os.path.join(tmp_dir_path, "change_queue.sqlite3"))
+            change_watcher = ChangeWatcher([root], change_queue)
+            change_watcher.start()
+
+            # Events that were dropped could have been anywhere under the root
+            root_watch = next(iter(change_watcher.root_watches.values()))
+            changed_files, changed_directories = root_watch.handle_events([(-1, IN_Q_OVERFLOW, "")])
+            assert changed_files == set()
+            assert changed_directories == {root}
+
+            change_watcher.close()
+            change_queue.close()
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+import urllib.error
+import urllib.request
+from datetime import datetime
+from unittest.mock import Mock
+
+import pytest
+
+from bitrotchecker.src.change_queue import ChangeQueue
+from bitrotchecker.src.daemon_util import ActiveHours, DaemonStatus, start_status_server
+
+
+class TestDaemonUtil:
+    def test_active_hours(self):
+        daytime = ActiveHours.parse(["09:00", "17:30"])
+        assert daytime.is_active(datetime(2024, 1, 1, 9, 0))
+        assert not daytime.is_active(datetime(2024, 1, 1, 17, 30))
+        assert daytime.get_end(datetime(2024, 1, 1, 12, 0)) == datetime(2024, 1, 1, 17, 30)
+        assert daytime.get_next_start(datetime(2024, 1, 1, 8, 0)) == datetime(2024, 1, 1, 9, 0)
+        assert daytime.get_next_start(datetime(2024, 1, 1, 18, 0)) == datetime(2024, 1, 2, 9, 0)
+
+        # Active hours can run past midnight
+        overnight = ActiveHours.parse(["22:00", "06:00"])
+        assert overnight.is_active(datetime(2024, 1, 1, 23, 0))
+        assert overnight.is_active(datetime(2024, 1, 2, 5, 0))
+        assert not overnight.is_active(datetime(2024, 1, 2, 12, 0))
+        assert overnight.get_end(datetime(2024, 1, 1, 23, 0)) == datetime(2024, 1, 2, 6, 0)
+        assert overnight.get_end(datetime(2024, 1, 2, 5, 0)) == datetime(2024, 1, 2, 6, 0)
+
+        assert ActiveHours.parse(None) is None
+
+    def test_status_server(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            change_queue = ChangeQueue(os.path.join(tmp_dir_path, "change_queue.sqlite3"))
+            change_queue.add_changes("root", ["root/a.txt"])
+            daemon_status = DaemonStatus(change_queue)
+
+            file_processor = Mock()
+            file_processor.progress_reporter.get_progress.return_value = {"files_done": 3}
+            file_processor.get_queue_sizes.return_value = {"look up": 2}
+            daemon_status.start_cycle()
+            daemon_status.set_file_processor(file_processor)
+
+            # Port 0 picks any free port
+            server = start_status_server(daemon_status, 0)
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            try:
+                with urllib.request.urlopen(f"{url}/status") as response:
+                    status = json.load(response)
+                assert status["state"] == "verifying"
+                assert status["queued_changes"] == 1
+                assert status["progress"] == {"files_done": 3}
+                assert status["queue_sizes"] == {"look up": 2}
+
+                daemon_status.finish_cycle(successes=3, failures=0, skips=1)
+                with urllib.request.urlopen(url) as response:
+                    status = json.load(response)
+                assert status["cycles_completed"] == 1
+                assert status["last_cycle"]["skips"] == 1
+                assert "progress" not in status
+
+                with pytest.raises(urllib.error.HTTPError):
+                    urllib.request.urlopen(f"{url}/other")
+            finally:
+                server.shutdown()
+                change_queue.close()
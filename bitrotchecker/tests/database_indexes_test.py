@@ -0,0 +1,70 @@
+from unittest.mock import Mock
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from bitrotchecker.src.constants import FILE_ID_KEY, MODIFIED_TIME_NS_KEY, LAST_ACCESSED_KEY
+from bitrotchecker.src.database_indexes import ensure_indexes, check_query_plans, find_collection_scans
+
+
+def _create_collection(winning_plan: dict) -> Mock:
+    collection = Mock()
+    collection.name = "files"
+    collection.database.command.return_value = {"queryPlanner": {"winningPlan": winning_plan}}
+    return collection
+
+
+class TestDatabaseIndexes:
+    def test_ensure_indexes(self):
+        collection = mongomock.MongoClient().db.files
+        lines = ensure_indexes(collection)
+        assert all(line.startswith("Created index") for line in lines)
+
+        # Records only expire when configured to
+        keys = [index["key"] for index in collection.index_information().values()]
+        assert [(FILE_ID_KEY, 1), (MODIFIED_TIME_NS_KEY, 1)] in keys
+        assert [(LAST_ACCESSED_KEY, 1)] not in keys
+
+        # Existing indexes are only checked
+        lines = ensure_indexes(collection)
+        assert all(line.endswith("is valid") for line in lines)
+
+    def test_record_expiry(self):
+        collection = mongomock.MongoClient().db.files
+        lines = ensure_indexes(collection, record_expiry_days=800)
+        assert lines[0].startswith("WARNING: Records that have not been accessed for 800 days are deleted")
+        assert lines[2].startswith("Created index l_1")
+        assert collection.index_information()["l_1"]["expireAfterSeconds"] == 800 * 24 * 60 * 60
+
+        # A TTL index that is no longer configured is reported
+        lines = ensure_indexes(collection)
+        assert lines[0].startswith("WARNING: Index l_1 deletes records")
+
+    def test_ensure_indexes_with_different_options(self):
+        collection = mongomock.MongoClient().db.files
+        collection.create_index(LAST_ACCESSED_KEY, expireAfterSeconds=60)
+        lines = ensure_indexes(collection, record_expiry_days=800)
+        assert lines[1].startswith("Created index")
+        assert lines[2].startswith("FAIL: Index l_1")
+
+    def test_collection_scans(self):
+        index_plan = {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}
+        collection = _create_collection(index_plan)
+        assert find_collection_scans(collection) == []
+        check_query_plans(collection)
+
+        # Newer servers nest the stages under queryPlan
+        collection_scan_plan = {"queryPlan": {"stage": "LIMIT", "inputStage": {"stage": "COLLSCAN"}}}
+        collection = _create_collection(collection_scan_plan)
+        assert len(find_collection_scans(collection)) == 4
+        with pytest.raises(ValueError):
+            check_query_plans(collection)
+        check_query_plans(collection, require_indexed_queries=False)
+
+        # Only a database that refuses to explain is let through, not one that cannot be reached
+        collection.database.command.side_effect = OperationFailure("not authorized")
+        check_query_plans(collection)
+        collection.database.command.side_effect = AutoReconnect("down")
+        with pytest.raises(AutoReconnect):
+            check_query_plans(collection)
@@ -0,0 +1,244 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from unittest import mock
+from unittest.mock import Mock
+
+import mongomock
+from pymongo.errors import AutoReconnect
+
+from bitrotchecker.src.byte_budget import ByteBudget
+from bitrotchecker.src.device_pool import DevicePool
+from bitrotchecker.src.constants import CHUNK_SIZE
+from bitrotchecker.src.file_processor import FileProcessor
+from bitrotchecker.src.file_reader import DOUBLE_BUFFER, READ_INTO, get_buffers_per_file
+from bitrotchecker.src.file_record import FileRecord
+from bitrotchecker.src.file_util import walk_files
+from bitrotchecker.src.mongo_util import MongoUtil
+from bitrotchecker.src.progress_reporter import ProgressReporter
+from bitrotchecker.src.recency_util import RecencyUtil
+
+
+class TestFileProcessor:
+    def test_process_files_concurrently(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            data_path = os.path.join(tmp_dir_path, "data")
+            os.makedirs(data_path)
+            file_paths = []
+            for i in range(20):
+                file_path = os.path.join(data_path, f"file{i}.txt")
+                with open(file_path, mode="wb") as file:
+                    file.write(f"contents {i}".encode() * (i + 1))
+                file_paths.append(file_path)
+            with open(os.path.join(data_path, "ignored.tmp"), mode="wb") as file:
+                file.write(b"ignored")
+
+            mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+            logger = Mock()
+
+            # First run records every file
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency1.sqlite3"))
+            file_processor = FileProcessor(
+                recency_util, mongo_util, logger, workers_per_device=4, max_in_flight_bytes=1
+            )
+            summary = file_processor.process_files(data_path, walk_files(data_path), file_is_immutable=False)
+            assert (summary.successes, summary.failures, summary.skips) == (20, 0, 0)
+            recency_util.close()
+            assert mongo_util.files_collection.count_documents({}) == 20
+
+            # Corrupt one file without changing its modified time
+            stat = os.stat(file_paths[3])
+            with open(file_paths[3], mode="r+b") as file:
+                file.write(b"X")
+            os.utime(file_paths[3], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            # Second run verifies every file and finds the corrupted one
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency2.sqlite3"))
+            file_processor = FileProcessor(recency_util, mongo_util, logger, workers_per_device=2)
+            summary = file_processor.process_files(data_path, walk_files(data_path), file_is_immutable=False)
+            assert (summary.successes, summary.failures, summary.skips) == (19, 1, 0)
+            assert len(file_processor.failed_files) == 1
+            assert file_paths[3] in file_processor.failed_files[0]
+            recency_util.close()
+
+    def test_dropped_files_are_counted(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            data_path = os.path.join(tmp_dir_path, "data")
+            os.makedirs(data_path)
+            for i in range(10):
+                with open(os.path.join(data_path, f"file{i}.txt"), mode="wb") as file:
+                    file.write(b"contents")
+
+            mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency.sqlite3"))
+            logger = Mock()
+            progress_reporter = ProgressReporter()
+            file_processor = FileProcessor(recency_util, mongo_util, logger, progress_reporter=progress_reporter)
+
+            # Every batch of the lookup stage fails, and its files are counted as skipped rather than lost
+            with mock.patch.object(FileProcessor, "_get_in_flight_bytes", side_effect=ValueError("lookup failed")):
+                summary = file_processor.process_files(data_path, walk_files(data_path), file_is_immutable=False)
+            assert (summary.successes, summary.failures, summary.skips) == (0, 0, 10)
+            assert progress_reporter.bytes_skipped == 10 * len(b"contents")
+            assert logger.write.call_count >= 1
+
+            # A file that was walked after the deadline is counted as skipped too
+            summary = file_processor.process_paths(
+                [(data_path, walk_files(data_path), False)], deadline=time.monotonic() - 1
+            )[data_path]
+            assert (summary.successes, summary.failures, summary.skips) == (0, 0, 1)
+            assert file_processor.deadline_reached
+            recency_util.close()
+
+    def test_byte_budget(self):
+        byte_budget = ByteBudget(100)
+        byte_budget.acquire(60)
+        byte_budget.acquire(40)
+        assert byte_budget.bytes_in_flight == 100
+        byte_budget.release(100)
+
+        # Oversized requests are let through on their own
+        byte_budget.acquire(500)
+        assert byte_budget.bytes_in_flight == 500
+        byte_budget.release(500)
+        assert byte_budget.bytes_in_flight == 0
+
+    def test_process_paths(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            paths = []
+            for name in ["immutable", "mutable"]:
+                path = os.path.join(tmp_dir_path, name)
+                os.makedirs(path)
+                for i in range(5):
+                    with open(os.path.join(path, f"file{i}.txt"), mode="wb") as file:
+                        file.write(f"{name} {i}".encode())
+                paths.append(path)
+
+            mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency.sqlite3"))
+            progress_reporter = ProgressReporter(output=io.StringIO())
+            file_processor = FileProcessor(recency_util, mongo_util, Mock(), progress_reporter=progress_reporter)
+            summaries = file_processor.process_paths(
+                [(paths[0], walk_files(paths[0]), True), (paths[1], walk_files(paths[1]), False)]
+            )
+            assert list(summaries.keys()) == paths
+            # Newly created immutable files are skipped, which shows each path kept its own settings
+            immutable_summary, mutable_summary = summaries[paths[0]], summaries[paths[1]]
+            assert (immutable_summary.successes, immutable_summary.failures, immutable_summary.skips) == (0, 0, 5)
+            assert (mutable_summary.successes, mutable_summary.failures, mutable_summary.skips) == (5, 0, 0)
+            assert [stage_metrics.items for stage_metrics in file_processor.stage_metrics] == [10, 10, 10, 10, 10]
+            assert not file_processor.deadline_reached
+            assert file_processor.get_queue_sizes() == {}
+
+            # Progress carries on across calls, and the recently processed files were not read
+            file_processor.process_paths([(paths[1], walk_files(paths[1]), False)])
+            assert progress_reporter.files_done == 15
+            assert progress_reporter.files_skipped == 10
+
+            # Once stopped, no more files are started
+            file_processor.stop()
+            summaries = file_processor.process_paths([(paths[1], walk_files(paths[1]), False)])
+            assert summaries[paths[1]].successes == 0
+            assert file_processor.deadline_reached
+            recency_util.close()
+
+    def test_failed_writes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            data_path = os.path.join(tmp_dir_path, "data")
+            os.makedirs(data_path)
+            for i in range(3):
+                with open(os.path.join(data_path, f"file{i}.txt"), mode="wb") as file:
+                    file.write(f"contents {i}".encode())
+
+            # Files whose records could not be written are not recorded as processed, so the next run retries them
+            mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency.sqlite3"))
+            logger = Mock()
+            file_processor = FileProcessor(recency_util, mongo_util, logger)
+            with mock.patch.object(mongo_util.files_collection, "bulk_write", side_effect=AutoReconnect("down")):
+                summary = file_processor.process_files(data_path, walk_files(data_path), file_is_immutable=False)
+            assert summary.successes == 3
+            assert len(recency_util) == 0
+            assert sum("Could not write the record" in call.args[0] for call in logger.write.call_args_list) == 3
+            # Lets the caller keep the queued changes of files that may not have been recorded
+            assert file_processor.exceptions_logged == 3
+
+            file_processor.process_files(data_path, walk_files(data_path), file_is_immutable=False)
+            assert len(recency_util) == 3
+            assert file_processor.exceptions_logged == 0
+            assert mongo_util.files_collection.count_documents({}) == 3
+
+            # A failed flush is logged and still leaves the processor ready for the next files
+            with mock.patch.object(mongo_util, "flush", side_effect=AutoReconnect("down")):
+                file_processor.process_files(data_path, walk_files(data_path), file_is_immutable=False)
+            assert "EXCEPTION: down" in logger.write.call_args.args[0]
+            assert file_processor.get_queue_sizes() == {}
+            assert not file_processor.deadline_reached
+            recency_util.close()
+
+    def test_hard_links(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            data_path = os.path.join(tmp_dir_path, "data")
+            snapshot_paths = [os.path.join(data_path, f"snapshot{i}") for i in range(3)]
+            for snapshot_path in snapshot_paths:
+                os.makedirs(snapshot_path)
+            file_path = os.path.join(snapshot_paths[0], "file.txt")
+            with open(file_path, mode="wb") as file:
+                file.write(b"contents" * 100)
+            for snapshot_path in snapshot_paths[1:]:
+                os.link(file_path, os.path.join(snapshot_path, "file.txt"))
+
+            mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency.sqlite3"))
+            file_processor = FileProcessor(recency_util, mongo_util, Mock(), workers_per_device=2)
+            summary = file_processor.process_files(data_path, walk_files(data_path), file_is_immutable=False)
+            assert (summary.successes, summary.failures, summary.skips) == (3, 0, 0)
+            # The inode is read once and every link gets its own record
+            assert file_processor.inode_checksum_cache.files_deduplicated == 2
+            assert file_processor.inode_checksum_cache.bytes_deduplicated == 1600
+            assert mongo_util.files_collection.count_documents({}) == 3
+            recency_util.close()
+
+    def test_in_flight_bytes(self):
+        # Each file counts as every chunk buffer the read strategy holds at once
+        assert get_buffers_per_file(DOUBLE_BUFFER) == 2
+        assert get_buffers_per_file(READ_INTO) == 1
+        file_record = FileRecord("file", 0, 10 * CHUNK_SIZE)
+        assert FileProcessor._get_in_flight_bytes(file_record) == CHUNK_SIZE * get_buffers_per_file()
+
+    def test_device_pool(self):
+        lock = threading.Lock()
+        running = defaultdict(int)
+        max_running = defaultdict(int)
+
+        def _read(device: int):
+            with lock:
+                running[device] += 1
+                max_running[device] = max(max_running[device], running[device])
+            time.sleep(0.01)
+            with lock:
+                running[device] -= 1
+
+        # Device 2 is allowed more workers than the default
+        with DevicePool(workers_per_device=1, max_in_flight_bytes=1000, device_workers={2: 3}) as device_pool:
+            for _ in range(6):
+                for device in [1, 2]:
+                    device_pool.submit(device, 100, _read, device)
+
+        assert max_running[1] == 1
+        assert 1 < max_running[2] <= 3
+
+    def test_slow_device_does_not_block_others(self):
+        slow_device_released = threading.Event()
+        with DevicePool(workers_per_device=1, max_in_flight_bytes=100, queue_size=1) as device_pool:
+            # Device 1's budget is used up by a read that is stuck, and another file is queued behind it
+            device_pool.submit(1, 100, slow_device_released.wait)
+            device_pool.submit(1, 100, lambda: None)
+            try:
+                # Submitting to device 1 did not wait for its budget, so device 2 can still be read
+                assert device_pool.submit(2, 100, lambda: "read").result(timeout=5) == "read"
+            finally:
+                slow_device_released.set()
@@ -1,7 +1,32 @@
+import os
+import tempfile
+from unittest import mock
+
+import pytest
+
 from bitrotchecker.src.file_record import FileRecord
 
 
 class TestFileRecord:
     def test_file_record(self):
-        file_record = FileRecord("C:\\Some Folder\\Some File.txt", '')
+        file_record = FileRecord("C:\\Some Folder\\Some File.txt", 12345.6, 1000)
         assert file_record.file_id == "52874b88c10c6e35478ff33c6ac67d6c91de5a23fb8c7b2c5ed21c1e7686624a"
+
+    def test_file_record_from_path(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            full_file_path = os.path.join(tmp_dir_path, "test.txt")
+            with open(full_file_path, mode="wb") as file:
+                file.write(b"test1")
+
+            file_record = FileRecord.from_path("test.txt", full_file_path)
+            assert file_record.size == 5
+            assert file_record.modified_time == os.path.getmtime(full_file_path)
+            assert file_record.checksum == 2326977762
+
+            # The checksum is only calculated once
+            with mock.patch("bitrotchecker.src.file_record.get_checksums_of_file") as mock_get_checksum:
+                assert file_record.checksum == 2326977762
+                mock_get_checksum.assert_not_called()
+
+            with pytest.raises(AttributeError):
+                file_record.size = 10
@@ -1,16 +1,89 @@
 import io
+import tempfile
+from unittest import mock
+
+import pytest
 
 # noinspection PyProtectedMember
 import os.path
 from typing import List
 
-from bitrotchecker.src.file_util import _get_checksum, should_skip_file
+from bitrotchecker.src.checksum_checkpoint_util import ChecksumCheckpointUtil
+from bitrotchecker.src.file_reader import READ_STRATEGIES, read_chunks, MMAP
+from bitrotchecker.src.file_util import (
+    _get_checksums,
+    should_skip_file,
+    walk_files,
+    get_checksums_of_file,
+)
+from bitrotchecker.src.run_metrics import METRICS
 
 
 class TestFileUtil:
-    def test_get_checksum(self):
-        checksum = _get_checksum(io.BytesIO(b"test1"))
-        assert 2326977762 == checksum
+    def test_get_checksums(self):
+        checksums = _get_checksums(io.BytesIO(b"test1"), ["crc32", "sha256"])
+        assert checksums == {
+            "crc32": 2326977762,
+            "sha256": "1b4f0e9851971998e732078544c96b36c3d01cedf7caa332359d6f1d83567014",
+        }
+
+    def test_read_strategies(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            file_path = os.path.join(tmp_dir_path, "test.bin")
+            data = bytes(range(256)) * 10
+            with open(file_path, mode="wb") as file:
+                file.write(data)
+
+            # Use a tiny chunk size so that every strategy needs many chunks
+            with mock.patch("bitrotchecker.src.file_reader.CHUNK_SIZE", 100):
+                for read_strategy in READ_STRATEGIES:
+                    with open(file_path, mode="rb") as file:
+                        chunks = [bytes(chunk) for chunk in read_chunks(file, read_strategy=read_strategy)]
+                    assert b"".join(chunks) == data, read_strategy
+                    assert max(len(chunk) for chunk in chunks) == 100, read_strategy
+
+                # Files without a file descriptor fall back to reading normally
+                assert b"".join(bytes(chunk) for chunk in read_chunks(io.BytesIO(data), read_strategy=MMAP)) == data
+
+    def test_resume_checksums(self, capsys):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            file_path = os.path.join(tmp_dir_path, "test.bin")
+            data = bytes(range(256)) * 10
+            with open(file_path, mode="wb") as file:
+                file.write(data)
+            checkpoint_util = ChecksumCheckpointUtil(os.path.join(tmp_dir_path, "checkpoints.sqlite3"))
+            algorithms = ["crc32", "crc32_blocks"]
+
+            def _interrupted_read_chunks(file):
+                for chunk_number, chunk in enumerate(read_chunks(file)):
+                    if chunk_number == 3:
+                        raise KeyboardInterrupt()
+                    yield chunk
+
+            with mock.patch("bitrotchecker.src.file_reader.CHUNK_SIZE", 100), mock.patch.multiple(
+                "bitrotchecker.src.file_util",
+                RESUMABLE_CHECKSUM_MIN_FILE_SIZE=0,
+                CHECKSUM_CHECKPOINT_INTERVAL_BYTES=100,
+            ):
+                with mock.patch("bitrotchecker.src.file_util.read_chunks", _interrupted_read_chunks):
+                    with pytest.raises(KeyboardInterrupt):
+                        get_checksums_of_file(file_path, algorithms, checkpoint_util, len(data), 12345.6)
+
+                # A checkpoint for a different modified time is not used
+                assert checkpoint_util.load_checkpoint(file_path, len(data), 99999.9, algorithms) is None
+                with mock.patch("bitrotchecker.src.file_util.read_chunks", _interrupted_read_chunks):
+                    with pytest.raises(KeyboardInterrupt):
+                        get_checksums_of_file(file_path, algorithms, checkpoint_util, len(data), 12345.6)
+                assert checkpoint_util.load_checkpoint(file_path, len(data), 12345.6, algorithms)[0] == 300
+
+                # The next read continues from the checkpoint and gives the same result as a full read
+                capsys.readouterr()
+                checksums = get_checksums_of_file(file_path, algorithms, checkpoint_util, len(data), 12345.6)
+                assert "from byte 300" in capsys.readouterr().out
+                assert checksums == get_checksums_of_file(file_path, algorithms)
+                assert checkpoint_util.load_checkpoint(file_path, len(data), 12345.6, algorithms) is None
+
+            checkpoint_util.close()
 
     def test_skip_prefixes_true(self):
         assert should_skip_file(self._create_file_path(["C:", "Program Files", "MyProgram", ".stver", "test.txt"]))
@@ -28,6 +101,33 @@ class TestFileUtil:
         assert not should_skip_file(self._create_file_path(["C:", "Program Files", "temp", "test.txt"]))
         assert not should_skip_file(self._create_file_path(["C:", "Program Files", ".tmp.5", "test.txt"]))
 
+    def test_walk_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            for relative_path in [
+                ["a.txt"],
+                ["b.txt.tmp"],
+                ["folder", "c.txt"],
+                ["folder", "nested", "d.txt"],
+                [".stversions", "e.txt"],
+            ]:
+                file_path = os.path.join(tmp_dir_path, *relative_path)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, mode="w") as file:
+                    file.write("test")
+
+            METRICS.reset()
+            file_entries = list(walk_files(tmp_dir_path))
+            relative_paths = sorted(os.path.relpath(entry.path, tmp_dir_path) for entry in file_entries)
+            assert relative_paths == [
+                "a.txt",
+                os.path.join("folder", "c.txt"),
+                os.path.join("folder", "nested", "d.txt"),
+            ]
+            assert all(entry.stat().st_size == 4 for entry in file_entries)
+            # The skipped directory is not counted as a skipped file
+            assert METRICS.get_counter("files_skipped", reason="ignored") == 1
+            assert METRICS.get_counter("directories_skipped", reason="ignored") == 1
+
     @staticmethod
     def _create_file_path(file_paths: List[str]) -> str:
         return os.path.sep.join(file_paths)
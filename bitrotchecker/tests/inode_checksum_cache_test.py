@@ -0,0 +1,108 @@
+import os
+import tempfile
+import threading
+import time
+
+from bitrotchecker.src.checksum_algorithms import CRC32
+from bitrotchecker.src.file_record import FileRecord
+from bitrotchecker.src.inode_checksum_cache import InodeChecksumCache, get_inode_key
+
+
+class TestInodeChecksumCache:
+    def test_inode_key(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            file_path = os.path.join(tmp_dir_path, "a.txt")
+            with open(file_path, mode="w") as file:
+                file.write("a")
+            # A file with a single link is never cached
+            assert get_inode_key(os.stat(file_path)) is None
+
+            link_path = os.path.join(tmp_dir_path, "b.txt")
+            os.link(file_path, link_path)
+            assert get_inode_key(os.stat(file_path)) == get_inode_key(os.stat(link_path))
+            assert get_inode_key(os.stat(file_path)) is not None
+
+    def test_links_share_one_read(self):
+        inode_checksum_cache = InodeChecksumCache()
+        reads = []
+
+        def _read_checksums(algorithms):
+            reads.append(algorithms)
+            time.sleep(0.05)
+            return {algorithm: 123 for algorithm in algorithms}
+
+        # Links read at the same time wait for the first one instead of reading again
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    inode_checksum_cache.get_checksums((1, 2, 100, 0), 3, 100, {CRC32}, _read_checksums)
+                )
+            )
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert reads == [{CRC32}]
+        assert results == [{CRC32: 123}] * 3
+        assert (inode_checksum_cache.files_deduplicated, inode_checksum_cache.bytes_deduplicated) == (2, 200)
+        # Every link has used the checksums, so they are not kept
+        assert len(inode_checksum_cache) == 0
+
+    def test_least_recently_used_inodes_are_dropped(self):
+        inode_checksum_cache = InodeChecksumCache(max_entries=2)
+        reads = []
+
+        def _read_checksums(algorithms):
+            reads.append(algorithms)
+            return {algorithm: 123 for algorithm in algorithms}
+
+        # Each inode has another link that is never reached, such as one outside the configured paths
+        for inode in range(3):
+            inode_checksum_cache.get_checksums((1, inode, 100, 0), 2, 100, {CRC32}, _read_checksums)
+            assert len(inode_checksum_cache) <= 2
+        assert len(reads) == 3
+
+        # The most recently used inode is still cached, and a link of a dropped inode is read again
+        inode_checksum_cache.get_checksums((1, 2, 100, 0), 3, 100, {CRC32}, _read_checksums)
+        assert len(reads) == 3
+        inode_checksum_cache.get_checksums((1, 0, 100, 0), 2, 100, {CRC32}, _read_checksums)
+        assert len(reads) == 4
+
+    def test_failed_read(self):
+        inode_checksum_cache = InodeChecksumCache()
+
+        def _fail(algorithms):
+            raise OSError("Input/output error")
+
+        try:
+            inode_checksum_cache.get_checksums((1, 2, 100, 0), 2, 100, {CRC32}, _fail)
+            assert False
+        except OSError:
+            pass
+
+        # The next link reads the file itself
+        checksums = inode_checksum_cache.get_checksums((1, 2, 100, 0), 2, 100, {CRC32}, lambda algorithms: {CRC32: 5})
+        assert checksums == {CRC32: 5}
+        assert inode_checksum_cache.files_deduplicated == 0
+
+    def test_file_records(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            file_path = os.path.join(tmp_dir_path, "a.txt")
+            with open(file_path, mode="w") as file:
+                file.write("contents")
+            link_path = os.path.join(tmp_dir_path, "b.txt")
+            os.link(file_path, link_path)
+
+            inode_checksum_cache = InodeChecksumCache()
+            file_record = FileRecord.from_stat(
+                "/a.txt", file_path, os.stat(file_path), inode_checksum_cache=inode_checksum_cache
+            )
+            link_record = FileRecord.from_stat(
+                "/b.txt", link_path, os.stat(link_path), inode_checksum_cache=inode_checksum_cache
+            )
+            assert file_record.checksum == link_record.checksum == FileRecord.from_path("/a.txt", file_path).checksum
+            assert inode_checksum_cache.bytes_deduplicated == len("contents")
@@ -0,0 +1,140 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from bitrotchecker.src.io_throttle import IO_THROTTLE, IoThrottle, ReadsStopped, parse_disk_stats, reload_limits_safely
+
+DISKSTATS = """
+   7       0 loop0 50 0 100 10 0 0 0 0 0 20 10 0 0 0 0
+   8       0 sda 1000 10 20000 500 2000 30 40000 800 0 1200 1300 0 0 0 0
+   8       1 sda1 900 10 18000 450 1900 30 38000 750 0 1100 1200 0 0 0 0
+ 259       0 nvme0n1 5000 0 90000 700 3000 0 50000 900 0 4000 1600 0 0 0 0
+"""
+
+
+def _diskstats(io_ticks: int, sectors_read: int, disk: str = "sda") -> str:
+    return f"   8       0 {disk} 1000 10 {sectors_read} 500 0 0 0 0 0 {io_ticks} 1300 0 0 0 0"
+
+
+def _read_own_bytes(io_throttle: IoThrottle, num_bytes: int):
+    # Count the read without checking the limits, which would read the mocked disk stats
+    with mock.patch.object(io_throttle, "_wait_while_overloaded"):
+        io_throttle.consume(num_bytes, device=1)
+
+
+class TestIoThrottle:
+    def test_bytes_per_second(self):
+        with mock.patch("bitrotchecker.src.io_throttle.time") as mock_time:
+            mock_time.monotonic.return_value = 100.0
+            io_throttle = IoThrottle(max_bytes_per_second=1000)
+
+            with mock.patch.object(io_throttle, "_wait") as mock_wait:
+                # One second of reads builds up
+                mock_time.monotonic.return_value = 105.0
+                io_throttle.consume(1000)
+                mock_wait.assert_not_called()
+
+                # Reads beyond that wait for the bucket to refill
+                io_throttle.consume(500)
+                mock_wait.assert_called_once_with(0.5)
+
+    def test_no_limits(self):
+        io_throttle = IoThrottle()
+        with mock.patch.object(io_throttle, "_wait") as mock_wait:
+            io_throttle.consume(10**12)
+            mock_wait.assert_not_called()
+
+    def test_pause_while_overloaded(self):
+        with mock.patch("bitrotchecker.src.io_throttle.time") as mock_time, mock.patch(
+            "bitrotchecker.src.io_throttle.os.getloadavg", create=True
+        ) as mock_getloadavg, mock.patch("bitrotchecker.src.io_throttle.count_own_active_threads", return_value=0):
+            mock_time.monotonic.side_effect = range(1000, 2000, 10)
+            mock_getloadavg.side_effect = [(9.0, 0, 0), (8.0, 0, 0), (1.0, 0, 0)]
+
+            io_throttle = IoThrottle(max_load_average=4.0)
+            with mock.patch.object(io_throttle, "_wait") as mock_wait:
+                io_throttle.consume(1000)
+            assert mock_wait.call_count == 2
+
+    def test_own_load_is_ignored(self):
+        with mock.patch("bitrotchecker.src.io_throttle.os.getloadavg", create=True) as mock_getloadavg, mock.patch(
+            "bitrotchecker.src.io_throttle.count_own_active_threads", return_value=4
+        ):
+            # Four of the five running threads are this program's own readers
+            mock_getloadavg.return_value = (5.0, 0, 0)
+            io_throttle = IoThrottle(max_load_average=2.0)
+            assert io_throttle._get_overloaded_reason() is None
+
+    def test_own_disk_utilization_is_ignored(self):
+        io_throttle = IoThrottle(max_disk_utilization_percent=50)
+        own_read_bytes = [0, 1000 * 512, 1000 * 512]
+        diskstats = [_diskstats(0, 0), _diskstats(1000, 1000), _diskstats(2000, 2000)]
+        with mock.patch("bitrotchecker.src.io_throttle.get_own_read_bytes", side_effect=own_read_bytes), mock.patch(
+            "bitrotchecker.src.io_throttle.get_device_disks", return_value=["sda1", "sda"]
+        ), mock.patch("builtins.open", mock.mock_open()) as mock_open:
+            mock_open.return_value.read.side_effect = diskstats
+            assert io_throttle._get_disk_utilization_percent(0.0) is None
+            # The disk was busy the whole second, but only with this program's reads of one of its partitions
+            _read_own_bytes(io_throttle, 1000 * 512)
+            assert io_throttle._get_disk_utilization_percent(1.0) == 0
+            # Then it was busy with another program's reads
+            assert io_throttle._get_disk_utilization_percent(2.0) == 100
+
+    def test_own_reads_only_discount_their_disk(self):
+        io_throttle = IoThrottle(max_disk_utilization_percent=50)
+        diskstats = [
+            _diskstats(0, 0) + "\n" + _diskstats(0, 0, disk="sdb"),
+            _diskstats(1000, 1000) + "\n" + _diskstats(1000, 100, disk="sdb"),
+        ]
+        with mock.patch("bitrotchecker.src.io_throttle.get_own_read_bytes", side_effect=[0, 1000 * 512]), mock.patch(
+            "bitrotchecker.src.io_throttle.get_device_disks", return_value=["sda"]
+        ), mock.patch("builtins.open", mock.mock_open()) as mock_open:
+            mock_open.return_value.read.side_effect = diskstats
+            io_throttle._get_disk_utilization_percent(0.0)
+            _read_own_bytes(io_throttle, 1000 * 512)
+            # This program only read sda, so another program keeping sdb busy still counts
+            assert io_throttle._get_disk_utilization_percent(1.0) == 100
+
+    def test_cached_reads_are_not_discounted(self):
+        io_throttle = IoThrottle(max_disk_utilization_percent=50)
+        diskstats = [_diskstats(0, 0), _diskstats(1000, 1000)]
+        with mock.patch("bitrotchecker.src.io_throttle.get_own_read_bytes", side_effect=[0, 500 * 512]), mock.patch(
+            "bitrotchecker.src.io_throttle.get_device_disks", return_value=["sda"]
+        ), mock.patch("builtins.open", mock.mock_open()) as mock_open:
+            mock_open.return_value.read.side_effect = diskstats
+            io_throttle._get_disk_utilization_percent(0.0)
+            # Half of the bytes this program read came from the page cache rather than the disk
+            _read_own_bytes(io_throttle, 1000 * 512)
+            assert io_throttle._get_disk_utilization_percent(1.0) == 50
+
+    def test_stop_while_waiting(self):
+        io_throttle = IoThrottle(max_bytes_per_second=1)
+        threading.Timer(0.05, io_throttle.stop).start()
+        # Without stop, this would wait for an hour
+        with pytest.raises(ReadsStopped):
+            io_throttle.consume(3600)
+        io_throttle.resume()
+
+    def test_parse_disk_stats(self):
+        with mock.patch("bitrotchecker.src.io_throttle.is_partition", side_effect=lambda disk: disk == "sda1"):
+            # Partitions are left out, since their I/O is part of their disk
+            assert parse_disk_stats(DISKSTATS) == {
+                "sda": (1200, 60000 * 512),
+                "nvme0n1": (4000, 140000 * 512),
+            }
+            assert parse_disk_stats(DISKSTATS, disks=["sda1"]) == {"sda1": (1100, 56000 * 512)}
+
+    def test_reload_invalid_config(self, capsys):
+        IO_THROTTLE.set_limits(1000, None, None)
+        try:
+            with mock.patch(
+                "bitrotchecker.src.io_throttle.get_max_read_bytes_per_second",
+                side_effect=ValueError("Expecting value: line 1 column 1 (char 0)"),
+            ):
+                reload_limits_safely()
+            # The old limits are kept
+            assert IO_THROTTLE.max_bytes_per_second == 1000
+            assert "Could not reload the read limits" in capsys.readouterr().out
+        finally:
+            IO_THROTTLE.set_limits(None, None, None)
@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+
+from bitrotchecker.src.logger_util import LoggerUtil, LATEST_LOG_FILE_NAME, LATEST_EVENT_LOG_FILE_NAME
+
+
+class TestLoggerUtil:
+    def test_logs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            # A copy left by an older version is replaced by a link
+            with open(os.path.join(tmp_dir_path, LATEST_LOG_FILE_NAME), mode="w") as old_latest_file:
+                old_latest_file.write("old run\n")
+
+            with LoggerUtil(tmp_dir_path) as logger:
+                logger.write("FAIL: File a.txt has a different size than expected", event="file_result", expected=1)
+                logger.write_event("file_result", result="pass", path="b.txt")
+
+            with open(os.path.join(tmp_dir_path, LATEST_LOG_FILE_NAME)) as log_file:
+                assert log_file.read() == "FAIL: File a.txt has a different size than expected\n"
+
+            with open(os.path.join(tmp_dir_path, LATEST_EVENT_LOG_FILE_NAME)) as event_log_file:
+                events = [json.loads(line) for line in event_log_file]
+            assert [event["event"] for event in events] == ["file_result", "file_result"]
+            assert events[0]["message"] == "FAIL: File a.txt has a different size than expected"
+            assert events[0]["expected"] == 1
+            assert events[1]["path"] == "b.txt"
+            assert "message" not in events[1]
+
+            # The dated logs and the links to them
+            assert len(os.listdir(tmp_dir_path)) == 4
+
+    def test_flushes_in_background(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            with LoggerUtil(tmp_dir_path, flush_interval_seconds=0.01) as logger:
+                logger.write_event("run_started")
+                event_log_path = os.path.join(tmp_dir_path, LATEST_EVENT_LOG_FILE_NAME)
+                # Only buffered until the background thread flushes it
+                for _ in range(500):
+                    if os.path.getsize(event_log_path) > 0:
+                        break
+                    logger._closed.wait(0.01)
+                assert os.path.getsize(event_log_path) > 0
@@ -0,0 +1,94 @@
+from datetime import datetime
+from unittest.mock import Mock
+
+import mongomock
+import pymongo
+import pytest
+
+from bitrotchecker.src.constants import (
+    FILE_ID_KEY,
+    MODIFIED_TIME_NS_KEY,
+    SIZE_KEY,
+    CHECKSUM_KEY,
+    LAST_ACCESSED_KEY,
+    SCHEMA_COLLECTION_NAME,
+)
+from bitrotchecker.src.file_record import FileRecord, get_file_id, encode_file_id
+from bitrotchecker.src.file_result_enum import FileResultValue
+from bitrotchecker.src.migrate_database import migrate_documents
+from bitrotchecker.src.mongo_util import MongoUtil
+
+
+def _create_legacy_document(file_path: str, modified_time: float) -> dict:
+    return {
+        "file_id": get_file_id(file_path),
+        "mtime": modified_time,
+        "mtime_s": int(modified_time),
+        "size": 1000,
+        "checksum": 99999999,
+        "checksum_algorithm": "crc32",
+        "last_accessed": datetime.now(),
+    }
+
+
+class TestMigrateDatabase:
+    def test_migrate_documents(self):
+        database = mongomock.MongoClient().db
+        database.files.create_index(
+            [("file_id", pymongo.ASCENDING), ("mtime", pymongo.ASCENDING)], unique=True, name="file_id_mtime"
+        )
+        database.files.create_index("last_accessed", expireAfterSeconds=60)
+        database.files.insert_many([_create_legacy_document(f"file{i}", 1700000000.1234567 + i) for i in range(5)])
+        database.files.insert_one({"file_id": "not hex", "mtime": 1.5})
+
+        # The old schema cannot be used until it is migrated
+        with pytest.raises(ValueError):
+            MongoUtil(database=database)
+
+        # A document that cannot be converted interrupts the migration after the batches before it
+        with pytest.raises(ValueError):
+            migrate_documents(database, batch_size=2)
+        database.files.delete_one({"file_id": "not hex"})
+
+        # Running it again continues from the last migrated batch
+        report = migrate_documents(database, batch_size=2)
+        assert report.documents_migrated == 1
+        assert report.bytes_after < report.bytes_before
+
+        document = database.files.find_one({FILE_ID_KEY: encode_file_id(get_file_id("file0"))})
+        assert set(document) == {
+            "_id",
+            FILE_ID_KEY,
+            MODIFIED_TIME_NS_KEY,
+            SIZE_KEY,
+            CHECKSUM_KEY,
+            "a",
+            LAST_ACCESSED_KEY,
+        }
+        assert document[MODIFIED_TIME_NS_KEY] == 1700000000123456700
+        assert database.files.count_documents({"file_id": {"$exists": True}}) == 0
+
+        indexes = {tuple(index["key"]): index for index in database.files.index_information().values()}
+        assert indexes[((FILE_ID_KEY, 1), (MODIFIED_TIME_NS_KEY, 1))]["unique"]
+        assert indexes[((LAST_ACCESSED_KEY, 1),)]["expireAfterSeconds"] == 60
+        assert (("file_id", 1), ("mtime", 1)) not in indexes
+
+        assert migrate_documents(database).documents_migrated == 0
+        assert database[SCHEMA_COLLECTION_NAME].find_one()["version"] == 2
+
+    def test_migrated_modified_time_upgraded(self):
+        database = mongomock.MongoClient().db
+        database.files.insert_one(_create_legacy_document("file_path", 1700000000.1234567))
+        migrate_documents(database)
+        mongo_util = MongoUtil(database=database)
+
+        # The float of seconds could not hold the exact nanoseconds of the file
+        file_record = FileRecord("file_path", 1700000000.1234567, 1000, 99999999, modified_time_ns=1700000000123456789)
+        result = mongo_util.process_file_record("root", file_record, Mock(), file_is_immutable=True)
+        assert result.value is FileResultValue.PASS
+        assert database.files.find_one()[MODIFIED_TIME_NS_KEY] == 1700000000123456789
+
+        result = mongo_util.process_file_record("root", file_record, Mock(), file_is_immutable=True)
+        assert result.value is FileResultValue.PASS
+        assert "upgraded" not in result.message
+        assert database.files.count_documents({}) == 1
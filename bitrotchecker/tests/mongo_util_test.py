@@ -1,9 +1,13 @@
+import os
+import tempfile
 import time
 from unittest import mock
 from unittest.mock import Mock
 
 import mongomock
+from pymongo.errors import BulkWriteError, WriteError
 
+from bitrotchecker.src.constants import CHECKSUM_ALGORITHM_KEY, CHECKSUM_KEY, BLOCK_CHECKSUMS_KEY
 from bitrotchecker.src.file_record import FileRecord
 from bitrotchecker.src.file_result_enum import FileResultValue
 from bitrotchecker.src.logger_util import LoggerUtil
@@ -152,3 +156,150 @@ class TestMongoUtil:
         # because it should be skipped for being too recently created.
         assert result.value is FileResultValue.SKIP
         assert mongo_util.files_collection.count_documents({}) == 2
+
+    def test_batched_lookups_and_writes(self):
+        database = mongomock.MongoClient().db
+        mongo_util = MongoUtil(database=database, lookup_batch_size=2, write_batch_size=2)
+
+        logger: LoggerUtil = Mock()
+
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            file_records = []
+            for i in range(5):
+                true_file_path = os.path.join(tmp_dir_path, f"file{i}")
+                with open(true_file_path, mode="wb") as file:
+                    file.write(f"{i}".encode())
+                file_records.append(FileRecord.from_path(file_path=f"file{i}", full_file_path=true_file_path))
+
+            # Unknown files are returned with no documents
+            documents_by_file_id = mongo_util.find_documents_by_file_ids(r.file_id for r in file_records)
+            assert documents_by_file_id == {r.file_id: [] for r in file_records}
+
+            # New records are buffered until the write batch is full or the writes are flushed
+            mongo_util.prefetch_file_ids(r.file_id for r in file_records)
+            for file_record in file_records:
+                result = mongo_util.process_file_record(file_record.full_file_path, file_record, logger, False)
+                assert result.value is FileResultValue.PASS
+            assert mongo_util.files_collection.count_documents({}) == 4
+            mongo_util.flush()
+            assert mongo_util.files_collection.count_documents({}) == 5
+
+            documents_by_file_id = mongo_util.find_documents_by_file_ids(r.file_id for r in file_records)
+            assert all(len(documents) == 1 for documents in documents_by_file_id.values())
+
+            # Known files are verified against the prefetched documents
+            mongo_util.prefetch_file_ids(r.file_id for r in file_records)
+            with mock.patch.object(mongo_util.files_collection, "find_one") as mock_find_one:
+                for file_record in file_records:
+                    result = mongo_util.process_file_record(file_record.full_file_path, file_record, logger, False)
+                    assert result.value is FileResultValue.PASS
+                mock_find_one.assert_not_called()
+            mongo_util.flush()
+            assert mongo_util.files_collection.count_documents({}) == 5
+
+    def test_failed_bulk_write(self):
+        database = mongomock.MongoClient().db
+        mongo_util = MongoUtil(database=database, write_batch_size=2)
+
+        logger: LoggerUtil = Mock()
+
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            file_records = []
+            for i in range(2):
+                true_file_path = os.path.join(tmp_dir_path, f"file{i}")
+                with open(true_file_path, mode="wb") as file:
+                    file.write(f"{i}".encode())
+                file_records.append(FileRecord.from_path(file_path=f"file{i}", full_file_path=true_file_path))
+
+            # Only the file whose write failed gets the error, not the file whose write sent the batch
+            bulk_write_error = BulkWriteError(
+                {"writeErrors": [{"index": 0, "code": 11000, "errmsg": "duplicate key"}], "writeConcernErrors": []}
+            )
+            mongo_util.prefetch_file_ids(r.file_id for r in file_records)
+            with mock.patch.object(mongo_util.files_collection, "bulk_write", side_effect=bulk_write_error):
+                results = [
+                    mongo_util.process_file_record(file_record.full_file_path, file_record, logger, False)
+                    for file_record in file_records
+                ]
+            assert all(result.value is FileResultValue.PASS for result in results)
+            assert isinstance(results[0].written.exception(), WriteError)
+            assert results[1].written.exception() is None
+
+    def test_checksum_algorithm_upgrade(self):
+        database = mongomock.MongoClient().db
+        mongo_util = MongoUtil(database=database)
+
+        logger: LoggerUtil = Mock()
+
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            true_file_path = os.path.join(tmp_dir_path, "file")
+            with open(true_file_path, mode="wb") as file:
+                file.write(b"test1")
+
+            # Records without an algorithm were made with CRC-32
+            file_record = FileRecord.from_path(file_path="file", full_file_path=true_file_path)
+            mongo_util.process_file_record(true_file_path, file_record, logger, False)
+            mongo_util.files_collection.update_many({}, {"$unset": {CHECKSUM_ALGORITHM_KEY: ""}})
+
+            # Verifying with a new configured algorithm upgrades the record
+            with mock.patch("bitrotchecker.src.mongo_util.CHECKSUM_ALGORITHM", "sha256"):
+                file_record = FileRecord.from_path(file_path="file", full_file_path=true_file_path)
+                result = mongo_util.process_file_record(true_file_path, file_record, logger, False)
+                assert result.value is FileResultValue.PASS
+                assert "upgraded" in result.message
+
+                document = mongo_util.files_collection.find_one({})
+                assert document[CHECKSUM_ALGORITHM_KEY] == "sha256"
+                assert document[CHECKSUM_KEY] == "1b4f0e9851971998e732078544c96b36c3d01cedf7caa332359d6f1d83567014"
+
+                # The upgraded record keeps verifying
+                file_record = FileRecord.from_path(file_path="file", full_file_path=true_file_path)
+                result = mongo_util.process_file_record(true_file_path, file_record, logger, False)
+                assert result.value is FileResultValue.PASS
+                assert "upgraded" not in result.message
+
+    def test_block_checksums(self):
+        database = mongomock.MongoClient().db
+        mongo_util = MongoUtil(database=database)
+
+        logger: LoggerUtil = Mock()
+
+        with tempfile.TemporaryDirectory() as tmp_dir_path, mock.patch.multiple(
+            "bitrotchecker.src.block_checksums", BLOCK_CHECKSUM_MIN_FILE_SIZE=500
+        ), mock.patch.multiple(
+            "bitrotchecker.src.checksum_algorithms", BLOCK_CHECKSUM_BLOCK_SIZE=100
+        ), mock.patch.multiple(
+            "bitrotchecker.src.file_record", BLOCK_CHECKSUM_BLOCK_SIZE=100
+        ), mock.patch.multiple(
+            "bitrotchecker.src.mongo_util", BLOCK_CHECKSUM_BLOCK_SIZE=100, BLOCK_VERIFICATION_BYTES_PER_RUN=400
+        ):
+            true_file_path = os.path.join(tmp_dir_path, "file")
+            data = bytes(range(256)) * 4
+            with open(true_file_path, mode="wb") as file:
+                file.write(data)
+
+            def _process():
+                record = FileRecord.from_path(file_path="file", full_file_path=true_file_path)
+                return mongo_util.process_file_record(true_file_path, record, logger, False)
+
+            # New large files get a checksum for every block
+            assert _process().value is FileResultValue.PASS
+            document = mongo_util.files_collection.find_one({})
+            assert len(document[BLOCK_CHECKSUMS_KEY]) == 11 * 4
+
+            # Each run verifies 4 blocks, and the file is only complete once every block is verified
+            results = [_process() for _ in range(3)]
+            assert all(result.value is FileResultValue.PASS for result in results)
+            assert [result.complete for result in results] == [False, False, True]
+            assert "blocks 8-10 of 11" in results[2].message
+
+            # Corrupt bytes in the second block without changing the modified time
+            stat = os.stat(true_file_path)
+            with open(true_file_path, mode="r+b") as file:
+                file.seek(150)
+                file.write(b"XX")
+            os.utime(true_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            result = _process()
+            assert result.value is FileResultValue.FAIL
+            assert "Changed bytes: 100-199" in result.message
@@ -0,0 +1,34 @@
+from bitrotchecker.src.pipeline_stage import PipelineStage
+
+
+class TestPipelineStage:
+    def test_stages(self):
+        results = []
+        errors = []
+
+        def _double(batch):
+            if 13 in batch:
+                raise ValueError("unlucky")
+            return [item * 2 for item in batch]
+
+        record_stage = PipelineStage("record", results.extend, queue_size=5)
+        double_stage = PipelineStage(
+            "double", _double, workers=3, queue_size=5, batch_size=4, output=record_stage.put, on_error=errors.append
+        )
+        for i in range(100):
+            double_stage.put(i)
+
+        # Closing a stage waits for everything that was put into it
+        double_stage.close()
+        record_stage.close()
+
+        # Only the batch with 13 in it is lost, and the stage keeps going
+        assert len(errors) == 1
+        assert 26 not in results
+        assert 96 <= len(results) < 100
+        assert len(set(results)) == len(results)
+        assert all(result % 2 == 0 for result in results)
+
+        assert double_stage.metrics.items == len(results)
+        assert record_stage.metrics.items == len(results)
+        assert double_stage.metrics.max_queue_depth <= 5
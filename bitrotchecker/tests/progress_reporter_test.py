@@ -0,0 +1,64 @@
+import io
+import os
+import tempfile
+
+from bitrotchecker.src.progress_reporter import ProgressReporter, load_previous_totals, save_totals, BYTES_IN_A_GIB
+
+
+class TestProgressReporter:
+    def test_reports_are_throttled(self):
+        output = io.StringIO()
+        reporter = ProgressReporter(
+            total_files=1000, total_bytes=4 * BYTES_IN_A_GIB, interval_seconds=60, output=output
+        )
+        for _ in range(100):
+            reporter.add(1, 1024)
+        # Nothing is written until the interval has passed
+        assert output.getvalue() == ""
+
+        reporter.finish()
+        lines = output.getvalue().splitlines()
+        assert len(lines) == 1
+        assert lines[0].startswith("100/1000 files, 0.00/4.00 GiB, ")
+
+    def test_every_add_reported_without_interval(self):
+        output = io.StringIO()
+        reporter = ProgressReporter(interval_seconds=0, output=output)
+        reporter.add(1, BYTES_IN_A_GIB)
+        reporter.add(2, BYTES_IN_A_GIB)
+
+        lines = output.getvalue().splitlines()
+        assert len(lines) == 2
+        assert lines[1].startswith("3 files, 2.00 GiB, ")
+        # Without totals there is nothing to estimate the time left from
+        assert "ETA" not in lines[1]
+
+    def test_eta(self):
+        reporter = ProgressReporter(total_files=10, total_bytes=4 * BYTES_IN_A_GIB, output=io.StringIO())
+        # A whole number start time keeps the elapsed time exact
+        reporter.start_time = 1000.0
+        reporter.add(5, BYTES_IN_A_GIB)
+        # A quarter of the bytes took 100 seconds, so three times as long is left
+        assert reporter.format_progress(1100.0).endswith("ETA 0:05:00")
+
+        # Past the estimated totals, there is nothing left
+        reporter.add(5, 4 * BYTES_IN_A_GIB)
+        assert reporter.format_progress(1100.0).endswith("ETA 0:00:00")
+
+    def test_eta_with_skipped_files(self):
+        reporter = ProgressReporter(total_files=10, total_bytes=4 * BYTES_IN_A_GIB, output=io.StringIO())
+        reporter.start_time = 1000.0
+        # Skipped files are not read, so they are left out of the bytes still to read
+        reporter.add(5, 2 * BYTES_IN_A_GIB, skipped=True)
+        reporter.add(1, BYTES_IN_A_GIB)
+        assert reporter.format_progress(1100.0).endswith("ETA 0:01:40")
+        assert (reporter.files_done, reporter.bytes_done) == (6, 3 * BYTES_IN_A_GIB)
+        assert reporter.get_progress()["bytes_skipped"] == 2 * BYTES_IN_A_GIB
+
+    def test_totals(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            totals_file_path = os.path.join(tmp_dir_path, "progress_totals.json")
+            assert load_previous_totals(totals_file_path) == (None, None)
+
+            save_totals(totals_file_path, 12, 3456)
+            assert load_previous_totals(totals_file_path) == (12, 3456)
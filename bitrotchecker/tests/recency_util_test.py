@@ -1,5 +1,7 @@
 import os
+import pickle
 import tempfile
+from datetime import datetime, timedelta
 
 from bitrotchecker.src.recency_util import RecencyUtil
 
@@ -7,7 +9,7 @@ from bitrotchecker.src.recency_util import RecencyUtil
 class TestRecencyUtil:
     def test_record_file_processed(self):
         with tempfile.TemporaryDirectory() as tmp_dir_path:
-            recency_file_path = os.path.join(tmp_dir_path, "recency.pickle")
+            recency_file_path = os.path.join(tmp_dir_path, "recency.sqlite3")
             recency_util = RecencyUtil(recency_file_path=recency_file_path)
 
             # Record a file
@@ -16,27 +18,55 @@ class TestRecencyUtil:
             assert recency_util.file_processed_recently(file_path, modified_time) is False
             recency_util.record_file_processed(file_path, modified_time)
             assert recency_util.file_processed_recently(file_path, modified_time) is True
+            recency_util.close()
 
             # Verify the file we recorded from before is still there
             recency_util = RecencyUtil(recency_file_path=recency_file_path)
             assert recency_util.file_processed_recently(file_path, modified_time) is True
             assert recency_util.file_processed_recently(file_path, modified_time + 999.9) is False
+            recency_util.close()
 
     def test_clean_records(self):
         with tempfile.TemporaryDirectory() as tmp_dir_path:
-            recency_file_path = os.path.join(tmp_dir_path, "recency.pickle")
+            recency_file_path = os.path.join(tmp_dir_path, "recency.sqlite3")
             recency_util = RecencyUtil(recency_file_path=recency_file_path)
 
             # Record some files
             recency_util.record_file_processed("file1", 12345.123)
             recency_util.record_file_processed("file2", 12345.123)
             recency_util.record_file_processed("file3", 12345.123)
-            assert len(recency_util.recency_dict) == 3
+            assert len(recency_util) == 3
 
             # 999 days means all records should stay
             recency_util.clean_records(age_in_days_to_clean=999)
-            assert len(recency_util.recency_dict) == 3
+            assert len(recency_util) == 3
 
             # 0 days means all records should be cleared
             recency_util.clean_records(age_in_days_to_clean=0)
-            assert len(recency_util.recency_dict) == 0
+            assert len(recency_util) == 0
+            recency_util.close()
+
+    def test_import_legacy_pickle(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            legacy_recency_file_path = os.path.join(tmp_dir_path, "recency.pickle")
+            recency_dict = {
+                "recentFile": (datetime.now(), 12345.123),
+                "oldFile": (datetime.now() - timedelta(days=999), 12345.123),
+            }
+            with open(legacy_recency_file_path, mode="wb") as legacy_recency_file:
+                pickle.dump(recency_dict, legacy_recency_file)
+
+            # Nothing is imported until asked to
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency.sqlite3"))
+            assert len(recency_util) == 0
+            recency_util.import_legacy_pickle(legacy_recency_file_path)
+            assert len(recency_util) == 2
+            assert recency_util.file_processed_recently("recentFile", 12345.123) is True
+            assert recency_util.file_processed_recently("oldFile", 12345.123) is False
+
+            # The pickle is only imported once
+            assert not os.path.exists(legacy_recency_file_path)
+            assert os.path.exists(legacy_recency_file_path + ".imported")
+            recency_util.import_legacy_pickle(legacy_recency_file_path)
+            assert len(recency_util) == 2
+            recency_util.close()
@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import mock
+
+import mongomock
+
+from bitrotchecker.src.file_record import FileRecord, get_file_id
+from bitrotchecker.src.mongo_util import MongoUtil
+
+# noinspection PyProtectedMember
+from bitrotchecker.src.remove_from_database import remove_file_ids, read_file_ids, walk_file_ids, _find_root
+
+
+class TestRemoveFromDatabase:
+    @staticmethod
+    def _create_mongo_util(file_paths) -> MongoUtil:
+        mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+        for file_path in file_paths:
+            for modified_time in [1.0, 2.0]:
+                document = FileRecord(file_path, modified_time, 100, 12345).get_mongo_document()
+                mongo_util.files_collection.insert_one(document)
+        return mongo_util
+
+    def test_remove_file_ids(self):
+        mongo_util = self._create_mongo_util([f"file{i}" for i in range(5)])
+        # One file ID is listed twice and one is not in the database
+        file_ids = [get_file_id("file0"), get_file_id("file1"), get_file_id("file1"), get_file_id("missing")]
+
+        assert remove_file_ids(mongo_util, iter(file_ids), dry_run=True, batch_size=3) == 4
+        assert mongo_util.files_collection.count_documents({}) == 10
+
+        assert remove_file_ids(mongo_util, iter(file_ids), dry_run=False, batch_size=3) == 4
+        assert mongo_util.files_collection.count_documents({}) == 6
+
+    def test_read_file_ids(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            ids_file_path = os.path.join(tmp_dir_path, "ids.txt")
+            with open(ids_file_path, mode="w") as ids_file:
+                ids_file.write(f"{get_file_id('file0')}\n\nnot a file ID\nabcd\n {get_file_id('file1')} \n")
+
+            assert list(read_file_ids(ids_file_path)) == [get_file_id("file0"), get_file_id("file1")]
+
+    def test_walk_file_ids(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            folder = os.path.join(tmp_dir_path, "folder")
+            os.makedirs(folder)
+            for name in ["a.txt", "b.tmp"]:
+                with open(os.path.join(folder, name), mode="w") as file:
+                    file.write(name)
+
+            # The same file IDs as when the files are processed under the root path
+            file_ids = list(walk_file_ids(folder, tmp_dir_path))
+            assert file_ids == [get_file_id(os.path.join(os.path.sep, "folder", "a.txt"))]
+
+    def test_find_root(self):
+        with mock.patch(
+            "bitrotchecker.src.remove_from_database.get_immutable_paths", return_value=["/data/foo"]
+        ), mock.patch("bitrotchecker.src.remove_from_database.get_mutable_paths", return_value=["/data/foo2"]):
+            assert _find_root("/data/foo") == "/data/foo"
+            assert _find_root("/data/foo/bar") == "/data/foo"
+            # A sibling whose name starts with a configured path is not under it
+            assert _find_root("/data/foo2/bar") == "/data/foo2"
+            assert _find_root("/data/foobar") is None
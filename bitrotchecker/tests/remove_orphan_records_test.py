@@ -0,0 +1,88 @@
+import os
+import tempfile
+from unittest import mock
+
+import mongomock
+import pytest
+
+from bitrotchecker.src.file_record import FileRecord, get_file_id
+from bitrotchecker.src.mongo_util import MongoUtil
+from bitrotchecker.src.remove_orphan_records import (
+    OrphanReport,
+    find_orphans,
+    remove_orphan_records,
+    sort_file_ids,
+)
+
+
+class TestRemoveOrphanRecords:
+    def test_sort_file_ids(self):
+        file_ids = [get_file_id(f"file{i}") for i in range(10)]
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            # Duplicates within and across runs are removed
+            sorted_file_ids = list(sort_file_ids(file_ids + file_ids[:4], tmp_dir_path, run_size=3))
+
+        assert sorted_file_ids == sorted(bytes.fromhex(file_id) for file_id in file_ids)
+
+    def test_find_orphans(self):
+        report = OrphanReport()
+        orphans = list(find_orphans(iter([b"b", b"d", b"e", b"f"]), iter([b"a", b"b", b"c", b"e", b"g"]), report))
+
+        assert orphans == [b"a", b"c", b"g"]
+        assert report == OrphanReport(live_file_ids=4, database_file_ids=5, orphan_file_ids=3)
+
+    def test_remove_orphan_records(self):
+        mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            root = os.path.join(tmp_dir_path, "root")
+            os.makedirs(root)
+            for i in range(5):
+                with open(os.path.join(root, f"file{i}.txt"), mode="w") as file:
+                    file.write("contents")
+
+            # Every live file has two records, and three deleted files have one each
+            file_paths = [os.path.sep + f"file{i}.txt" for i in range(5)]
+            for file_path in file_paths:
+                for modified_time in [1.0, 2.0]:
+                    mongo_util.files_collection.insert_one(
+                        FileRecord(file_path, modified_time, 8, 1).get_mongo_document()
+                    )
+            for i in range(3):
+                deleted_file_path = os.path.sep + f"deleted{i}.txt"
+                mongo_util.files_collection.insert_one(FileRecord(deleted_file_path, 1.0, 8, 1).get_mongo_document())
+
+            report = remove_orphan_records(
+                mongo_util, [root], dry_run=True, run_size=2, temporary_directory=tmp_dir_path
+            )
+            assert report == OrphanReport(live_file_ids=5, database_file_ids=8, orphan_file_ids=3, documents=3)
+            assert mongo_util.files_collection.count_documents({}) == 13
+
+            report = remove_orphan_records(mongo_util, [root], dry_run=False, run_size=2, batch_size=2)
+            assert report.documents == 3
+            assert mongo_util.files_collection.count_documents({}) == 10
+            deleted_file_id = get_file_id(os.path.sep + "deleted0.txt")
+            assert mongo_util.find_documents_by_file_ids([deleted_file_id]) == {deleted_file_id: []}
+
+    def test_unreadable_directory(self):
+        mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            root = os.path.join(tmp_dir_path, "root")
+            os.makedirs(os.path.join(root, "unreadable"))
+            with open(os.path.join(root, "unreadable", "file.txt"), mode="w") as file:
+                file.write("contents")
+            mongo_util.files_collection.insert_one(
+                FileRecord(os.path.join(os.path.sep + "unreadable", "file.txt"), 1.0, 8, 1).get_mongo_document()
+            )
+
+            real_scandir = os.scandir
+
+            def scandir(path):
+                # The temporary directory of the sorted runs is removed with scandir of a file descriptor
+                if isinstance(path, str) and os.path.basename(path) == "unreadable":
+                    raise PermissionError(f"Permission denied: {path}")
+                return real_scandir(path)
+
+            # The record under the directory that could not be listed must not be removed as an orphan
+            with mock.patch("os.scandir", side_effect=scandir), pytest.raises(PermissionError):
+                remove_orphan_records(mongo_util, [root], dry_run=False, temporary_directory=tmp_dir_path)
+            assert mongo_util.files_collection.count_documents({}) == 1
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+
+from bitrotchecker.src.run_metrics import RunMetrics
+
+
+class TestRunMetrics:
+    def test_prometheus_textfile(self):
+        metrics = RunMetrics()
+        metrics.observe("hash", 0.002)
+        metrics.observe("hash", 0.02)
+        metrics.observe("hash", 5000)
+        metrics.increment("bytes_hashed", 100)
+        metrics.increment("bytes_hashed", 50)
+        metrics.increment("files_skipped", reason='quote " here')
+        metrics.set_gauge("last_run_failures", 2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            textfile_path = os.path.join(tmp_dir_path, "bitrotchecker.prom")
+            metrics.write_prometheus_textfile(textfile_path)
+            with open(textfile_path) as textfile:
+                lines = textfile.read().splitlines()
+
+        assert "# TYPE bitrot_phase_duration_seconds histogram" in lines
+        assert 'bitrot_phase_duration_seconds_bucket{phase="hash",le="0.001"} 0' in lines
+        assert 'bitrot_phase_duration_seconds_bucket{phase="hash",le="0.0025"} 1' in lines
+        assert 'bitrot_phase_duration_seconds_bucket{phase="hash",le="0.025"} 2' in lines
+        assert 'bitrot_phase_duration_seconds_bucket{phase="hash",le="1800"} 2' in lines
+        assert 'bitrot_phase_duration_seconds_bucket{phase="hash",le="+Inf"} 3' in lines
+        assert 'bitrot_phase_duration_seconds_count{phase="hash"} 3' in lines
+        assert "# TYPE bitrot_bytes_hashed_total counter" in lines
+        assert "bitrot_bytes_hashed_total 150" in lines
+        assert 'bitrot_files_skipped_total{reason="quote \\" here"} 1' in lines
+        assert "bitrot_last_run_failures 2" in lines
+
+    def test_json_summary(self):
+        metrics = RunMetrics()
+        with metrics.time("db_find"):
+            pass
+        metrics.increment("db_round_trips", operation="find")
+
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            json_path = os.path.join(tmp_dir_path, "metrics.json")
+            metrics.write_json(json_path)
+            with open(json_path) as json_file:
+                summary = json.load(json_file)
+
+        assert summary["phases"][0]["phase"] == "db_find"
+        assert summary["phases"][0]["count"] == 1
+        assert summary["counters"] == [{"name": "db_round_trips", "labels": {"operation": "find"}, "value": 1}]
+        assert metrics.get_counter("db_round_trips", operation="find") == 1
@@ -0,0 +1,32 @@
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from bitrotchecker.src.run_profiler import RunProfiler
+
+
+def _work():
+    return sum(range(1000))
+
+
+class TestRunProfiler:
+    def test_profile_threads(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            profile_file_path = os.path.join(tmp_dir_path, "run.pstats")
+            with RunProfiler(profile_file_path):
+                thread = threading.Thread(target=_work)
+                thread.start()
+                thread.join()
+            assert os.path.getsize(profile_file_path) > 0
+
+    def test_nothing_profiled(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            profile_file_path = os.path.join(tmp_dir_path, "run.pstats")
+            # Another profiling tool being active does not stop the run
+            with mock.patch(
+                "cProfile.Profile.enable", side_effect=ValueError("Another profiling tool is already active")
+            ):
+                with RunProfiler(profile_file_path):
+                    _work()
+            assert not os.path.exists(profile_file_path)
@@ -0,0 +1,117 @@
+import os
+import tempfile
+
+import mongomock
+
+from bitrotchecker.src.constants import CHECKSUM_ALGORITHM_KEY
+from bitrotchecker.src.file_record import FileRecord
+from bitrotchecker.src.mongo_util import MongoUtil
+from bitrotchecker.src.timestamp_fixer import fix_files_in_folder
+
+DATABASE_MODIFIED_TIME_NS = 1600000000123456789
+
+
+class TestTimestampFixer:
+    @staticmethod
+    def _create_file(folder: str, name: str) -> str:
+        file_path = os.path.join(folder, name)
+        with open(file_path, mode="w") as file:
+            file.write(f"contents of {name}")
+        return file_path
+
+    @staticmethod
+    def _insert_record(mongo_util: MongoUtil, prefix: str, file_path: str, modified_time_ns: int, checksum=None):
+        file_record = FileRecord.from_path(file_path.replace(prefix, ""), file_path)
+        document = FileRecord(
+            file_record.file_path,
+            modified_time_ns / 1e9,
+            file_record.size,
+            file_record.checksum if checksum is None else checksum,
+            modified_time_ns=modified_time_ns,
+        ).get_mongo_document()
+        mongo_util.files_collection.insert_one(document)
+
+    def _create_tree(self, prefix: str) -> MongoUtil:
+        folder = os.path.join(prefix, "folder")
+        os.makedirs(folder)
+        mongo_util = MongoUtil(database=mongomock.MongoClient().db, lookup_batch_size=2)
+
+        # A single record with the same size
+        self._insert_record(mongo_util, prefix, self._create_file(folder, "single.txt"), DATABASE_MODIFIED_TIME_NS)
+        # Two records with the same size, told apart by their checksums
+        two_records_path = self._create_file(folder, "two_records.txt")
+        self._insert_record(mongo_util, prefix, two_records_path, DATABASE_MODIFIED_TIME_NS)
+        self._insert_record(mongo_util, prefix, two_records_path, DATABASE_MODIFIED_TIME_NS + 1, checksum=1)
+        # Already matching the database
+        matching_path = self._create_file(folder, "matching.txt")
+        self._insert_record(mongo_util, prefix, matching_path, os.stat(matching_path).st_mtime_ns)
+        # Two records with the same size and checksum
+        ambiguous_path = self._create_file(folder, "ambiguous.txt")
+        self._insert_record(mongo_util, prefix, ambiguous_path, DATABASE_MODIFIED_TIME_NS)
+        self._insert_record(mongo_util, prefix, ambiguous_path, DATABASE_MODIFIED_TIME_NS + 1)
+        # Not in the database
+        self._create_file(folder, "missing.txt")
+        return mongo_util
+
+    def test_fix_files_in_folder(self):
+        with tempfile.TemporaryDirectory() as prefix:
+            mongo_util = self._create_tree(prefix)
+
+            report = fix_files_in_folder(prefix, "folder", mongo_util, verify_checksum=False)
+
+            assert report.fixed == 2
+            assert report.already_matching == 1
+            assert report.ambiguous == 1
+            assert report.no_match == 1
+            # Only the files whose size matches more than one record are hashed
+            assert report.files_hashed == 2
+            for name in ["single.txt", "two_records.txt"]:
+                assert os.stat(os.path.join(prefix, "folder", name)).st_mtime_ns == DATABASE_MODIFIED_TIME_NS
+            assert os.stat(os.path.join(prefix, "folder", "ambiguous.txt")).st_mtime_ns != DATABASE_MODIFIED_TIME_NS
+
+            report = fix_files_in_folder(prefix, "folder", mongo_util, verify_checksum=True)
+            assert report.fixed == 0
+            assert report.already_matching == 3
+            assert report.files_hashed == 4
+
+    def test_dry_run(self):
+        with tempfile.TemporaryDirectory() as prefix:
+            mongo_util = self._create_tree(prefix)
+            single_path = os.path.join(prefix, "folder", "single.txt")
+            modified_time_ns = os.stat(single_path).st_mtime_ns
+
+            report = fix_files_in_folder(prefix, "folder", mongo_util, verify_checksum=False, dry_run=True)
+
+            assert report.fixed == 2
+            assert os.stat(single_path).st_mtime_ns == modified_time_ns
+
+    def test_migrated_modified_time(self):
+        with tempfile.TemporaryDirectory() as prefix:
+            folder = os.path.join(prefix, "folder")
+            os.makedirs(folder)
+            mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+            file_path = self._create_file(folder, "migrated.txt")
+            os.utime(file_path, ns=(DATABASE_MODIFIED_TIME_NS, DATABASE_MODIFIED_TIME_NS))
+            # The record was migrated from a float modified time, so it is a few hundred nanoseconds off
+            legacy_modified_time_ns = FileRecord.from_path(file_path, file_path).legacy_modified_time_ns
+            assert legacy_modified_time_ns != DATABASE_MODIFIED_TIME_NS
+            self._insert_record(mongo_util, prefix, file_path, legacy_modified_time_ns)
+
+            report = fix_files_in_folder(prefix, "folder", mongo_util, verify_checksum=False)
+
+            assert report.already_matching == 1
+            assert report.fixed == 0
+            assert os.stat(file_path).st_mtime_ns == DATABASE_MODIFIED_TIME_NS
+
+    def test_bad_record(self):
+        with tempfile.TemporaryDirectory() as prefix:
+            mongo_util = self._create_tree(prefix)
+            single_path = os.path.join(prefix, "folder", "single.txt")
+            mongo_util.files_collection.update_many({}, {"$set": {CHECKSUM_ALGORITHM_KEY: "unknown"}})
+
+            # A record that cannot be checked is counted as an error instead of stopping the run
+            report = fix_files_in_folder(prefix, "folder", mongo_util, verify_checksum=True)
+
+            assert report.errors == 4
+            assert report.no_match == 1
+            assert os.stat(single_path).st_mtime_ns != DATABASE_MODIFIED_TIME_NS
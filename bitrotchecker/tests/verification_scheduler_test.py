@@ -0,0 +1,119 @@
+import os
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
+from unittest.mock import Mock
+
+import mongomock
+
+from bitrotchecker.src.file_processor import FileProcessor
+from bitrotchecker.src.file_util import walk_files
+from bitrotchecker.src.mongo_util import MongoUtil
+from bitrotchecker.src.recency_util import RecencyUtil
+from bitrotchecker.src.verification_scheduler import VerificationScheduler
+
+
+class TestVerificationScheduler:
+    def test_oldest_verified_first(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            data_path = os.path.join(tmp_dir_path, "data")
+            os.makedirs(data_path)
+            file_paths = []
+            for i in range(6):
+                file_path = os.path.join(data_path, f"file{i}.txt")
+                with open(file_path, mode="wb") as file:
+                    file.write(bytes([i]) * 100)
+                file_paths.append(file_path)
+
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency.sqlite3"))
+            for i in range(6):
+                # File 0 is the most overdue and file 5 was verified most recently
+                recency_util.connection.execute(
+                    "INSERT INTO recency (file_path, processed_time, modified_time) VALUES (?, ?, ?)",
+                    (file_paths[i], 1000.0 + i, os.stat(file_paths[i]).st_mtime),
+                )
+            # File 4 was modified after it was verified, so it counts as never verified
+            recency_util.connection.execute(
+                "UPDATE recency SET modified_time = 1 WHERE file_path = ?", (file_paths[4],)
+            )
+
+            scheduler = VerificationScheduler(recency_util, max_bytes=250)
+            scheduler.add_files(data_path, walk_files(data_path), False)
+            scheduled_paths = [file_entry.path for _, file_entry, _ in scheduler.get_files_to_verify()]
+            assert scheduled_paths == [file_paths[4], file_paths[0]]
+
+            # Verifying the only file without a valid verification leaves no file unverified
+            mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+            file_processor = FileProcessor(recency_util, mongo_util, Mock(), workers_per_device=1)
+            scheduler = VerificationScheduler(recency_util, max_bytes=150)
+            scheduler.add_files(data_path, walk_files(data_path), False)
+            summary = file_processor.process_scheduled_files(scheduler.get_files_to_verify())
+            assert (summary.successes, summary.failures, summary.skips) == (1, 0, 0)
+
+            report = scheduler.get_report()
+            assert "Never verified: 0.00 GiB" in report
+            assert "Every file has been verified at least once" in report
+            recency_util.close()
+
+    def test_bounded_candidates(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            data_path = os.path.join(tmp_dir_path, "data")
+            os.makedirs(data_path)
+            file_paths = []
+            for i in range(20):
+                file_path = os.path.join(data_path, f"file{i:02}.txt")
+                with open(file_path, mode="wb") as file:
+                    file.write(bytes([i]) * 100)
+                file_paths.append(file_path)
+
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency.sqlite3"))
+            # The files are verified from newest to oldest, so the last files found are the most overdue
+            for i, file_path in enumerate(file_paths):
+                recency_util.connection.execute(
+                    "INSERT INTO recency (file_path, processed_time, modified_time) VALUES (?, ?, ?)",
+                    (file_path, 2000.0 - i, os.stat(file_path).st_mtime),
+                )
+
+            scheduler = VerificationScheduler(recency_util, max_bytes=300)
+            with mock.patch("bitrotchecker.src.verification_scheduler.RECENCY_LOOKUP_BATCH_SIZE", 4), mock.patch.object(
+                recency_util, "get_last_processed_times", wraps=recency_util.get_last_processed_times
+            ) as get_last_processed_times:
+                scheduler.add_files(data_path, sorted(walk_files(data_path), key=lambda entry: entry.path), False)
+            # Files are looked up in batches, and only the files that fit in the budget are kept
+            assert get_last_processed_times.call_count == 5
+            assert len(scheduler._candidates) == 3
+            assert scheduler.total_bytes == 2000
+
+            scheduled_paths = [file_entry.path for _, file_entry, _ in scheduler.get_files_to_verify()]
+            assert scheduled_paths == [file_paths[19], file_paths[18], file_paths[17]]
+
+            # With only a time budget, the number of files kept is bounded instead
+            scheduler = VerificationScheduler(recency_util, max_files=2)
+            scheduler.add_files(data_path, walk_files(data_path), False)
+            assert len(scheduler._candidates) == 2
+            scheduled_paths = [file_entry.path for _, file_entry, _ in scheduler.get_files_to_verify()]
+            assert scheduled_paths == [file_paths[19], file_paths[18]]
+            recency_util.close()
+
+    def test_projected_date(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            data_path = os.path.join(tmp_dir_path, "data")
+            os.makedirs(data_path)
+            for i in range(5):
+                with open(os.path.join(data_path, f"file{i}.txt"), mode="wb") as file:
+                    file.write(bytes([i]) * 100)
+
+            recency_util = RecencyUtil(recency_file_path=os.path.join(tmp_dir_path, "recency.sqlite3"))
+            mongo_util = MongoUtil(database=mongomock.MongoClient().db)
+            file_processor = FileProcessor(recency_util, mongo_util, Mock(), workers_per_device=1)
+
+            # Two files are verified this run, leaving three files which take two more runs
+            scheduler = VerificationScheduler(recency_util, max_bytes=200)
+            scheduler.add_files(data_path, walk_files(data_path), False)
+            file_processor.process_scheduled_files(scheduler.get_files_to_verify())
+
+            projected_date = date.today() + timedelta(days=2)
+            assert f"Every file will have been verified at least once by {projected_date.isoformat()}" in (
+                scheduler.get_report()
+            )
+            recency_util.close()